@@ -0,0 +1,66 @@
+"""add reddit corpus tables
+
+Revision ID: 3f2a9c4d7e18
+Revises: 6bfdb667f5f1
+Create Date: 2026-10-17 10:12:41.527310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c4d7e18'
+down_revision: Union[str, None] = '6bfdb667f5f1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('reddit_posts',
+    sa.Column('id', sa.String(length=16), nullable=False),
+    sa.Column('subreddit', sa.String(length=100), nullable=True),
+    sa.Column('title', sa.Text(), nullable=True),
+    sa.Column('author', sa.String(length=100), nullable=True),
+    sa.Column('selftext', sa.Text(), nullable=True),
+    sa.Column('score', sa.Integer(), nullable=True),
+    sa.Column('num_comments', sa.Integer(), nullable=True),
+    sa.Column('permalink', sa.String(length=512), nullable=True),
+    sa.Column('created_utc', sa.Float(), nullable=True),
+    sa.Column('fetched_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_reddit_posts_subreddit'), 'reddit_posts', ['subreddit'], unique=False)
+    op.create_table('reddit_comments',
+    sa.Column('id', sa.String(length=16), nullable=False),
+    sa.Column('post_id', sa.String(length=16), nullable=False),
+    sa.Column('author', sa.String(length=100), nullable=True),
+    sa.Column('body', sa.Text(), nullable=True),
+    sa.Column('score', sa.Integer(), nullable=True),
+    sa.Column('created_utc', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['post_id'], ['reddit_posts.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_reddit_comments_post_id'), 'reddit_comments', ['post_id'], unique=False)
+    op.create_table('session_posts',
+    sa.Column('parameter_history_id', sa.Integer(), nullable=False),
+    sa.Column('reddit_post_id', sa.String(length=16), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['parameter_history_id'], ['parameter_histories.id'], ),
+    sa.ForeignKeyConstraint(['reddit_post_id'], ['reddit_posts.id'], ),
+    sa.PrimaryKeyConstraint('parameter_history_id', 'reddit_post_id')
+    )
+    op.create_index(op.f('ix_session_posts_reddit_post_id'), 'session_posts', ['reddit_post_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_session_posts_reddit_post_id'), table_name='session_posts')
+    op.drop_table('session_posts')
+    op.drop_index(op.f('ix_reddit_comments_post_id'), table_name='reddit_comments')
+    op.drop_table('reddit_comments')
+    op.drop_index(op.f('ix_reddit_posts_subreddit'), table_name='reddit_posts')
+    op.drop_table('reddit_posts')
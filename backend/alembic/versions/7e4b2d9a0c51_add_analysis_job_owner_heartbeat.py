@@ -0,0 +1,32 @@
+"""add analysis job owner and heartbeat
+
+Revision ID: 7e4b2d9a0c51
+Revises: c2f7a8e41b93
+Create Date: 2026-10-17 21:48:19.734052
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7e4b2d9a0c51'
+down_revision: Union[str, None] = 'c2f7a8e41b93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('analysis_jobs', sa.Column('owner_instance', sa.String(length=128), nullable=True))
+    op.add_column('analysis_jobs', sa.Column('heartbeat_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(op.f('ix_analysis_jobs_owner_instance'), 'analysis_jobs', ['owner_instance'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_analysis_jobs_owner_instance'), table_name='analysis_jobs')
+    op.drop_column('analysis_jobs', 'heartbeat_at')
+    op.drop_column('analysis_jobs', 'owner_instance')
@@ -0,0 +1,30 @@
+"""add comment thread columns
+
+Revision ID: 8c1e5b07d2a4
+Revises: 3f2a9c4d7e18
+Create Date: 2026-10-17 11:03:19.804512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1e5b07d2a4'
+down_revision: Union[str, None] = '3f2a9c4d7e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('reddit_comments', sa.Column('parent_id', sa.String(length=20), nullable=True))
+    op.add_column('reddit_comments', sa.Column('depth', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('reddit_comments', 'depth')
+    op.drop_column('reddit_comments', 'parent_id')
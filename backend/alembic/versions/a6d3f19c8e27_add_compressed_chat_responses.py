@@ -0,0 +1,50 @@
+"""add compressed chat history responses
+
+Revision ID: a6d3f19c8e27
+Revises: e81c4f2a9d60
+Create Date: 2026-10-17 19:02:37.815264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import zlib
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6d3f19c8e27'
+down_revision: Union[str, None] = 'e81c4f2a9d60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing rows keep their plain-text response (response_format NULL) and stay readable
+    op.add_column('chat_histories', sa.Column('response_data', sa.LargeBinary(), nullable=True))
+    op.add_column('chat_histories', sa.Column('response_format', sa.String(length=16), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Compressed rows would lose their payload; restore them to plain text first
+    chat_histories = sa.table(
+        'chat_histories',
+        sa.column('id', sa.Integer),
+        sa.column('response', sa.Text),
+        sa.column('response_data', sa.LargeBinary),
+        sa.column('response_format', sa.String),
+    )
+    connection = op.get_bind()
+    rows = connection.execute(
+        sa.select(chat_histories.c.id, chat_histories.c.response_data).where(chat_histories.c.response_format == 'zlib')
+    ).all()
+    for row_id, data in rows:
+        connection.execute(
+            chat_histories.update()
+            .where(chat_histories.c.id == row_id)
+            .values(response=zlib.decompress(data).decode('utf-8'))
+        )
+    op.drop_column('chat_histories', 'response_format')
+    op.drop_column('chat_histories', 'response_data')
@@ -0,0 +1,43 @@
+"""add session_comments link table
+
+Revision ID: c2f7a8e41b93
+Revises: a6d3f19c8e27
+Create Date: 2026-10-17 21:10:54.602318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2f7a8e41b93'
+down_revision: Union[str, None] = 'a6d3f19c8e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('session_comments',
+    sa.Column('parameter_history_id', sa.Integer(), nullable=False),
+    sa.Column('reddit_comment_id', sa.String(length=16), nullable=False),
+    sa.ForeignKeyConstraint(['parameter_history_id'], ['parameter_histories.id'], ),
+    sa.ForeignKeyConstraint(['reddit_comment_id'], ['reddit_comments.id'], ),
+    sa.PrimaryKeyConstraint('parameter_history_id', 'reddit_comment_id')
+    )
+    op.create_index(op.f('ix_session_comments_reddit_comment_id'), 'session_comments', ['reddit_comment_id'], unique=False)
+    # Sessions stored before this table existed keep every stored comment of their posts,
+    # which is what they were read back with until now
+    op.execute(
+        "INSERT INTO session_comments (parameter_history_id, reddit_comment_id) "
+        "SELECT session_posts.parameter_history_id, reddit_comments.id "
+        "FROM session_posts JOIN reddit_comments ON reddit_comments.post_id = session_posts.reddit_post_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_session_comments_reddit_comment_id'), table_name='session_comments')
+    op.drop_table('session_comments')
@@ -0,0 +1,34 @@
+"""add refresh schedule columns
+
+Revision ID: d47a2e9b1c35
+Revises: 8c1e5b07d2a4
+Create Date: 2026-10-17 14:22:41.317205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd47a2e9b1c35'
+down_revision: Union[str, None] = '8c1e5b07d2a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('parameter_histories', sa.Column('refresh_interval_seconds', sa.Integer(), nullable=True))
+    op.add_column('parameter_histories', sa.Column('next_refresh_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('parameter_histories', sa.Column('watermark_utc', sa.Float(), nullable=True))
+    op.create_index(op.f('ix_parameter_histories_next_refresh_at'), 'parameter_histories', ['next_refresh_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_parameter_histories_next_refresh_at'), table_name='parameter_histories')
+    op.drop_column('parameter_histories', 'watermark_utc')
+    op.drop_column('parameter_histories', 'next_refresh_at')
+    op.drop_column('parameter_histories', 'refresh_interval_seconds')
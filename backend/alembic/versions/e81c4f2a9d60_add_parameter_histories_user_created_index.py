@@ -0,0 +1,28 @@
+"""add parameter_histories (user_id, created_at) index
+
+Revision ID: e81c4f2a9d60
+Revises: 5b93f0c6e2a8
+Create Date: 2026-10-17 18:20:41.306517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e81c4f2a9d60'
+down_revision: Union[str, None] = '5b93f0c6e2a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_parameter_histories_user_id_created_at', 'parameter_histories', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_parameter_histories_user_id_created_at', table_name='parameter_histories')
@@ -1,12 +1,94 @@
+import asyncio
+import hashlib
+import json
 import os
-from openai import OpenAI
+import time
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 
+from api.cache import TTLCache, DiskCacheStore
+from api.prompt_packing import pack_reddit_content, chunk_post, count_tokens, truncate_to_tokens, PROMPT_TOKEN_BUDGET, COMMENT_MAX_TOKENS
+
 # Load environment variables
 load_dotenv()
 
-# Initialize OpenAI client
+# Initialize OpenAI clients (the async one serves the websocket pipeline)
 client = OpenAI(api_key=os.getenv("OPENAI_KEY"))
+async_client = AsyncOpenAI(api_key=os.getenv("OPENAI_KEY"))
+
+# --- Analysis Request Settings ---
+ANALYSIS_MODEL = "gpt-4o"  # Using a model with higher context length
+SYSTEM_PROMPT = "You are a helpful assistant that analyzes Reddit discussions and provides concise, accurate summaries of community recommendations and opinions."
+TEMPERATURE = 0.5
+MAX_TOKENS = 800
+FOLLOW_UP_MAX_TOKENS = 500
+
+# --- LLM Result Cache ---
+# Identical prompts (same question over the same corpus) are answered from here instead of OpenAI.
+# Memory only by default; set LLM_CACHE_PATH (e.g. /var/cache/reddit-summary/llm_cache.sqlite3) to
+# also persist answers across restarts in a SQLite file shared by all workers.
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 24 * 3600))  # seconds
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH")  # optional, like REDDIT_CACHE_PATH
+
+# --- Map-Reduce Settings ---
+# Large corpora are summarized chunk by chunk (map), then merged in one final call (reduce).
+MAP_CONCURRENCY = int(os.getenv("MAP_CONCURRENCY", 4))  # map calls in flight at once
+MAP_CHUNK_TOKENS = int(os.getenv("MAP_CHUNK_TOKENS", 3000))  # Reddit content per map call
+MAP_MAX_TOKENS = 300
+MAP_CACHE_TTL = float(os.getenv("MAP_CACHE_TTL", 6 * 3600))  # map summaries are reused by later queries on the same posts
+MAP_REDUCE_DROP_RATIO = float(os.getenv("MAP_REDUCE_DROP_RATIO", 1.0))  # "auto" switches when dropped tokens exceed used tokens by this factor
+MAP_SYSTEM_PROMPT = "You summarize Reddit threads faithfully and concisely, keeping concrete recommendations, reasons, warnings and disagreements."
+
+llm_cache = TTLCache(
+    "llm",
+    max_bytes=LLM_CACHE_MAX_BYTES,
+    default_ttl=LLM_CACHE_TTL,
+    disk_store=DiskCacheStore(LLM_CACHE_PATH) if LLM_CACHE_PATH else None,
+)
+
+def llm_cache_key(model, system_prompt, user_prompt, **sampling):
+    """
+    Content address of a completion request. Unlike make_cache_key, prompts are hashed
+    verbatim: any change to the question or corpus is a different answer.
+    """
+    request = {"model": model, "system": system_prompt, "user": user_prompt, "sampling": sampling}
+    digest = hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+    return f"llm:{digest}"
+
+def build_analysis_request(question, posts_with_comments, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Builds the chat completion arguments for an analysis.
+    
+    Returns:
+        (request, packing_stats): keyword arguments for client.chat.completions.create
+        and the token accounting from pack_reddit_content
+    """
+    # Prepare the content for analysis
+    formatted_content, packing_stats = pack_reddit_content(posts_with_comments, token_budget)
+    
+    # Create the prompt
+    prompt = create_analysis_prompt(question, formatted_content)
+    
+    request = {
+        "model": ANALYSIS_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+    return request, packing_stats
+
+def request_cache_key(request):
+    return llm_cache_key(
+        request["model"],
+        request["messages"][0]["content"],
+        request["messages"][1]["content"],
+        temperature=request["temperature"],
+        max_tokens=request["max_tokens"],
+    )
 
 def analyze_reddit_content(question, posts_with_comments):
     """
@@ -24,22 +106,9 @@ def analyze_reddit_content(question, posts_with_comments):
         return None
         
     try:
-        # Prepare the content for analysis
-        formatted_content = format_reddit_content(posts_with_comments)
-        
-        # Create the prompt
-        prompt = create_analysis_prompt(question, formatted_content)
-        
         # Call OpenAI API
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Using a model with higher context length
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that analyzes Reddit discussions and provides concise, accurate summaries of community recommendations and opinions."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5,
-            max_tokens=800
-        )
+        request, _ = build_analysis_request(question, posts_with_comments)
+        response = client.chat.completions.create(**request)
         
         # Extract and return the analysis
         analysis = response.choices[0].message.content.strip()
@@ -49,30 +118,278 @@ def analyze_reddit_content(question, posts_with_comments):
         print(f"Error during OpenAI analysis: {e}")
         return None
 
-def format_reddit_content(posts_with_comments):
+async def stream_completion(request, on_delta=None):
     """
-    Formats posts and comments into a structured string for the OpenAI prompt.
+    Runs a chat completion with stream=True on the async client.
     
     Args:
-        posts_with_comments: List of post dictionaries with their comments
+        request: Keyword arguments for chat.completions.create
+        on_delta: Optional async callable receiving each text delta as it arrives
         
     Returns:
-        Formatted string containing post and comment content
+        (full_text, time_to_first_token_seconds)
+    """
+    started = time.perf_counter()
+    time_to_first_token = None
+    parts = []
+    stream = await async_client.chat.completions.create(**request, stream=True)
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta:
+            continue
+        if time_to_first_token is None:
+            time_to_first_token = time.perf_counter() - started
+            print(f"OpenAI time to first token: {time_to_first_token:.2f}s")
+        parts.append(delta)
+        if on_delta:
+            await on_delta(delta)
+    print(f"OpenAI completion streamed in {time.perf_counter() - started:.2f}s")
+    return "".join(parts).strip(), time_to_first_token
+
+async def cached_completion(request, on_delta=None):
+    """
+    Streams a completion, answering from llm_cache when the exact request was seen before.
+    A cache hit is forwarded to on_delta as a single delta so callers render it the same way.
+    
+    Returns:
+        {"analysis": str or None, "cached": bool, "time_to_first_token": float or None}
+    """
+    cache_key = request_cache_key(request)
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        print("Serving analysis from the LLM result cache.")
+        if on_delta:
+            await on_delta(cached["analysis"])
+        return {"analysis": cached["analysis"], "cached": True, "time_to_first_token": 0.0}
+
+    if not async_client.api_key:
+        print("Error: OPENAI_API_KEY not found in environment variables.")
+        return {"analysis": None, "cached": False, "time_to_first_token": None}
+
+    try:
+        analysis, time_to_first_token = await stream_completion(request, on_delta)
+    except Exception as e:
+        print(f"Error during OpenAI analysis: {e}")
+        return {"analysis": None, "cached": False, "time_to_first_token": None}
+
+    if analysis:
+        await llm_cache.set(cache_key, {"analysis": analysis, "model": request["model"]})
+    return {"analysis": analysis or None, "cached": False, "time_to_first_token": time_to_first_token}
+
+async def analyze_reddit_content_async(question, posts_with_comments, on_delta=None, token_budget=PROMPT_TOKEN_BUDGET, mode="auto", on_progress=None):
+    """
+    Async, streaming analysis entry point used by process_reddit_query.
+    
+    Args:
+        question: The user's question
+        posts_with_comments: List of post dictionaries, each containing post data and comments
+        on_delta: Optional async callable receiving completion text deltas as they arrive
+        token_budget: Maximum tokens of Reddit content packed into the prompt
+        mode: "single" (one packed prompt), "map_reduce", or "auto" to pick by corpus size
+        on_progress: Optional async callable receiving status strings during map-reduce
+        
+    Returns:
+        {"analysis": str or None, "cached": bool, "time_to_first_token": float or None,
+         "packing": token accounting of the prompt(s) sent (pack_reddit_content's for "single",
+         map/reduce token counts for "map_reduce"), "mode": the mode used}
+    """
+    request, packing_stats = build_analysis_request(question, posts_with_comments, token_budget)
+    if mode == "auto":
+        # Switch to map-reduce when most of the corpus would not fit in a single prompt
+        too_large = packing_stats["tokens_dropped"] > packing_stats["tokens_used"] * MAP_REDUCE_DROP_RATIO
+        mode = "map_reduce" if too_large else "single"
+
+    if mode == "map_reduce":
+        outcome = await analyze_reddit_content_map_reduce(question, posts_with_comments, on_delta, on_progress)
+        outcome.setdefault("packing", None) # Set with the map-reduce figures when the map step ran
+    else:
+        outcome = await cached_completion(request, on_delta)
+        outcome["packing"] = packing_stats
+    outcome["mode"] = mode
+    return outcome
+
+async def summarize_chunk(chunk_text):
+    """
+    Map step: summarizes one chunk of one post, independent of the user's question so
+    the summary can be reused by any later query that sends the same chunk. The cache is
+    keyed on the prompt itself, so a different comment set (deeper fetch, new or edited
+    comments, another MAP_CHUNK_TOKENS) is summarized afresh.
+    
+    Returns:
+        (summary, cached)
+    """
+    map_prompt = create_map_prompt(chunk_text)
+    cache_key = llm_cache_key(
+        ANALYSIS_MODEL, MAP_SYSTEM_PROMPT, map_prompt,
+        temperature=0.2, max_tokens=MAP_MAX_TOKENS,
+    )
+    cached = await llm_cache.get(cache_key)
+    if cached is not None:
+        return cached["analysis"], True
+
+    response = await async_client.chat.completions.create(
+        model=ANALYSIS_MODEL,
+        messages=[
+            {"role": "system", "content": MAP_SYSTEM_PROMPT},
+            {"role": "user", "content": map_prompt}
+        ],
+        temperature=0.2,
+        max_tokens=MAP_MAX_TOKENS,
+    )
+    summary = response.choices[0].message.content.strip()
+    await llm_cache.set(cache_key, {"analysis": summary, "model": ANALYSIS_MODEL}, ttl=MAP_CACHE_TTL)
+    return summary, False
+
+async def analyze_reddit_content_map_reduce(question, posts_with_comments, on_delta=None, on_progress=None):
+    """
+    Map-reduce analysis for corpora too large for one prompt.
+    
+    Map: every post is split into chunks (see chunk_post) that are summarized
+    concurrently, at most MAP_CONCURRENCY at a time. Reduce: the partial summaries are
+    merged into the answer with one streamed call.
+    
+    Args:
+        question: The user's question
+        posts_with_comments: List of post dictionaries, each containing post data and comments
+        on_delta: Optional async callable receiving the reduce step's text deltas
+        on_progress: Optional async callable receiving a status string per finished chunk
+        
+    Returns:
+        Same shape as analyze_reddit_content_async, with map_chunks/map_cached counts
+    """
+    if not async_client.api_key:
+        print("Error: OPENAI_API_KEY not found in environment variables.")
+        return {"analysis": None, "cached": False, "time_to_first_token": None}
+
+    jobs = []
+    for post_idx, post in enumerate(posts_with_comments):
+        chunks = chunk_post(post, MAP_CHUNK_TOKENS)
+        for chunk_index, chunk_text in enumerate(chunks):
+            jobs.append((post_idx, post, chunk_index, len(chunks), chunk_text))
+
+    semaphore = asyncio.Semaphore(MAP_CONCURRENCY)
+    summaries = [None] * len(jobs)
+    completed = 0
+    map_cached = 0
+
+    async def run_map(job_index, job):
+        nonlocal completed, map_cached
+        post_idx, post, chunk_index, chunk_count, chunk_text = job
+        async with semaphore:
+            try:
+                summary, was_cached = await summarize_chunk(chunk_text)
+            except Exception as e:
+                print(f"Map step failed for post {post.get('id')} chunk {chunk_index + 1}: {e}")
+                summary, was_cached = None, False
+        summaries[job_index] = summary
+        completed += 1
+        map_cached += was_cached
+        if on_progress:
+            source = "from cache" if was_cached else "done"
+            await on_progress(f"Summarized part {completed} of {len(jobs)} ('{(post.get('title') or '')[:40]}...', {source}).")
+
+    await asyncio.gather(*(run_map(i, job) for i, job in enumerate(jobs)))
+
+    # Reduce: merge summaries in search order, labelled by post
+    parts = []
+    for (post_idx, post, chunk_index, chunk_count, _), summary in zip(jobs, summaries):
+        if summary:
+            part_label = f" (part {chunk_index + 1}/{chunk_count})" if chunk_count > 1 else ""
+            parts.append(f"\n--- POST {post_idx + 1}: {post.get('title')}{part_label} ---\n{summary}\n")
+    if not parts:
+        return {"analysis": None, "cached": False, "time_to_first_token": None}
+
+    reduce_prompt = create_analysis_prompt(question, "".join(parts))
+    request = {
+        "model": ANALYSIS_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": reduce_prompt}
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+    outcome = await cached_completion(request, on_delta)
+    outcome["map_chunks"] = len(jobs)
+    outcome["map_cached"] = map_cached
+    # Token accounting of what was actually sent (the single packed prompt never is)
+    outcome["packing"] = {
+        "map_chunks": len(jobs),
+        "map_cached": map_cached,
+        "map_tokens": sum(count_tokens(job[4]) for job in jobs),
+        "reduce_prompt_tokens": count_tokens(reduce_prompt),
+    }
+    return outcome
+
+async def answer_follow_up(question, snippets, previous_analysis=None, on_delta=None):
     """
-    formatted_content = ""
+    Answers a follow-up question from the snippets retrieved out of the session index.
+    Only the top-k snippets are sent, so the prompt stays small and nothing is refetched.
     
-    for post_idx, post in enumerate(posts_with_comments, 1):
-        formatted_content += f"\n--- POST {post_idx}: {post['title']} ---\n"
-        formatted_content += f"Post content: {post['selftext'][:500]}...\n" if len(post.get('selftext', '')) > 500 else f"Post content: {post.get('selftext', '')}\n"
+    Args:
+        question: The follow-up question
+        snippets: Snippet dicts from BM25Index.search
+        previous_analysis: The session's analysis text, if known
+        on_delta: Optional async callable receiving completion text deltas
         
-        formatted_content += f"\nTop comments ({len(post['comments'])} total):\n"
+    Returns:
+        Same shape as cached_completion
+    """
+    request = {
+        "model": ANALYSIS_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": create_follow_up_prompt(question, snippets, previous_analysis)}
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": FOLLOW_UP_MAX_TOKENS,
+    }
+    return await cached_completion(request, on_delta)
+
+async def analyze_reddit_update(question, new_posts, previous_analysis=None, on_delta=None, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Updates an earlier analysis with only the posts and comments that appeared since it ran
+    (scheduled refreshes). The delta is packed like a normal corpus, so a quiet interval
+    costs a small prompt instead of a full re-analysis.
+    
+    Args:
+        question: The session's original question
+        new_posts: Post records carrying only their new comments
+        previous_analysis: The latest analysis text for the session, if any
+        on_delta: Optional async callable receiving completion text deltas
+        token_budget: Maximum tokens of new Reddit content packed into the prompt
         
-        # Add up to 5 top comments for each post
-        for comment_idx, comment in enumerate(post['comments'][:5], 1):
-            formatted_content += f"Comment {comment_idx}: {comment['body'][:300]}...\n" if len(comment['body']) > 300 else f"Comment {comment_idx}: {comment['body']}\n"
-            
-        formatted_content += "\n"
+    Returns:
+        Same shape as cached_completion, plus "packing"
+    """
+    formatted_content, packing_stats = pack_reddit_content(new_posts, token_budget)
+    request = {
+        "model": ANALYSIS_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": create_update_prompt(question, formatted_content, previous_analysis)}
+        ],
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+    outcome = await cached_completion(request, on_delta)
+    outcome["packing"] = packing_stats
+    return outcome
+
+def format_reddit_content(posts_with_comments, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Formats posts and comments into a structured string for the OpenAI prompt.
+    
+    Args:
+        posts_with_comments: List of post dictionaries with their comments
+        token_budget: Maximum tokens of Reddit content (see api/prompt_packing.py)
         
+    Returns:
+        Formatted string containing post and comment content
+    """
+    formatted_content, _ = pack_reddit_content(posts_with_comments, token_budget)
     return formatted_content
 
 def create_analysis_prompt(question, formatted_content):
@@ -101,4 +418,73 @@ Could you please help me understand what the Reddit community thinks? I'd love a
 4.  Wrap it up with a short conclusion, highlighting what seem to be the most popular or agreed-upon points.
 
 Please make your response easy to read, perhaps using clear headings or bullet points where it makes sense. I'm looking for a helpful summary, not just a list of data. Thanks!
-"""
\ No newline at end of file
+"""
+
+def create_map_prompt(chunk_text):
+    """
+    Creates the prompt for the map step of map-reduce analysis.
+    
+    Args:
+        chunk_text: One formatted chunk from chunk_post
+        
+    Returns:
+        Complete prompt string
+    """
+    return f"""
+Summarize the following Reddit thread excerpt in at most 8 bullet points. Keep concrete suggestions, the reasons people give for or against them, notable warnings or tips, and where commenters disagree. Mention roughly how strongly supported each point is (comment scores are shown in brackets).
+
+{chunk_text}
+"""
+
+def create_follow_up_prompt(question, snippets, previous_analysis=None):
+    """
+    Creates the prompt for answering a follow-up from retrieved snippets.
+    
+    Args:
+        question: The follow-up question
+        snippets: Snippet dicts from BM25Index.search, best first
+        previous_analysis: The earlier analysis for this session, if any
+        
+    Returns:
+        Complete prompt string
+    """
+    parts = []
+    for snippet_idx, snippet in enumerate(snippets, 1):
+        source = "Post" if snippet.get("kind") == "post" else "Comment"
+        text = truncate_to_tokens(snippet.get("text") or "", COMMENT_MAX_TOKENS)
+        parts.append(f"[{snippet_idx}] {source} on \"{snippet.get('post_title')}\" (score {snippet.get('score') or 0}): {text}\n")
+    excerpts = "".join(parts) or "(No matching excerpts were found.)\n"
+    earlier = f"\nYour earlier summary of these discussions:\n{previous_analysis}\n" if previous_analysis else ""
+
+    return f"""
+We've been chatting about some Reddit discussions.{earlier}
+Here are the excerpts from those discussions most relevant to my follow-up question:
+{excerpts}
+My follow-up question: "{question}"
+
+Please answer using only what these Reddit discussions say, in a friendly, concise way. Refer to excerpts by their [number] when it helps, and say so plainly if the discussions don't cover something.
+"""
+
+def create_update_prompt(question, formatted_content, previous_analysis=None):
+    """
+    Creates the prompt for refreshing an analysis with new Reddit activity.
+    
+    Args:
+        question: The session's original question
+        formatted_content: Formatted new posts and comments only
+        previous_analysis: The earlier analysis for this session, if any
+        
+    Returns:
+        Complete prompt string
+    """
+    earlier = f"\nHere's what you told me last time:\n{previous_analysis}\n" if previous_analysis else ""
+
+    return f"""
+You've been keeping an eye on Reddit for me about this question:
+"{question}"
+{earlier}
+Since then, these new posts and comments have appeared:
+{formatted_content}
+
+Please give me a short update: what's new, whether it confirms or changes your earlier take, and any new tips or warnings worth knowing. Skip anything that just repeats what you already told me, and say so plainly if nothing meaningful has changed.
+"""
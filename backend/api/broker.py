@@ -0,0 +1,167 @@
+import asyncio
+import json
+import os
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # Only needed when BROKER_URL points at Redis
+    aioredis = None
+
+# --- Broker Configuration ---
+BROKER_URL = os.getenv("BROKER_URL", "")  # e.g. redis://localhost:6379/0; empty = single-process broker
+BROKER_CHANNEL = os.getenv("BROKER_CHANNEL", "reddit-summary:events")
+JOB_LOG_TTL = int(os.getenv("BROKER_JOB_LOG_TTL", 3600))  # seconds a chat's frame log stays replayable
+RECONNECT_DELAY = float(os.getenv("BROKER_RECONNECT_DELAY", 1.0))  # seconds between resubscribe attempts
+
+def make_envelope(scope, key, frame, seq=None):
+    """
+    The unit carried by every broker.
+
+    Args:
+        scope: "chat" (frames of one analysis session) or "user" (everything for one user)
+        key: The chat_id or user_id
+        frame: The serialized frame, sent to sockets as-is
+        seq: Position of the frame in the chat's job log, if it belongs to one
+    """
+    return {"scope": scope, "key": key, "seq": seq, "frame": frame}
+
+class InProcessBroker:
+    """
+    Broker for a single worker process: publishing hands the envelope straight to the
+    local delivery function. Job logs live in the JobRunner, so history() is always empty.
+    """
+
+    def __init__(self):
+        self._deliver = None
+
+    async def start(self, deliver):
+        """
+        deliver: async callable taking an envelope (normally ConnectionManager.deliver)
+        """
+        self._deliver = deliver
+
+    async def publish(self, envelope):
+        if self._deliver is not None:
+            await self._deliver(envelope)
+
+    async def publish_to_chat(self, chat_id, frame, seq=None):
+        await self.publish(make_envelope("chat", chat_id, frame, seq))
+
+    async def publish_to_user(self, user_id, frame):
+        await self.publish(make_envelope("user", user_id, frame))
+
+    async def history(self, chat_id):
+        return []
+
+    async def close(self):
+        self._deliver = None
+
+class RedisBroker(InProcessBroker):
+    """
+    Broker shared by every worker and node through Redis pub/sub.
+
+    Each envelope is published once on a single channel that every worker subscribes
+    to; workers then route it to their own sockets through the ConnectionManager indexes,
+    so a worker only pays a dict lookup for events none of its sockets want. Chat frames
+    with a seq are also appended to a per-chat Redis list (expiring after JOB_LOG_TTL),
+    so a socket on another worker than the job's can still be replayed the whole run.
+
+    `client` may be any redis.asyncio-compatible client (a local stand-in in tests);
+    otherwise one is created from `url`.
+    """
+
+    def __init__(self, client=None, url=BROKER_URL, channel=BROKER_CHANNEL, log_ttl=JOB_LOG_TTL, reconnect_delay=RECONNECT_DELAY):
+        super().__init__()
+        if client is None:
+            if aioredis is None:
+                raise RuntimeError("BROKER_URL is set but the 'redis' package is not installed")
+            client = aioredis.from_url(url)
+        self.client = client
+        self.channel = channel
+        self.log_ttl = log_ttl
+        self.reconnect_delay = reconnect_delay
+        self.reconnects = 0
+        self._listener = None
+
+    def _log_key(self, chat_id):
+        return f"{self.channel}:log:{chat_id}"
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        # Runs until close(); a dropped Redis connection is logged and the channel resubscribed
+        while True:
+            try:
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue  # subscribe confirmations etc.
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    try:
+                        await self._deliver(json.loads(data))
+                    except Exception as e:
+                        print(f"Broker: could not deliver event: {e}")
+                raise ConnectionError("subscription ended")
+            except asyncio.CancelledError:
+                try:
+                    await pubsub.unsubscribe(self.channel)
+                except Exception:
+                    pass  # Closing anyway
+                raise
+            except Exception as e:
+                print(f"Broker: lost the subscription to {self.channel} ({e}); resubscribing in {self.reconnect_delay}s")
+            pubsub = await self._resubscribe(pubsub)
+
+    async def _resubscribe(self, broken):
+        try:
+            await (getattr(broken, "aclose", None) or broken.close)()
+        except Exception:
+            pass  # Already unusable
+        while True:
+            await asyncio.sleep(self.reconnect_delay)
+            try:
+                pubsub = self.client.pubsub()
+                await pubsub.subscribe(self.channel)
+            except Exception as e:
+                print(f"Broker: resubscribing to {self.channel} failed: {e}")
+                continue
+            self.reconnects += 1
+            return pubsub
+
+    async def publish(self, envelope):
+        # One round trip per frame: log append, TTL and publish are pipelined
+        pipe = self.client.pipeline(transaction=False)
+        if envelope["scope"] == "chat" and envelope["seq"] is not None:
+            log_key = self._log_key(envelope["key"])
+            pipe.rpush(log_key, envelope["frame"])
+            pipe.expire(log_key, self.log_ttl)
+        pipe.publish(self.channel, json.dumps(envelope))
+        await pipe.execute()
+
+    async def history(self, chat_id):
+        frames = await self.client.lrange(self._log_key(chat_id), 0, -1)
+        return [frame.decode("utf-8") if isinstance(frame, bytes) else frame for frame in frames]
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        await super().close()
+
+def create_broker():
+    """
+    The broker selected by BROKER_URL: Redis when it is a redis:// or rediss:// URL,
+    otherwise the in-process one.
+    """
+    if BROKER_URL.startswith(("redis://", "rediss://")):
+        return RedisBroker(url=BROKER_URL)
+    return InProcessBroker()
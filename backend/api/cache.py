@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# --- Cache Configuration ---
+DISK_CACHE_PURGE_EVERY = int(os.getenv("DISK_CACHE_PURGE_EVERY", 500))  # disk writes between sweeps of expired entries
+
+def make_cache_key(namespace, **params):
+    """
+    Builds a stable key from request parameters.
+
+    Strings are normalized (trimmed, lowercased, whitespace collapsed) so that
+    "Bird Course" and " bird  course" share an entry.
+
+    Args:
+        namespace: Endpoint or cache-user prefix (e.g. "search", "comments")
+        **params: The parameters that identify the request
+
+    Returns:
+        "<namespace>:<sha256 hex>"
+    """
+    normalized = {}
+    for name, value in params.items():
+        if isinstance(value, str):
+            value = " ".join(value.split()).lower()
+        normalized[name] = value
+    digest = hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return f"{namespace}:{digest}"
+
+def _json_default(value):
+    # Objects that know their JSON shape (e.g. corpus records) provide to_dict()
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return str(value)
+
+class DiskCacheStore:
+    """
+    SQLite-backed second tier for TTLCache.
+
+    A single file can be shared by every worker process on the host, and entries
+    survive restarts. Values are stored as JSON text with an absolute expiry time.
+    Expired entries are skipped on read and deleted every `purge_every` writes (and when
+    the store is opened), so the file doesn't grow without bound.
+    """
+
+    def __init__(self, path, purge_every=DISK_CACHE_PURGE_EVERY):
+        self.path = path
+        self.purge_every = purge_every
+        self._writes = 0  # approximate across threads; only paces the purges
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+        self.purge_expired()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared across threads; keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """
+        Returns (expires_at, json_text) or None if missing or expired.
+        """
+        row = self._connection().execute(
+            "SELECT expires_at, value FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[0] <= time.time():
+            return None
+        return row
+
+    def set(self, key, expires_at, json_text):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, expires_at, value) VALUES (?, ?, ?)",
+                (key, expires_at, json_text),
+            )
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.purge_expired()
+
+    def purge_expired(self):
+        """
+        Deletes expired entries. Returns how many were removed.
+        """
+        with self._connection() as conn:
+            return conn.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),)).rowcount
+
+class TTLCache:
+    """
+    In-memory LRU cache with per-entry TTLs, bounded by an approximate byte budget,
+    optionally backed by a DiskCacheStore.
+
+    Entry size is the length of the value's JSON encoding (computed anyway for the
+    disk tier), or the `sizeof` estimate when one is given. Values read back from disk
+    go through `from_json` if given. Memory hits never leave the event loop; disk reads
+    and writes run in a worker thread.
+
+    Cached values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, name, max_bytes, default_ttl, disk_store=None, sizeof=None, from_json=None):
+        self.name = name
+        self.sizeof = sizeof  # optional cheap size estimate, to avoid encoding memory-only entries
+        self.from_json = from_json  # optional hook rebuilding objects from their JSON shape
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.disk_store = disk_store
+        self._entries = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key):
+        """
+        Returns the cached value or None on a miss.
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self._remove(key)
+
+        if self.disk_store is not None:
+            try:
+                row = await asyncio.to_thread(self.disk_store.get, key)
+            except sqlite3.Error as e:
+                print(f"Cache '{self.name}': disk read failed: {e}")
+                row = None
+            if row is not None:
+                expires_at, json_text = row
+                value = json.loads(json_text)
+                if self.from_json is not None:
+                    value = self.from_json(value)
+                self._store(key, expires_at, len(json_text), value)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def set(self, key, value, ttl=None):
+        expires_at = time.time() + (ttl if ttl is not None else self.default_ttl)
+        json_text = None
+        if self.disk_store is not None or self.sizeof is None:
+            json_text = json.dumps(value, default=_json_default)
+        self._store(key, expires_at, self.sizeof(value) if self.sizeof else len(json_text), value)
+        if self.disk_store is not None:
+            try:
+                await asyncio.to_thread(self.disk_store.set, key, expires_at, json_text)
+            except sqlite3.Error as e:
+                print(f"Cache '{self.name}': disk write failed: {e}")
+
+    def invalidate(self, key):
+        self._remove(key)
+
+    def _store(self, key, expires_at, size, value):
+        if size > self.max_bytes:
+            return  # Larger than the whole budget; not worth evicting everything for
+        self._remove(key)
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+        }
@@ -0,0 +1,95 @@
+import asyncio
+
+from api.cache import make_cache_key
+
+class SharedAnalysis:
+    """
+    One in-flight pipeline run and the progress callbacks subscribed to it.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.events = []  # everything broadcast so far, replayed to late subscribers
+        self.task = None
+
+    async def broadcast(self, event):
+        self.events.append(event)
+        subscribers = list(self.subscribers)
+        # Each subscriber gets its own copy: their callbacks stamp their own chat_id on it
+        outcomes = await asyncio.gather(
+            *(callback(_copy_event(event)) for callback in subscribers), return_exceptions=True
+        )
+        for callback, outcome in zip(subscribers, outcomes):
+            if isinstance(outcome, Exception):
+                # Usually a closed websocket; the pipeline keeps going for everyone else
+                print(f"Dropping analysis subscriber after send failure: {outcome}")
+                self._unsubscribe(callback)
+
+    def _unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+
+def _copy_event(event):
+    return dict(event) if isinstance(event, dict) else event
+
+class AnalysisCoalescer:
+    """
+    Deduplicates identical concurrent analyses (single-flight).
+
+    The first request for a given set of parameters starts the pipeline; identical
+    requests that arrive while it is running subscribe to it instead. Every subscriber
+    receives the progress events already sent (replayed) and all later ones through its
+    own progress callback, and gets the same final result, so each websocket still sees
+    a complete run under its own chat_id and writes its own history rows.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> SharedAnalysis
+
+    def key_for(self, **params):
+        return make_cache_key("analysis", **params)
+
+    def is_running(self, key):
+        return key in self._inflight
+
+    async def run(self, key, progress_callback, start):
+        """
+        Runs (or joins) the analysis identified by `key`.
+
+        Args:
+            key: Result of key_for(...) over every parameter that affects the output
+            progress_callback: This subscriber's async callback
+            start: Callable taking the shared progress callback and returning the
+                   pipeline coroutine; only called if no identical run is in flight
+
+        Returns:
+            The pipeline's result (shared between subscribers; treat as read-only)
+        """
+        shared = self._inflight.get(key)
+        if shared is None:
+            shared = SharedAnalysis()
+            self._inflight[key] = shared
+            shared.subscribers.append(progress_callback)
+            shared.task = asyncio.create_task(self._execute(key, shared, start))
+        else:
+            await progress_callback("Someone asked the exact same thing a moment ago, so I'm joining that analysis instead of starting over. 🤝")
+            # Catch up on what was already sent; events may keep arriving while we replay
+            replayed = 0
+            while replayed < len(shared.events):
+                await progress_callback(_copy_event(shared.events[replayed]))
+                replayed += 1
+            shared.subscribers.append(progress_callback)
+
+        try:
+            # shield: one subscriber going away must not cancel the run for the others
+            return await asyncio.shield(shared.task)
+        finally:
+            shared._unsubscribe(progress_callback)
+
+    async def _execute(self, key, shared, start):
+        try:
+            return await start(shared.broadcast)
+        finally:
+            self._inflight.pop(key, None)
+
+analysis_coalescer = AnalysisCoalescer()
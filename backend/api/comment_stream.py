@@ -0,0 +1,103 @@
+import asyncio
+import os
+import time
+
+# --- Batching Configuration ---
+BATCH_WINDOW = float(os.getenv("COMMENT_BATCH_WINDOW", 0.25))  # seconds a comment may wait before being flushed
+BATCH_MIN_SIZE = int(os.getenv("COMMENT_BATCH_MIN_SIZE", 5))
+BATCH_MAX_SIZE = int(os.getenv("COMMENT_BATCH_MAX_SIZE", 200))
+
+def comment_frame_item(post_info, comment_data):
+    """
+    The per-comment payload shared by "comment" frames and "comment_batch" items.
+    Corpus records are converted to their JSON shape here, at the websocket boundary.
+    """
+    return {
+        "post": {
+            "id": post_info.get('id'),
+            "title": post_info.get('title'),
+            "author": post_info.get('author')
+        },
+        "comment": comment_data.to_dict() if hasattr(comment_data, "to_dict") else comment_data
+    }
+
+class CommentBatcher:
+    """
+    Coalesces streamed comments into "comment_batch" frames.
+
+    A batch is flushed when it reaches batch_size or when its oldest comment has waited
+    BATCH_WINDOW seconds. Only one frame is in flight at a time, so while the socket is
+    busy new comments simply accumulate into the next frame. After every send the batch
+    size is re-derived from the measured drain rate (comments per second the socket
+    actually accepted): it is set to what the socket can drain within one window, so a
+    fast client gets large frames (latency is still bounded by the window) and a slow
+    one gets frames small enough that a send never stalls the fetch loop for long.
+
+    Frame format:
+        {"type": "comment_batch", "comments": [{"post": {...}, "comment": {...}}, ...]}
+    """
+
+    def __init__(self, send, window=BATCH_WINDOW, min_size=BATCH_MIN_SIZE, max_size=BATCH_MAX_SIZE):
+        self._send = send  # async callable taking the frame dict (e.g. progress_callback)
+        self.window = window
+        self.min_size = min_size
+        self.max_size = max_size
+        self.batch_size = min_size
+        self._buffer = []
+        self._lock = asyncio.Lock()
+        self._timer = None
+        self._error = None
+        self.frames_sent = 0
+        self.comments_sent = 0
+
+    async def add(self, post_info, comment_data):
+        self._raise_pending_error()
+        self._buffer.append(comment_frame_item(post_info, comment_data))
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        try:
+            await asyncio.sleep(self.window)
+            self._timer = None
+            await self.flush()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            # Surface send failures (e.g. a closed socket) to the next add()/close() caller
+            self._error = e
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            started = time.perf_counter()
+            await self._send({"type": "comment_batch", "comments": batch})
+            elapsed = time.perf_counter() - started
+            self.frames_sent += 1
+            self.comments_sent += len(batch)
+            self._adapt(len(batch), elapsed)
+
+    def _adapt(self, sent, elapsed):
+        # Aim for frames the socket can drain within one window
+        drain_rate = sent / max(elapsed, 1e-4)
+        target = int(drain_rate * self.window)
+        self.batch_size = max(self.min_size, min(self.max_size, target))
+
+    async def close(self):
+        """
+        Flushes whatever is still buffered. Call once the comment stream is finished.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._raise_pending_error()
+        await self.flush()
+
+    def _raise_pending_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
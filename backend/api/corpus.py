@@ -0,0 +1,118 @@
+import sys
+
+def _intern(value):
+    # Authors and parent ids repeat heavily within a thread; keep one copy of each
+    return sys.intern(value) if isinstance(value, str) else value
+
+class _Record:
+    """
+    Base for the compact corpus records.
+
+    Records use __slots__ instead of a per-instance dict, which roughly halves their
+    size for the tens of thousands of comments a deep fetch can produce. They support
+    read-only dict-style access (record['title'], record.get('score')) so code written
+    against the old dict shape keeps working; to_dict() produces the JSON shape and is
+    only called at the websocket and storage boundaries.
+    """
+
+    __slots__ = ()
+
+    def get(self, name, default=None):
+        return getattr(self, name, default) if name in self.__slots__ else default
+
+    def __getitem__(self, name):
+        if name not in self.__slots__:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def __contains__(self, name):
+        return name in self.__slots__
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return f"{type(self).__name__}(id={getattr(self, 'id', None)!r})"
+
+class Comment(_Record):
+    __slots__ = ("id", "author", "body", "score", "created_utc", "parent_id", "depth")
+
+    def __init__(self, id=None, author=None, body=None, score=None, created_utc=None, parent_id=None, depth=0):
+        self.id = id
+        self.author = _intern(author)
+        self.body = body
+        self.score = score
+        self.created_utc = created_utc
+        self.parent_id = _intern(parent_id)
+        self.depth = depth
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data.get(name) for name in cls.__slots__ if name in data})
+
+class Post(_Record):
+    __slots__ = ("id", "title", "author", "selftext", "score", "num_comments", "permalink", "created_utc", "comments")
+
+    def __init__(self, id=None, title=None, author=None, selftext=None, score=None, num_comments=None,
+                 permalink=None, created_utc=None, comments=None):
+        self.id = id
+        self.title = title
+        self.author = _intern(author)
+        self.selftext = selftext
+        self.score = score
+        self.num_comments = num_comments
+        self.permalink = permalink
+        self.created_utc = created_utc
+        self.comments = comments if comments is not None else []
+
+    @classmethod
+    def from_dict(cls, data):
+        post = cls(**{name: data.get(name) for name in cls.__slots__ if name != "comments" and name in data})
+        post.comments = [Comment.from_dict(comment) for comment in data.get("comments", [])]
+        return post
+
+    def with_comments(self, comments):
+        """
+        A copy of this post carrying `comments`; the original (possibly cached) record is left untouched.
+        """
+        post = Post.__new__(Post)
+        for name in self.__slots__:
+            setattr(post, name, getattr(self, name))
+        post.comments = comments
+        return post
+
+    def to_dict(self, include_comments=True):
+        data = {name: getattr(self, name) for name in self.__slots__ if name != "comments"}
+        if include_comments:
+            data["comments"] = [comment.to_dict() for comment in self.comments]
+        return data
+
+def approx_size(value):
+    """
+    Cheap byte estimate of a cached Reddit response, without serializing it.
+    """
+    if isinstance(value, list):
+        return sum(approx_size(item) for item in value) + 8 * len(value)
+    if isinstance(value, Post):
+        return 160 + len(value.title or "") + len(value.selftext or "") + approx_size(value.comments)
+    if isinstance(value, Comment):
+        return 120 + len(value.body or "")
+    return sys.getsizeof(value)
+
+def records_from_json(values):
+    """
+    Rebuilds a cached list of posts or comments from its JSON shape (disk cache tier).
+    """
+    return [Post.from_dict(value) if "title" in value else Comment.from_dict(value) for value in values]
+
+def newest_created_utc(posts_with_comments, default=None):
+    """
+    The latest created_utc among posts and their comments: the watermark for incremental refreshes.
+    """
+    newest = default
+    for post in posts_with_comments:
+        for item in [post, *post.get('comments', [])]:
+            created = item.get('created_utc')
+            if created is not None and (newest is None or created > newest):
+                newest = created
+    return newest
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import os
+import socket
+import time
+import uuid
+
+# --- Job Runner Configuration ---
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", 4))  # analyses running at once; the rest wait in the queue
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_SECONDS", 600))  # finished jobs stay re-attachable this long
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 30))  # how often this worker vouches for its active jobs
+JOB_HEARTBEAT_TIMEOUT = float(os.getenv("JOB_HEARTBEAT_TIMEOUT", 120))  # active jobs unvouched for this long are considered dead
+# Identifies this worker process as the owner of the jobs it runs. Set INSTANCE_ID to a stable
+# per-worker name to have a restarted worker interrupt its own leftover jobs immediately.
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class AnalysisJob:
+    """
+    One submitted analysis: its status and the events it has published.
+
+    Events are the already-serialized frames the client would have received, so a socket
+    that attaches late (or re-attaches after a reload) is replayed the full run. A frame's
+    position in `events` is its seq, which lets sockets skip live copies of frames they
+    were already replayed.
+    """
+
+    def __init__(self, chat_id, user_id, on_event=None):
+        self.chat_id = chat_id  # the session_uuid the client knows the analysis by
+        self.user_id = user_id
+        self.status = "queued"
+        self.events = []
+        self.on_event = on_event  # async callable (chat_id, seq, frame), e.g. a broker publish
+        self.task = None
+        self.result = None
+        self.final_frame = None
+        self.submitted_at = time.monotonic()
+        self.finished_at = None
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    async def publish(self, frame, final=False):
+        """
+        Appends a frame to the job's events and hands it to on_event. A `final` frame (the
+        results) is held until the job has been marked completed and done, so a client that
+        acts on it straight away (e.g. a follow-up) never finds the job still running.
+        """
+        if final:
+            self.final_frame = frame
+            return
+        seq = len(self.events)
+        self.events.append(frame)
+        if self.on_event is not None:
+            try:
+                await self.on_event(self.chat_id, seq, frame)
+            except Exception as e:
+                # Delivery problems must not fail the analysis; the frame stays replayable
+                print(f"Could not publish event {seq} of job {self.chat_id}: {e}")
+
+class JobRunner:
+    """
+    In-process runner for analyses, decoupled from the websocket that submitted them.
+
+    Jobs run as background tasks, at most `max_workers` at a time (the rest wait in FIFO
+    order), so a socket keeps serving other messages and a disconnect or reload does not
+    lose the work. Every published frame goes to `on_event(chat_id, seq, frame)` (the
+    broker, which routes it to the sockets attached to that chat on any worker); a socket
+    that attaches late is first replayed the frames published so far. Status changes are
+    reported to `on_status(chat_id, status, error)` so they can be persisted.
+
+    Once started, `on_heartbeat()` is awaited every `heartbeat_seconds`, so the stored jobs
+    of this instance can be kept alive and those of dead instances found.
+    """
+
+    def __init__(self, max_workers=ANALYSIS_WORKERS, retention_seconds=JOB_RETENTION_SECONDS, on_status=None, on_event=None,
+                 on_heartbeat=None, heartbeat_seconds=JOB_HEARTBEAT_SECONDS):
+        self.max_workers = max_workers
+        self.retention_seconds = retention_seconds
+        self.on_status = on_status
+        self.on_event = on_event
+        self.on_heartbeat = on_heartbeat
+        self.heartbeat_seconds = heartbeat_seconds
+        self._slots = asyncio.Semaphore(max_workers)
+        self._jobs = {}  # chat_id -> AnalysisJob
+        self._heartbeat_task = None
+
+    def start(self):
+        if self._heartbeat_task is None and self.on_heartbeat is not None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self.on_heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Job heartbeat failed: {e}")
+            await asyncio.sleep(self.heartbeat_seconds)
+
+    def submit(self, chat_id, user_id, run):
+        """
+        Queues a job.
+
+        Args:
+            chat_id: Session uuid identifying the job
+            user_id: Owner; only they may attach
+            run: Async callable taking the job's publish function and returning the result
+
+        Returns:
+            The AnalysisJob
+        """
+        self._prune()
+        job = AnalysisJob(chat_id, user_id, self.on_event)
+        self._jobs[chat_id] = job
+        job.task = asyncio.create_task(self._execute(job, run))
+        return job
+
+    async def _execute(self, job, run):
+        try:
+            if self._slots.locked():
+                waiting = self.queue_depth() - 1
+                await job.publish(json.dumps({"status": f"All analysis workers are busy, so yours is queued behind {waiting} other(s). ⏳", "chat_id": job.chat_id}))
+            async with self._slots:
+                await self._set_status(job, "running")
+                job.result = await run(job.publish)
+                await self._set_status(job, "completed")
+            job.finished_at = time.monotonic()
+            if job.final_frame is not None:
+                await job.publish(job.final_frame)
+        except asyncio.CancelledError:
+            await self._set_status(job, "interrupted")
+            raise
+        except Exception as e:
+            print(f"Analysis job {job.chat_id} failed: {e}")
+            await self._set_status(job, "failed", str(e))
+        finally:
+            if job.finished_at is None:
+                job.finished_at = time.monotonic()
+        return job.result
+
+    async def _set_status(self, job, status, error=None):
+        job.status = status
+        if self.on_status is None:
+            return
+        try:
+            await self.on_status(job.chat_id, status, error)
+        except Exception as e:
+            print(f"Could not record status '{status}' for job {job.chat_id}: {e}")
+
+    async def replay(self, chat_id, send):
+        """
+        Sends a job's events published so far to `send`.
+
+        Returns:
+            (job, next_seq), or (None, 0) if the job is not held by this process. The caller
+            should start live delivery at next_seq without awaiting anything in between, so
+            no frame is lost or sent twice.
+        """
+        job = self._jobs.get(chat_id)
+        if job is None:
+            return None, 0
+        # Catch up on what was already published; events may keep arriving while we replay
+        replayed = 0
+        while replayed < len(job.events):
+            await send(job.events[replayed])
+            replayed += 1
+        return job, replayed
+
+    def get(self, chat_id):
+        return self._jobs.get(chat_id)
+
+    def queue_depth(self):
+        return sum(1 for job in self._jobs.values() if job.status == "queued")
+
+    def _prune(self):
+        cutoff = time.monotonic() - self.retention_seconds
+        for chat_id in [chat_id for chat_id, job in self._jobs.items() if job.done and job.finished_at < cutoff]:
+            del self._jobs[chat_id]
+
+    async def shutdown(self):
+        """
+        Cancels running and queued jobs (app shutdown); on_status records them as interrupted.
+        """
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        tasks = [job.task for job in self._jobs.values() if not job.done]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "workers": self.max_workers,
+            "running": sum(1 for job in self._jobs.values() if job.status == "running"),
+            "queued": self.queue_depth(),
+            "retained": len(self._jobs),
+        }
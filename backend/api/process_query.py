@@ -1,25 +1,37 @@
-from api.reddit_fetch import get_access_token, search_subreddit, get_post_content
+from api.reddit_fetch import get_access_token, search_subreddit, get_post_content, get_reddit_client
 import time
 import asyncio
 import json
-from api.ai_analysis import analyze_reddit_content
+import os
+from api.ai_analysis import analyze_reddit_content, analyze_reddit_content_async, analyze_reddit_update
+from api.comment_stream import CommentBatcher, comment_frame_item
+from api.corpus import Post, newest_created_utc
+
+# Maximum number of posts whose comments are fetched from Reddit at the same time
+COMMENT_FETCH_CONCURRENCY = int(os.getenv("COMMENT_FETCH_CONCURRENCY", 5))
 
 # Define a custom exception for analysis errors
 class AnalysisError(Exception):
     pass
 
-async def process_reddit_query(subreddit, keyword, question, limit, repeatHours, repeatMinutes, progress_callback=None, sort_order="hot"):
+async def process_reddit_query(subreddit, keyword, question, limit, repeatHours, repeatMinutes, progress_callback=None, sort_order="hot", comment_concurrency=None, stream_mode="batch", analysis_mode="auto", deep_fetch=False):
     """
     Main function that orchestrates the workflow:
     1. Fetch relevant Reddit posts
     2. Get comments for those posts and send each comment as it's processed
-    3. Analyze the content with OpenAI
+    3. Analyze the content with OpenAI, streaming the answer as analysis_delta messages
     
     Args:
         subreddit: The subreddit to search (e.g., "UofT")
         keyword: The search keyword (e.g., "bird course")
         question: The specific question to analyze (e.g., "What are the easiest bird courses at UofT?")
-        progress_callback: An async function to call with status updates and comments
+        progress_callback: An async function to call with status updates and comments. It also receives
+            one internal {"type": "corpus", "posts": [...]} event with the fetched posts, which the
+            endpoint consumes itself rather than forwarding to the client
+        comment_concurrency: How many posts to fetch comments for at once (defaults to COMMENT_FETCH_CONCURRENCY)
+        stream_mode: "batch" (default) for coalesced comment_batch frames, "comment" for one websocket frame per comment
+        analysis_mode: "single", "map_reduce" or "auto" (map-reduce when the corpus overflows the prompt budget)
+        deep_fetch: Walk full reply trees and expand "more" stubs instead of reading top-level comments only
         
     Returns:
         Analysis results or error message
@@ -30,23 +42,29 @@ async def process_reddit_query(subreddit, keyword, question, limit, repeatHours,
         if progress_callback:
             await progress_callback(message)
             
+    # "batch" mode coalesces comments into comment_batch frames, "comment" sends one frame each
+    comment_batcher = CommentBatcher(progress_callback) if progress_callback and stream_mode == "batch" else None
+
     async def send_comment_data(post_info, comment_data):
         """Send a single comment to the frontend as it's processed"""
-        if progress_callback:
-            data = {
-                "type": "comment",
-                "post": {
-                    "id": post_info.get('id'),
-                    "title": post_info.get('title'),
-                    "author": post_info.get('author')
-                },
-                "comment": comment_data
-            }
+        if comment_batcher:
+            await comment_batcher.add(post_info, comment_data)
+        elif progress_callback:
+            data = {"type": "comment", **comment_frame_item(post_info, comment_data)}
             await progress_callback(data)
 
+    async def send_analysis_delta(delta):
+        """Forward a chunk of the analysis text as the model generates it"""
+        if progress_callback:
+            await progress_callback({"type": "analysis_delta", "delta": delta})
+
+    async def report_rate_limit_wait(queue_depth, wait_seconds):
+        """Let the user know when Reddit's rate limit is holding their request in the queue"""
+        await send_progress_message(f"Reddit is rate limiting us right now: {queue_depth} request(s) queued, waiting about {wait_seconds:.1f}s... ⏳")
+
     await send_progress_message(f"Alright, I'm diving into r/{subreddit} to find posts about '{keyword}' for you! (Sorting by: {sort_order}) 🕵️‍♂️")
-    token = get_access_token()
-    posts = search_subreddit(token, subreddit, keyword, limit, sort_order)
+    reddit = get_reddit_client()
+    posts = await reddit.search_subreddit(subreddit, keyword, limit, sort_order, on_wait=report_rate_limit_wait)
     
     if posts is None:
         return {"error": "Failed to fetch posts from Reddit API"}
@@ -57,45 +75,79 @@ async def process_reddit_query(subreddit, keyword, question, limit, repeatHours,
     
     await send_progress_message(f"Success! Found {len(posts)} relevant post(s) related to '{keyword}' in r/{subreddit}. 🎉")
     
-    # Step 2: Get comments for each post
-    posts_with_comments = []
+    # Step 2: Get comments for each post, several posts at a time
+    concurrency = max(1, min(comment_concurrency or COMMENT_FETCH_CONCURRENCY, len(posts)))
+    semaphore = asyncio.Semaphore(concurrency)
+    await send_progress_message(f"Now gathering comments for {len(posts)} post(s), {concurrency} at a time... 📝")
+
+    async def fetch_comments(index, post):
+        async with semaphore:
+            started = time.perf_counter()
+            raw_comments = await reddit.get_post_content(post['id'], subreddit, on_wait=report_rate_limit_wait, deep=deep_fetch)
+            return index, raw_comments, time.perf_counter() - started
+
+    # Slots keep the final list in search order while comments stream in completion order
+    comments_by_index = [None] * len(posts)
+    fetch_times = {}
     comment_count = 0
-    
-    for i, post in enumerate(posts):
-        await send_progress_message(f"Now gathering comments for post {i+1} of {len(posts)}: '{post['title'][:50]}...' 📝")
-        
-        # Get the comments for this post
-        raw_comments = get_post_content(token, post['id'], subreddit)
-        
-        if raw_comments is not None:
-            # Create a copy of the post to add comments to
-            post_with_comments = post.copy()
-            post_with_comments['comments'] = []
-            
-            # Process each comment individually and send it to the frontend
-            for comment in raw_comments:
-                # Send each comment as it's processed
-                await send_comment_data(post, comment)
+
+    # Real tasks, so the ones still running can be cancelled if streaming fails (e.g. socket closed)
+    fetch_tasks = [asyncio.create_task(fetch_comments(i, post)) for i, post in enumerate(posts)]
+    try:
+        for next_done in asyncio.as_completed(fetch_tasks):
+            i, raw_comments, elapsed = await next_done
+            post = posts[i]
+            fetch_times[post['id']] = round(elapsed, 3)
+
+            if raw_comments is not None:
+                comments_by_index[i] = raw_comments
                 
-                # Add comment to the post_with_comments
-                post_with_comments['comments'].append(comment)
-                comment_count += 1
+                # Send each comment to the frontend as soon as its post is fetched.
+                # Backpressure comes from awaiting the socket send, not a fixed sleep.
+                for comment in raw_comments:
+                    await send_comment_data(post, comment)
                 
-                # Small delay to avoid overwhelming the frontend
-                await asyncio.sleep(0.05)
-            
-            # Add the post with all comments to our list
-            posts_with_comments.append(post_with_comments)
-            await send_progress_message(f"Collected {len(post_with_comments['comments'])} comments for this post. Moving on...")
+                comment_count += len(raw_comments)
+                await send_progress_message(f"Collected {len(raw_comments)} comments for '{post['title'][:50]}...' in {elapsed:.2f}s.")
+    finally:
+        for task in fetch_tasks:
+            if not task.done():
+                task.cancel()
+
+    if comment_batcher:
+        await comment_batcher.close()
+
+    posts_with_comments = []
+    for post, comments in zip(posts, comments_by_index):
+        if comments is not None:
+            # Copy the post record (it may be shared with the response cache) with its comments
+            posts_with_comments.append(post.with_comments(comments))
+
+    fetch_stats = {
+        "concurrency": concurrency,
+        "posts_fetched": len(fetch_times),
+        "avg_fetch_seconds": round(sum(fetch_times.values()) / len(fetch_times), 3) if fetch_times else 0,
+        "max_fetch_seconds": max(fetch_times.values(), default=0),
+        "per_post_seconds": fetch_times,
+    }
+    print(f"Comment fetch stats: {fetch_stats}")
     
     if len(posts_with_comments) == 0:
         await send_progress_message("It seems I couldn't fetch comments for the posts I found. This might be a temporary issue.")
         return {"error": "Failed to fetch comments for any posts"}
     
+    # Hand the corpus to the endpoint (it indexes it for follow-ups); never sent to clients
+    if progress_callback:
+        await progress_callback({"type": "corpus", "posts": posts_with_comments})
+    
     # Step 3: Analyze the content with OpenAI
     await send_progress_message(f"Got all the data! Now, I'm analyzing {len(posts_with_comments)} post(s) and {comment_count} comment(s) to answer your question. This might take a moment... 🤔")
     try:
-        analysis_result = analyze_reddit_content(question, posts_with_comments)
+        analysis_outcome = await analyze_reddit_content_async(
+            question, posts_with_comments,
+            on_delta=send_analysis_delta, mode=analysis_mode, on_progress=send_progress_message
+        )
+        analysis_result = analysis_outcome["analysis"]
         if analysis_result is None: # Or if analyze_reddit_content raises its own error caught below
              await send_progress_message("Analysis resulted in no content.") # Inform user
              # Decide if this should be a hard error or return empty analysis
@@ -111,11 +163,13 @@ async def process_reddit_query(subreddit, keyword, question, limit, repeatHours,
     
     await send_progress_message(f"Done! I've finished analyzing the discussions. Here's what I found: 💡")
     
-    # Step 4: Repeat the process after the specified time
-    if repeatHours > 0 or repeatMinutes > 0:
-        await send_progress_message(f"All set for now! If you wanted this to repeat, I've noted it should run again in {repeatHours}h and {repeatMinutes}m. The next time you connect, I'll look for new info. 🔄")
-        # For this implementation, we don't actually schedule the next run here
-        # as it would block the websocket. Instead, the frontend should reconnect.
+    # Step 4: Repeats are run by the background RefreshScheduler (api/refresh.py), which the
+    # endpoint arms for this session; each refresh only analyzes what's new since this run
+    from api.refresh import refresh_interval_seconds # Imported here: api.refresh imports this module
+    interval_seconds = refresh_interval_seconds(repeatHours, repeatMinutes) # Clamped to MIN_REFRESH_INTERVAL
+    if interval_seconds:
+        interval_hours, interval_minutes = divmod(interval_seconds // 60, 60)
+        await send_progress_message(f"All set for now! I'll check back every {interval_hours}h {interval_minutes}m and add an update to this chat whenever there's something new. 🔄")
     
     # Extract post URLs
     post_urls = []
@@ -133,8 +187,94 @@ async def process_reddit_query(subreddit, keyword, question, limit, repeatHours,
         "num_posts_analyzed": len(posts_with_comments),
         "total_comments": comment_count,
         "analysis": analysis_result,
-        "post_urls": post_urls  # Add the list of URLs
+        "analysis_cached": analysis_outcome["cached"],  # True when answered from the LLM result cache
+        "prompt_packing": analysis_outcome["packing"],  # tokens used/dropped when packing the prompt
+        "analysis_mode": analysis_outcome["mode"],
+        "post_urls": post_urls,  # Add the list of URLs
+        "fetch_stats": fetch_stats
+    }
+
+async def refresh_reddit_query(subreddit, keyword, question, limit, watermark_utc, known_posts, previous_analysis=None, progress_callback=None, comment_concurrency=None, deep_fetch=False):
+    """
+    Incremental re-run of a saved analysis, used by the refresh scheduler.
+
+    Only posts and comments created after watermark_utc are collected: new matching posts
+    come from a "new"-sorted search, new comments from re-reading the session's posts with
+    comments sorted newest first. The delta alone is sent to the LLM together with the
+    previous analysis.
+
+    Args:
+        subreddit, keyword, question, limit: The session's original parameters
+        watermark_utc: Newest created_utc already analyzed for this session
+        known_posts: The session's stored posts (dicts or Post records)
+        previous_analysis: The latest analysis text for the session, if any
+        progress_callback: Optional async callable; receives the internal
+            {"type": "corpus", "posts": [...]} event with the delta posts
+        comment_concurrency: How many posts to re-read at once (defaults to COMMENT_FETCH_CONCURRENCY)
+        deep_fetch: Walk full reply trees, as in process_reddit_query
+
+    Returns:
+        Result dict with the update ("analysis" is None when nothing new was found), the
+        delta counts and the advanced "watermark_utc"
+    """
+    reddit = get_reddit_client()
+    watermark_utc = watermark_utc or 0
+    known_posts = [post if isinstance(post, Post) else Post.from_dict(post) for post in known_posts]
+    known_ids = {post.id for post in known_posts}
+
+    # New posts matching the search, newest first
+    searched = await reddit.search_subreddit(subreddit, keyword, limit, "new")
+    if searched is None:
+        return {"error": "Failed to fetch posts from Reddit API"}
+    new_posts = [post for post in searched if post.id not in known_ids and (post.created_utc or 0) > watermark_utc]
+    new_post_ids = {post.id for post in new_posts}
+
+    # New comments on every post of the session, newest first so the page limit keeps the recent ones
+    candidates = known_posts + new_posts
+    semaphore = asyncio.Semaphore(max(1, comment_concurrency or COMMENT_FETCH_CONCURRENCY))
+
+    async def fetch_new_comments(post):
+        async with semaphore:
+            comments = await reddit.get_post_content(post.id, subreddit, deep=deep_fetch, sort="new")
+        if comments is None:
+            return post, []
+        if post.id in new_post_ids:
+            return post, comments
+        return post, [comment for comment in comments if (comment.created_utc or 0) > watermark_utc]
+
+    delta_posts = []
+    new_comment_count = 0
+    for post, comments in await asyncio.gather(*(fetch_new_comments(post) for post in candidates)):
+        if post.id in new_post_ids or comments:
+            delta_posts.append(post.with_comments(comments))
+            new_comment_count += len(comments)
+
+    result = {
+        "question": question,
+        "subreddit": subreddit,
+        "keyword": keyword,
+        "refresh": True,
+        "new_posts": len(new_posts),
+        "new_comments": new_comment_count,
+        "analysis": None,
+        "watermark_utc": newest_created_utc(delta_posts, default=watermark_utc),
     }
+    if not delta_posts:
+        return result
+
+    if progress_callback:
+        await progress_callback({"type": "corpus", "posts": delta_posts})
+
+    outcome = await analyze_reddit_update(question, delta_posts, previous_analysis)
+    if outcome["analysis"] is None:
+        raise AnalysisError("Failed to get a refresh analysis from AI provider (returned None).")
+    result.update({
+        "analysis": outcome["analysis"],
+        "analysis_cached": outcome["cached"],
+        "prompt_packing": outcome["packing"],
+        "post_urls": [f"https://www.reddit.com{post.permalink}" for post in delta_posts if post.permalink],
+    })
+    return result
 
 # This synchronous version is kept for backward compatibility
 def process_reddit_query_sync(subreddit, keyword, question, limit, repeatHours, repeatMinutes, progress_callback=None, sort_order="hot"):
@@ -166,19 +306,14 @@ def process_reddit_query_sync(subreddit, keyword, question, limit, repeatHours,
         raw_comments = get_post_content(token, post['id'], subreddit)
         
         if raw_comments is not None:
-            # Create a copy of the post to add comments to
-            post_with_comments = post.copy()
-            post_with_comments['comments'] = []
-            
-            # Process each comment individually
-            for comment in raw_comments:
-                # In the sync version, we can't send individual comments in real-time
-                post_with_comments['comments'].append(comment)
-                comment_count += 1
+            # Copy the post record with its comments
+            # (in the sync version, we can't send individual comments in real-time)
+            post_with_comments = post.with_comments(raw_comments)
+            comment_count += len(raw_comments)
             
             # Add the post with all comments to our list
             posts_with_comments.append(post_with_comments)
-            sync_callback(f"Added {len(post_with_comments['comments'])} comments for post {i+1}/{len(posts)}")
+            sync_callback(f"Added {len(post_with_comments.comments)} comments for post {i+1}/{len(posts)}")
     
     if len(posts_with_comments) == 0:
         return {"error": "Failed to fetch comments for any posts"}
@@ -192,10 +327,8 @@ def process_reddit_query_sync(subreddit, keyword, question, limit, repeatHours,
     
     sync_callback(f"Analysis complete")
     
-    # Step 4: Repeat the process after the specified time
-    if repeatHours > 0 or repeatMinutes > 0:
-        time.sleep(repeatHours * 3600 + repeatMinutes * 60)
-        return process_reddit_query_sync(subreddit, keyword, question, limit, repeatHours, repeatMinutes, progress_callback)
+    # Step 4: Repeats are handled by the background RefreshScheduler (api/refresh.py) rather
+    # than by sleeping here and reprocessing everything
     
     # Return the results
     return {
@@ -0,0 +1,177 @@
+import asyncio
+import math
+import os
+import time
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a rough estimate rather than failing the analysis
+    tiktoken = None
+
+# --- Packing Configuration ---
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000))  # tokens of Reddit content per prompt
+SELFTEXT_MAX_TOKENS = int(os.getenv("PROMPT_SELFTEXT_MAX_TOKENS", 150))
+COMMENT_MAX_TOKENS = int(os.getenv("PROMPT_COMMENT_MAX_TOKENS", 200))
+RECENCY_HALF_LIFE_HOURS = float(os.getenv("PROMPT_RECENCY_HALF_LIFE_HOURS", 24 * 7))
+RECENCY_WEIGHT = float(os.getenv("PROMPT_RECENCY_WEIGHT", 2.0))  # how much a brand-new comment is worth, in log-score units
+DEPTH_PENALTY = float(os.getenv("PROMPT_DEPTH_PENALTY", 0.3))  # per reply level, in log-score units
+TOKENIZER_MODEL = "gpt-4o"
+
+_encoding = None
+_encoding_failed = False  # set once loading failed (e.g. no network for tiktoken's download); never retried
+
+def get_encoding():
+    """
+    The tokenizer, or None to use the ~4 characters per token estimate. tiktoken may
+    download its encoding file on first use, so call load_encoding() at startup to do
+    that off the event loop.
+    """
+    global _encoding, _encoding_failed
+    if _encoding is None and not _encoding_failed and tiktoken is not None:
+        try:
+            try:
+                _encoding = tiktoken.encoding_for_model(TOKENIZER_MODEL)
+            except KeyError:
+                _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            _encoding_failed = True
+            print(f"Prompt packing: could not load the tokenizer ({e}); estimating token counts instead.")
+    return _encoding
+
+async def load_encoding():
+    # Loads (and if needed downloads) the tokenizer in a worker thread
+    return await asyncio.to_thread(get_encoding)
+
+def count_tokens(text):
+    encoding = get_encoding()
+    if encoding is None:
+        return max(1, len(text) // 4)  # ~4 characters per token for English text
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cuts text to at most max_tokens tokens, marking the cut with "...".
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        max_chars = max_tokens * 4
+        return text if len(text) <= max_chars else text[:max_chars] + "..."
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + "..."
+
+def rank_comment(comment, now):
+    """
+    Usefulness estimate: log-scaled score plus a bonus that halves every RECENCY_HALF_LIFE_HOURS,
+    minus a small penalty per reply level (deep replies tend to be side conversations).
+    """
+    score = comment.get('score') or 0
+    created = comment.get('created_utc') or 0
+    age_hours = max(0.0, (now - created) / 3600) if created else float("inf")
+    recency = RECENCY_WEIGHT * 0.5 ** (age_hours / RECENCY_HALF_LIFE_HOURS)
+    return math.log1p(max(score, 0)) + recency - DEPTH_PENALTY * (comment.get('depth') or 0)
+
+def pack_reddit_content(posts_with_comments, token_budget=PROMPT_TOKEN_BUDGET):
+    """
+    Packs posts and comments into the prompt corpus under a token budget.
+
+    Post headers (title and a token-capped selftext) go in first, in search order.
+    Comments from all posts are then ranked together by score and recency and added
+    greedily while they fit, so the budget goes to the most useful comments rather
+    than the first few of every post.
+
+    Args:
+        posts_with_comments: List of post dictionaries with their comments
+        token_budget: Maximum number of tokens of formatted content
+
+    Returns:
+        (formatted_content, stats) where stats reports token_budget, tokens_used,
+        tokens_dropped, comments_included and comments_dropped
+    """
+    now = time.time()
+    remaining = token_budget
+    tokens_dropped = 0
+    headers = {}
+
+    for post_idx, post in enumerate(posts_with_comments, 1):
+        selftext = truncate_to_tokens(post.get('selftext') or '', SELFTEXT_MAX_TOKENS)
+        header = (
+            f"\n--- POST {post_idx}: {post.get('title')} ---\nPost content: {selftext}\n"
+            f"\nTop comments ({len(post.get('comments', []))} total, best first):\n"
+        )
+        header_tokens = count_tokens(header + "\n")  # + the blank line closing the post
+        if header_tokens > remaining:
+            tokens_dropped += header_tokens
+            continue
+        headers[post_idx] = header
+        remaining -= header_tokens
+
+    candidates = []
+    for post_idx, post in enumerate(posts_with_comments, 1):
+        for comment in post.get('comments', []):
+            candidates.append((rank_comment(comment, now), post_idx, comment))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+    selected = {}
+    comments_dropped = 0
+    for rank, post_idx, comment in candidates:
+        body = truncate_to_tokens(comment.get('body') or '', COMMENT_MAX_TOKENS)
+        line = f"- [score {comment.get('score') or 0}] {body}\n"
+        line_tokens = count_tokens(line)
+        if post_idx not in headers or line_tokens > remaining:
+            tokens_dropped += line_tokens
+            comments_dropped += 1
+            continue
+        selected.setdefault(post_idx, []).append(line)
+        remaining -= line_tokens
+
+    parts = []
+    for post_idx in range(1, len(posts_with_comments) + 1):
+        if post_idx not in headers:
+            continue
+        parts.append(headers[post_idx])
+        parts.extend(selected.get(post_idx, []))
+        parts.append("\n")
+    formatted_content = "".join(parts)
+
+    stats = {
+        "token_budget": token_budget,
+        "tokens_used": token_budget - remaining,
+        "tokens_dropped": tokens_dropped,
+        "comments_included": sum(len(lines) for lines in selected.values()),
+        "comments_dropped": comments_dropped,
+        "tokenizer": "tiktoken" if get_encoding() is not None else "estimate",
+    }
+    return formatted_content, stats
+
+def chunk_post(post, chunk_budget):
+    """
+    Splits one post into formatted chunks of at most ~chunk_budget tokens for map-reduce.
+
+    Every chunk repeats the post header so it can be summarized on its own; comments
+    keep their original order and are token-capped like in pack_reddit_content.
+
+    Returns:
+        List of formatted chunk strings (at least one, even for posts without comments)
+    """
+    selftext = truncate_to_tokens(post.get('selftext') or '', SELFTEXT_MAX_TOKENS)
+    header = f"--- POST: {post.get('title')} ---\nPost content: {selftext}\n\nComments:\n"
+    header_tokens = count_tokens(header)
+
+    chunks = []
+    lines = []
+    used = header_tokens
+    for comment in post.get('comments', []):
+        body = truncate_to_tokens(comment.get('body') or '', COMMENT_MAX_TOKENS)
+        line = f"- [score {comment.get('score') or 0}] {body}\n"
+        line_tokens = count_tokens(line)
+        if lines and used + line_tokens > chunk_budget:
+            chunks.append(header + "".join(lines))
+            lines = []
+            used = header_tokens
+        lines.append(line)
+        used += line_tokens
+    if lines or not chunks:
+        chunks.append(header + "".join(lines))
+    return chunks
@@ -0,0 +1,124 @@
+import asyncio
+import os
+import time
+
+# --- Rate Limit Configuration ---
+# Reddit allows ~100 OAuth requests per minute per client; start from that until headers say otherwise
+DEFAULT_RATE = float(os.getenv("REDDIT_DEFAULT_RATE", 100 / 60))  # requests per second
+BURST = float(os.getenv("REDDIT_RATE_BURST", 10))  # how many requests may go out back-to-back
+WAIT_REPORT_THRESHOLD = float(os.getenv("REDDIT_RATE_WAIT_REPORT_THRESHOLD", 1.0))  # seconds
+
+class RedditRateLimiter:
+    """
+    Shared request scheduler for every Reddit call in the process.
+
+    A token bucket spreads requests out; its refill rate is re-derived from the
+    X-Ratelimit-Remaining / X-Ratelimit-Reset headers on each response, so the remaining
+    quota is spread evenly over what is left of the reset window. When the quota is
+    exhausted (or Reddit answers 429) the bucket is paused until the window resets.
+
+    Callers queue in FIFO order on acquire() instead of failing. Queue depth and the
+    wait time are passed to an optional on_wait callback so they can be shown to users.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = None
+        self.queue_depth = 0
+        self.remaining = None
+        self.reset_in = None
+        self.total_wait = 0.0
+        self.throttled_requests = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _time_until_token(self):
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self, on_wait=None):
+        """
+        Waits for a request slot.
+
+        Args:
+            on_wait: Optional async callable(queue_depth, wait_seconds), called before
+                     queueing when the caller is expected to wait at least
+                     WAIT_REPORT_THRESHOLD seconds
+
+        Returns:
+            Seconds spent waiting
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        self.queue_depth += 1
+        started = time.monotonic()
+        try:
+            if on_wait:
+                # Reported before queueing: on_wait sends to sockets, and a slow client must
+                # never hold the process-wide lock. Requests ahead of us each need a token.
+                estimate = self._time_until_token() + (self.queue_depth - 1) / self.rate
+                if estimate >= WAIT_REPORT_THRESHOLD:
+                    await on_wait(self.queue_depth, estimate)
+            # asyncio.Lock wakes waiters in FIFO order, which makes it our request queue
+            async with self._lock:
+                while True:
+                    wait = self._time_until_token()
+                    if wait <= 0:
+                        break
+                    await asyncio.sleep(wait)
+                self.tokens -= 1
+        finally:
+            self.queue_depth -= 1
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.total_wait += waited
+            self.throttled_requests += 1
+        return waited
+
+    def update_from_headers(self, headers):
+        """
+        Adjusts the bucket from Reddit's X-Ratelimit-* response headers.
+        """
+        try:
+            remaining = float(headers.get("x-ratelimit-remaining"))
+            reset_in = float(headers.get("x-ratelimit-reset"))
+        except (TypeError, ValueError):
+            return
+        self.remaining = remaining
+        self.reset_in = reset_in
+        self._refill()
+        if remaining < 1:
+            self.pause(reset_in)
+            return
+        # Spread what is left of the quota over the rest of the window
+        self.rate = max(remaining / max(reset_in, 1.0), 0.01)
+        self.tokens = min(self.tokens, remaining)
+
+    def pause(self, seconds):
+        """
+        Holds every queued request for `seconds` (quota exhausted or 429 received).
+        """
+        self._paused_until = max(self._paused_until, time.monotonic() + max(seconds, 0))
+        self.tokens = 0
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "rate_per_second": round(self.rate, 3),
+            "remaining": self.remaining,
+            "reset_in": self.reset_in,
+            "throttled_requests": self.throttled_requests,
+            "total_wait_seconds": round(self.total_wait, 3),
+        }
@@ -1,7 +1,14 @@
 import requests
+import httpx
+import asyncio
+import random
+import time
 import json
 import os
 from dotenv import load_dotenv # Import dotenv
+from api.cache import TTLCache, DiskCacheStore, make_cache_key
+from api.rate_limit import RedditRateLimiter
+from api.corpus import Post, Comment, approx_size, records_from_json
 
 # --- Load Environment Variables ---
 load_dotenv() # Load variables from .env file in the current directory or parent directories
@@ -23,6 +30,32 @@ search_keyword = "exam"  # Example: Replace with user input
 AUTH_URL = "https://www.reddit.com/api/v1/access_token"
 API_BASE_URL = "https://oauth.reddit.com" # Use oauth.reddit.com for authenticated requests
 
+# --- Async HTTP Client Configuration ---
+# Shared by every analysis running in this worker, so connections to reddit.com stay warm
+HTTP_TIMEOUT = float(os.getenv("REDDIT_HTTP_TIMEOUT", 10))  # seconds, per request
+HTTP_CONNECT_TIMEOUT = float(os.getenv("REDDIT_HTTP_CONNECT_TIMEOUT", 5))
+HTTP_MAX_RETRIES = int(os.getenv("REDDIT_HTTP_MAX_RETRIES", 3))
+HTTP_RETRY_BACKOFF = float(os.getenv("REDDIT_HTTP_RETRY_BACKOFF", 0.5))  # base delay, doubled per attempt
+HTTP_MAX_CONNECTIONS = int(os.getenv("REDDIT_HTTP_MAX_CONNECTIONS", 20))
+HTTP_MAX_KEEPALIVE = int(os.getenv("REDDIT_HTTP_MAX_KEEPALIVE", 10))
+RETRYABLE_STATUS_CODES = {500, 502, 503, 504}
+MAX_RATE_LIMITED_RETRIES = int(os.getenv("REDDIT_MAX_RATE_LIMITED_RETRIES", 5))  # 429s tolerated per request
+TOKEN_REFRESH_MARGIN = float(os.getenv("REDDIT_TOKEN_REFRESH_MARGIN", 60))  # refresh this many seconds before expiry
+DEFAULT_TOKEN_LIFETIME = 3600  # Reddit script tokens last an hour when expires_in is missing
+
+# --- Deep Fetch Configuration ---
+# Caps for walking full reply trees (get_post_content(..., deep=True))
+DEEP_FETCH_MAX_DEPTH = int(os.getenv("DEEP_FETCH_MAX_DEPTH", 8))
+DEEP_FETCH_MAX_COMMENTS = int(os.getenv("DEEP_FETCH_MAX_COMMENTS", 2000))
+DEEP_FETCH_TIME_BUDGET = float(os.getenv("DEEP_FETCH_TIME_BUDGET", 15))  # seconds per post
+MORECHILDREN_BATCH = 100  # Reddit's limit on ids per /api/morechildren call
+
+# --- Response Cache Configuration ---
+SEARCH_CACHE_TTL = float(os.getenv("REDDIT_SEARCH_CACHE_TTL", 300))  # seconds
+COMMENTS_CACHE_TTL = float(os.getenv("REDDIT_COMMENTS_CACHE_TTL", 600))
+CACHE_MAX_BYTES = int(os.getenv("REDDIT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_PATH = os.getenv("REDDIT_CACHE_PATH")  # optional SQLite file shared by all workers, e.g. /tmp/reddit_cache.sqlite3
+
 def get_access_token():
     """
     Authenticates with the Reddit API using script credentials
@@ -106,31 +139,7 @@ def search_subreddit(token, subreddit, keyword, limit, sort_order="hot"):
         response.raise_for_status() # Raise an exception for bad status codes
 
         # Parse the JSON response
-        search_results = response.json()
-
-        # Extract the actual post data
-        posts = search_results.get('data', {}).get('children', [])
-
-        if not posts:
-            print("No posts found matching the criteria.")
-            return []
-
-        print(f"Found {len(posts)} posts.")
-        post_list = []
-        for post in posts:
-            post_data = post.get('data', {})
-            post_list.append({
-                'id': post_data.get('id'),
-                'title': post_data.get('title'),
-                'author': post_data.get('author'),
-                'selftext': post_data.get('selftext'),
-                'score': post_data.get('score'),
-                'num_comments': post_data.get('num_comments'),
-                'permalink': post_data.get('permalink'),
-                'created_utc': post_data.get('created_utc')
-            })
-            
-        return post_list
+        return parse_search_results(response.json())
 
     except requests.exceptions.RequestException as e:
         print(f"Error during search request: {e}")
@@ -166,8 +175,58 @@ def get_post_content(token, post_id, subreddit, limit=100):
     
     response = requests.get(comments_url, headers=headers, params=params)
     response.raise_for_status()
+    return parse_comments(response.json())
+
+def parse_search_results(search_results):
+    """
+    Turns a raw search.json listing into the Post records used by the pipeline.
+    Shared by the blocking functions above and RedditClient below.
+    """
+    # Extract the actual post data
+    posts = search_results.get('data', {}).get('children', [])
+
+    if not posts:
+        print("No posts found matching the criteria.")
+        return []
+
+    print(f"Found {len(posts)} posts.")
+    post_list = []
+    for post in posts:
+        post_data = post.get('data', {})
+        post_list.append(Post(
+            id=post_data.get('id'),
+            title=post_data.get('title'),
+            author=post_data.get('author'),
+            selftext=post_data.get('selftext'),
+            score=post_data.get('score'),
+            num_comments=post_data.get('num_comments'),
+            permalink=post_data.get('permalink'),
+            created_utc=post_data.get('created_utc')
+        ))
+
+    return post_list
+
+def comment_from_data(comment_data, depth=0):
+    """
+    The flat comment record used throughout the pipeline (see api/corpus.py). parent_id
+    is Reddit's fullname of the parent ("t3_..." for top-level comments, "t1_..." for replies).
+    """
+    return Comment(
+        id=comment_data.get('id'),
+        author=comment_data.get('author'),
+        body=comment_data.get('body'),
+        score=comment_data.get('score'),
+        created_utc=comment_data.get('created_utc'),
+        parent_id=comment_data.get('parent_id'),
+        depth=comment_data.get('depth', depth)
+    )
+
+def parse_comments(result):
+    """
+    Turns a raw comments/{id}.json response into a list of Comment records.
+    Only top-level comments are read; see walk_comment_tree for the deep-fetch mode.
+    """
     # Reddit returns an array with 2 elements: [0] = post data, [1] = comments
-    result = response.json()
     if len(result) < 2:
         return []
         
@@ -183,14 +242,370 @@ def get_post_content(token, post_id, subreddit, limit=100):
             if comment_data.get('body') in ['[deleted]', '[removed]']:
                 continue
                 
-            comments.append({
-                'author': comment_data.get('author'),
-                'body': comment_data.get('body'),
-                'score': comment_data.get('score'),
-                'created_utc': comment_data.get('created_utc')
-            })
+            comments.append(comment_from_data(comment_data))
             
     return comments
+
+def walk_comment_tree(children, comments, more_stubs, max_depth, max_comments, depth=0):
+    """
+    Flattens a comment listing depth-first, following nested replies.
+
+    Args:
+        children: The "children" of a comment listing (t1 comments and "more" stubs)
+        comments: Output list the flat Comment records are appended to
+        more_stubs: Output list for unresolved "more" stubs (their data dicts)
+        max_depth: Replies deeper than this are ignored
+        max_comments: Stop once this many comments were collected
+        depth: Depth of `children` when the API doesn't say (morechildren results do)
+    """
+    for child in children:
+        if len(comments) >= max_comments:
+            return
+        kind = child.get('kind')
+        child_data = child.get('data', {})
+        child_depth = child_data.get('depth', depth)
+        if child_depth > max_depth:
+            continue
+        if kind == 'more':
+            if child_data.get('children'):
+                more_stubs.append(child_data)
+            continue
+        if kind != 't1':
+            continue
+        # Deleted comments are skipped, but their replies are still worth reading
+        if child_data.get('body') not in ['[deleted]', '[removed]']:
+            comments.append(comment_from_data(child_data, child_depth))
+        replies = child_data.get('replies')
+        if isinstance(replies, dict):
+            walk_comment_tree(replies.get('data', {}).get('children', []), comments, more_stubs,
+                              max_depth, max_comments, child_depth + 1)
+
+def retry_after_seconds(headers, default=10.0):
+    """
+    How long Reddit asked us to back off, from Retry-After or X-Ratelimit-Reset.
+    """
+    for header in ('retry-after', 'x-ratelimit-reset'):
+        try:
+            return float(headers.get(header))
+        except (TypeError, ValueError):
+            continue
+    return default
+
+# --- Async Client ---
+class RedditAuthError(Exception):
+    pass
+
+class TokenManager:
+    """
+    Process-wide cache for the Reddit OAuth token.
+
+    The token is reused until TOKEN_REFRESH_MARGIN seconds before its expires_in.
+    Refreshes are single-flight: when many analyses need a token at the same time,
+    one of them performs the POST and the rest wait for its result.
+    """
+
+    def __init__(self, fetch_token, refresh_margin=TOKEN_REFRESH_MARGIN):
+        self._fetch_token = fetch_token  # async callable returning the token payload
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = None
+
+    def _is_fresh(self):
+        return self._token is not None and time.monotonic() < self._expires_at
+
+    async def get_token(self):
+        if self._is_fresh():
+            return self._token
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            # Another coroutine may have refreshed while we were waiting for the lock
+            if self._is_fresh():
+                return self._token
+            token_data = await self._fetch_token()
+            if not token_data:
+                return None
+            expires_in = float(token_data.get('expires_in') or DEFAULT_TOKEN_LIFETIME)
+            self._token = token_data['access_token']
+            self._expires_at = time.monotonic() + max(expires_in - self.refresh_margin, 0)
+            return self._token
+
+    def invalidate(self, token=None):
+        """
+        Drops the cached token. Passing the rejected token makes concurrent 401s
+        on the same stale token cause a single refresh rather than one each.
+        """
+        if token is None or token == self._token:
+            self._token = None
+            self._expires_at = 0.0
+
+class RedditClient:
+    """
+    Non-blocking Reddit API client built on a shared httpx.AsyncClient.
+
+    One instance is meant to live for the whole process (see get_reddit_client) so
+    every websocket analysis reuses the same keep-alive connection pool instead of
+    opening a new TLS connection per request. Transient failures (network errors and
+    5xx responses) are retried with exponential backoff. Search and comment responses
+    are cached (see api/cache.py), so repeated queries skip the network entirely.
+    """
+
+    def __init__(self, timeout=HTTP_TIMEOUT, connect_timeout=HTTP_CONNECT_TIMEOUT,
+                 max_retries=HTTP_MAX_RETRIES, retry_backoff=HTTP_RETRY_BACKOFF,
+                 max_connections=HTTP_MAX_CONNECTIONS, max_keepalive=HTTP_MAX_KEEPALIVE):
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._http = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            headers={'User-Agent': USER_AGENT or "reddit-post-summary"},
+        )
+        self.tokens = TokenManager(self.fetch_token)
+        self.rate_limiter = RedditRateLimiter()
+        self.cache = TTLCache(
+            "reddit",
+            max_bytes=CACHE_MAX_BYTES,
+            default_ttl=SEARCH_CACHE_TTL,
+            disk_store=DiskCacheStore(CACHE_PATH) if CACHE_PATH else None,
+            sizeof=approx_size,
+            from_json=records_from_json,
+        )
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    async def _request(self, method, url, on_wait=None, **kwargs):
+        """
+        Sends a request through the shared rate limiter, retrying network errors and
+        5xx responses. A 429 pauses the limiter until Reddit's window resets and the
+        request is queued again rather than failed.
+
+        Args:
+            on_wait: Optional async callable(queue_depth, wait_seconds) for rate-limit waits
+
+        Returns:
+            The httpx.Response of the last attempt (raise_for_status already applied)
+        """
+        attempt = 0
+        throttled = 0
+        while True:
+            await self.rate_limiter.acquire(on_wait)
+            try:
+                response = await self._http.request(method, url, **kwargs)
+                self.rate_limiter.update_from_headers(response.headers)
+                if response.status_code == 429 and throttled < MAX_RATE_LIMITED_RETRIES:
+                    throttled += 1
+                    retry_after = retry_after_seconds(response.headers)
+                    print(f"Reddit rate limit hit (429) for {url}, requeueing in {retry_after:.1f}s...")
+                    self.rate_limiter.pause(retry_after)
+                    continue
+                if response.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    print(f"Reddit returned {response.status_code} for {url}, retrying...")
+                else:
+                    response.raise_for_status()
+                    return response
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries:
+                    raise
+                print(f"Network error talking to Reddit ({e!r}), retrying...")
+            attempt += 1
+            # Exponential backoff with a little jitter so concurrent retries don't line up
+            await asyncio.sleep(self.retry_backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.1))
+
+    async def fetch_token(self):
+        """
+        Performs the password-grant POST against AUTH_URL.
+
+        Returns:
+            The token payload ({"access_token": ..., "expires_in": ...}) or None on failure
+        """
+        try:
+            data = {
+                'grant_type': 'password',
+                'username': REDDIT_USERNAME,
+                'password': REDDIT_PASSWORD
+            }
+            response = await self._request("POST", AUTH_URL, auth=(CLIENT_ID, CLIENT_SECRET), data=data)
+            token_data = response.json()
+
+            if not token_data.get('access_token'):
+                print("Error: Could not retrieve access token from response.")
+                print("Response:", token_data)
+                return None
+
+            print("Access token obtained successfully.")
+            return token_data
+
+        except httpx.HTTPStatusError as e:
+            print(f"Error during authentication request: {e}")
+            print(f"Response status code: {e.response.status_code}")
+            print(f"Response content: {e.response.text}")
+            return None
+        except Exception as e:
+            print(f"An unexpected error occurred during authentication: {e}")
+            return None
+
+    async def get_access_token(self):
+        """
+        Async equivalent of get_access_token(), served from the shared token cache.
+        """
+        return await self.tokens.get_token()
+
+    async def _authorized_get(self, url, params, on_wait=None):
+        """
+        GETs an oauth.reddit.com endpoint with the cached token.
+        A 401 means the token was revoked or expired early: refresh once and retry.
+        """
+        for attempt in range(2):
+            token = await self.tokens.get_token()
+            if not token:
+                raise RedditAuthError("Could not obtain a Reddit access token")
+            try:
+                return await self._request(
+                    "GET", url, on_wait=on_wait, headers={'Authorization': f"bearer {token}"}, params=params
+                )
+            except httpx.HTTPStatusError as e:
+                if e.response.status_code != 401 or attempt == 1:
+                    raise
+                print("Reddit rejected the access token (401), refreshing...")
+                self.tokens.invalidate(token)
+
+    async def search_subreddit(self, subreddit, keyword, limit, sort_order="hot", on_wait=None):
+        """
+        Async equivalent of search_subreddit(). Returns None on failure, [] when nothing matched.
+        on_wait is passed to the rate limiter (see _request).
+        """
+        cache_key = make_cache_key("search", subreddit=subreddit, keyword=keyword, sort=sort_order, limit=int(limit))
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            print(f"\nServing r/{subreddit} search for '{keyword}' ({sort_order}) from cache.")
+            return cached
+
+        print(f"\nSearching r/{subreddit} for keyword '{keyword}', sorting by '{sort_order}'...")
+        try:
+            response = await self._authorized_get(
+                f"{API_BASE_URL}/r/{subreddit}/search.json",
+                params={'q': keyword, 'restrict_sr': 'true', 'sort': sort_order, 'limit': limit},
+                on_wait=on_wait,
+            )
+            posts = parse_search_results(response.json())
+            await self.cache.set(cache_key, posts, ttl=SEARCH_CACHE_TTL)
+            return posts
+
+        except RedditAuthError as e:
+            print(f"Error: {e}")
+            return None
+        except httpx.HTTPStatusError as e:
+            print(f"Error during search request: {e}")
+            print(f"Response status code: {e.response.status_code}")
+            print(f"Response content: {e.response.text}")
+            return None
+        except Exception as e:
+            print(f"An unexpected error occurred during search: {e}")
+            return None
+
+    async def get_post_content(self, post_id, subreddit, limit=100, on_wait=None, deep=False, sort=None):
+        """
+        Async equivalent of get_post_content(). Returns None if the comments could not be fetched.
+        on_wait is passed to the rate limiter (see _request). sort (e.g. "new") overrides
+        Reddit's default comment order, which decides which comments fall within limit.
+
+        With deep=True the whole reply tree is walked and "more" stubs are expanded with
+        batched /api/morechildren calls, within the DEEP_FETCH_* depth, count and time caps.
+        Every comment carries parent_id and depth either way.
+        """
+        cache_key = make_cache_key("comments", subreddit=subreddit, post_id=post_id, limit=int(limit), deep=deep, sort=sort)
+        cached = await self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        try:
+            if deep:
+                comments = await self._get_comment_tree(post_id, subreddit, limit, on_wait, sort=sort)
+            else:
+                response = await self._authorized_get(
+                    f"{API_BASE_URL}/r/{subreddit}/comments/{post_id}.json",
+                    params={'limit': limit, **({'sort': sort} if sort else {})},
+                    on_wait=on_wait,
+                )
+                comments = parse_comments(response.json())
+            await self.cache.set(cache_key, comments, ttl=COMMENTS_CACHE_TTL)
+            return comments
+
+        except Exception as e:
+            print(f"Error fetching comments for post {post_id}: {e}")
+            return None
+
+    async def _get_comment_tree(self, post_id, subreddit, limit, on_wait=None,
+                                max_depth=DEEP_FETCH_MAX_DEPTH, max_comments=DEEP_FETCH_MAX_COMMENTS,
+                                time_budget=DEEP_FETCH_TIME_BUDGET, sort=None):
+        """
+        Fetches a post's comment tree and resolves "more" stubs breadth-first.
+
+        Returns:
+            Flat list of Comment records in thread order (replies follow their parent
+            within each fetched page), capped by depth, count and time budget
+        """
+        deadline = time.monotonic() + time_budget
+        response = await self._authorized_get(
+            f"{API_BASE_URL}/r/{subreddit}/comments/{post_id}.json",
+            params={'limit': limit, 'depth': max_depth + 1, **({'sort': sort} if sort else {})},
+            on_wait=on_wait,
+        )
+        result = response.json()
+        comments = []
+        more_stubs = []
+        if len(result) >= 2:
+            walk_comment_tree(result[1].get('data', {}).get('children', []), comments, more_stubs, max_depth, max_comments)
+
+        pending_ids = [child_id for stub in more_stubs for child_id in stub['children']]
+        requests_made = 0
+        while pending_ids and len(comments) < max_comments and time.monotonic() < deadline:
+            batch, pending_ids = pending_ids[:MORECHILDREN_BATCH], pending_ids[MORECHILDREN_BATCH:]
+            response = await self._authorized_get(
+                f"{API_BASE_URL}/api/morechildren",
+                params={
+                    'api_type': 'json',
+                    'link_id': f"t3_{post_id}",
+                    'children': ",".join(batch),
+                    'limit_children': 'false',
+                    **({'sort': sort} if sort else {}),
+                },
+                on_wait=on_wait,
+            )
+            requests_made += 1
+            # morechildren returns a flat list of things, each with its own depth and parent_id
+            things = response.json().get('json', {}).get('data', {}).get('things', [])
+            new_stubs = []
+            walk_comment_tree(things, comments, new_stubs, max_depth, max_comments)
+            pending_ids.extend(child_id for stub in new_stubs for child_id in stub['children'])
+
+        if pending_ids:
+            print(f"Deep fetch for post {post_id} stopped with {len(pending_ids)} comment(s) unexpanded "
+                  f"({len(comments)} collected, {requests_made} morechildren call(s)).")
+        return comments
+
+_reddit_client = None
+
+def get_reddit_client():
+    """
+    Returns the process-wide RedditClient, creating it on first use.
+    """
+    global _reddit_client
+    if _reddit_client is None:
+        _reddit_client = RedditClient()
+    return _reddit_client
+
+async def close_reddit_client():
+    """
+    Closes the shared client's connection pool (called on app shutdown).
+    """
+    global _reddit_client
+    if _reddit_client is not None:
+        await _reddit_client.aclose()
+        _reddit_client = None
+
 # --- Main Execution ---
 if __name__ == "__main__":
     access_token = get_access_token()
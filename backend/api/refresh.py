@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+
+import crud
+from database import run_db
+from history_writer import history_writer
+from api import wire
+from api.process_query import refresh_reddit_query
+from api.session_index import session_indexes
+
+# --- Scheduler Configuration ---
+REFRESH_POLL_SECONDS = float(os.getenv("REFRESH_POLL_SECONDS", 30))  # how often due sessions are looked up
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", 10))  # due sessions picked up per poll
+MIN_REFRESH_INTERVAL = int(os.getenv("MIN_REFRESH_INTERVAL_SECONDS", 300))  # floor for repeatHours/repeatMinutes
+
+def refresh_interval_seconds(repeat_hours, repeat_minutes):
+    """
+    Converts the repeatHours/repeatMinutes parameters to a schedule interval, or None if the
+    analysis should not repeat. Intervals are clamped to MIN_REFRESH_INTERVAL.
+    """
+    seconds = int(repeat_hours or 0) * 3600 + int(repeat_minutes or 0) * 60
+    if seconds <= 0:
+        return None
+    return max(seconds, MIN_REFRESH_INTERVAL)
+
+def _load_refresh_context(db, parameter_history):
+    # Everything a refresh reads up front, in one short-lived session
+    stored_posts = crud.get_session_corpus(db, parameter_history_id=parameter_history.id)
+    previous_analysis = crud.get_latest_session_analysis(db, parameter_history.session_uuid)
+    return stored_posts, previous_analysis
+
+class RefreshScheduler:
+    """
+    Background task running the scheduled refreshes of saved analyses.
+
+    Every REFRESH_POLL_SECONDS it loads the sessions whose next_refresh_at has passed,
+    claims each one (so several worker processes never refresh the same session twice)
+    and runs refresh_reddit_query with the session's watermark. Each update is appended
+    to the session's ChatHistory, its delta corpus is stored, and on_refreshed (if given)
+    is awaited with (user_id, session_uuid, results_json) so connected clients can be told.
+    Database work goes through run_db, one short-lived session per step.
+    """
+
+    def __init__(self, on_refreshed=None, poll_seconds=REFRESH_POLL_SECONDS, batch_size=REFRESH_BATCH_SIZE):
+        self.on_refreshed = on_refreshed
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self._task = None
+        self.refreshes_run = 0
+        self.refreshes_empty = 0  # refreshes that found nothing new and skipped the LLM
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Refresh scheduler: poll failed: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    async def run_due(self):
+        """
+        Runs every refresh that is currently due (one batch). Returns how many were run.
+        """
+        ran = 0
+        for parameter_history in await run_db(crud.get_due_session_refreshes, limit=self.batch_size):
+            if not await run_db(crud.claim_session_refresh, parameter_history):
+                continue  # Another worker got there first
+            try:
+                await self.refresh_session(parameter_history)
+                ran += 1
+            except Exception as e:
+                print(f"Refresh scheduler: session {parameter_history.session_uuid} failed: {e}")
+        return ran
+
+    async def refresh_session(self, parameter_history):
+        params = json.loads(parameter_history.parameters or "{}")
+        await history_writer.sync(session_uuid=parameter_history.session_uuid)  # see the latest queued update
+        stored_posts, previous_analysis = await run_db(_load_refresh_context, parameter_history)
+
+        async def store_delta(event):
+            # Only the internal corpus event is of interest; there is no client to stream to
+            if isinstance(event, dict) and event.get("type") == "corpus":
+                # The delta also carries already-stored posts that got new comments; only the others get positions
+                await run_db(
+                    crud.save_session_corpus, parameter_history.id, params.get("subreddit"), event["posts"],
+                    start_position=len(stored_posts), linked_post_ids={post["id"] for post in stored_posts},
+                )
+
+        results = await refresh_reddit_query(
+            params.get("subreddit"),
+            params.get("keyword"),
+            params.get("question"),
+            params.get("limit", 10),
+            parameter_history.watermark_utc,
+            stored_posts,
+            previous_analysis=previous_analysis,
+            progress_callback=store_delta,
+            deep_fetch=params.get("deep_fetch", False),
+        )
+        if results.get("error"):
+            print(f"Refresh scheduler: session {parameter_history.session_uuid}: {results['error']}")
+            return
+
+        self.refreshes_run += 1
+        await run_db(crud.advance_session_watermark, parameter_history.id, results["watermark_utc"])
+        if results["analysis"] is None:
+            self.refreshes_empty += 1
+            return
+
+        results_json = wire.dumps(results)  # Encoded once, for storage and the notification
+        history_writer.add_chat_history(
+            parameter_history.user_id,
+            f"Scheduled update: {parameter_history.title}",
+            results_json,
+            session_uuid=parameter_history.session_uuid,
+        )
+        # The in-memory follow-up index no longer covers the whole corpus; rebuild it on next use
+        session_indexes.discard(parameter_history.session_uuid)
+        print(f"Refresh scheduler: session {parameter_history.session_uuid} updated with "
+              f"{results['new_posts']} new post(s) and {results['new_comments']} new comment(s).")
+        if self.on_refreshed is not None:
+            await self.on_refreshed(parameter_history.user_id, parameter_history.session_uuid, results_json)
+
+    def stats(self):
+        return {
+            "running": self._task is not None,
+            "refreshes_run": self.refreshes_run,
+            "refreshes_empty": self.refreshes_empty,
+        }
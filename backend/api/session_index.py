@@ -0,0 +1,118 @@
+import asyncio
+import heapq
+import math
+import os
+import re
+from collections import OrderedDict
+
+# --- Index Configuration ---
+MAX_INDEXED_SESSIONS = int(os.getenv("MAX_INDEXED_SESSIONS", 200))  # LRU bound across sessions
+FOLLOW_UP_TOP_K = int(os.getenv("FOLLOW_UP_TOP_K", 8))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+_STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i if in is it its of on or so that the their them they
+this to was were what when where which who why will with would you your do does did can could should
+""".split())
+
+def tokenize(text):
+    return [token for token in _TOKEN_PATTERN.findall((text or "").lower()) if token not in _STOPWORDS]
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 ranking over one session's corpus.
+
+    Every post (title + selftext) and every comment is a document. Postings map
+    term -> [(doc_id, term_frequency)], so a query only touches documents that share
+    at least one term with it.
+    """
+
+    def __init__(self, posts_with_comments):
+        self.documents = []  # snippet dicts returned by search()
+        self.postings = {}
+        self.doc_lengths = []
+        self.analysis = None  # latest analysis text, given to the LLM as context for follow-ups
+
+        for post in posts_with_comments:
+            post_meta = {
+                "post_id": post.get('id'),
+                "post_title": post.get('title'),
+                "permalink": post.get('permalink'),
+            }
+            self._add(f"{post.get('title') or ''}\n{post.get('selftext') or ''}", {"kind": "post", "score": post.get('score'), **post_meta})
+            for comment in post.get('comments', []):
+                self._add(comment.get('body'), {"kind": "comment", "score": comment.get('score'), "author": comment.get('author'), **post_meta})
+
+        self.average_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def _add(self, text, meta):
+        tokens = tokenize(text)
+        if not tokens:
+            return
+        doc_id = len(self.documents)
+        self.documents.append({"text": text, **meta})
+        self.doc_lengths.append(len(tokens))
+        frequencies = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, frequency in frequencies.items():
+            self.postings.setdefault(token, []).append((doc_id, frequency))
+
+    def search(self, query, k=FOLLOW_UP_TOP_K):
+        """
+        Returns the top-k snippet dicts for the query, best first, each with a "relevance" score.
+        """
+        total_docs = len(self.documents)
+        if not total_docs:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings:
+                length_norm = 1 - BM25_B + BM25_B * self.doc_lengths[doc_id] / self.average_length
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [{**self.documents[doc_id], "relevance": round(score, 3)} for doc_id, score in best]
+
+class SessionIndexStore:
+    """
+    Per-session BM25 indexes kept in memory, evicting the least recently used session.
+    """
+
+    def __init__(self, max_sessions=MAX_INDEXED_SESSIONS):
+        self.max_sessions = max_sessions
+        self._indexes = OrderedDict()
+
+    def put(self, session_id, posts_with_comments):
+        return self._insert(session_id, BM25Index(posts_with_comments))
+
+    async def build(self, session_id, posts_with_comments):
+        """
+        Like put(), but builds the index in a worker thread: large (deep-fetched) corpora
+        take long enough to tokenize that doing it on the event loop would stall every socket.
+        """
+        index = await asyncio.to_thread(BM25Index, posts_with_comments)
+        return self._insert(session_id, index)
+
+    def _insert(self, session_id, index):
+        self._indexes[session_id] = index
+        self._indexes.move_to_end(session_id)
+        while len(self._indexes) > self.max_sessions:
+            self._indexes.popitem(last=False)
+        return index
+
+    def get(self, session_id):
+        index = self._indexes.get(session_id)
+        if index is not None:
+            self._indexes.move_to_end(session_id)
+        return index
+
+    def discard(self, session_id):
+        self._indexes.pop(session_id, None)
+
+session_indexes = SessionIndexStore()
@@ -0,0 +1,91 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # Falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # The msgpack protocol is only offered when installed
+    msgpack = None
+
+# --- Wire Protocol Configuration ---
+DEFAULT_PROTOCOL = "json"
+
+def supported_protocols():
+    """
+    Protocols /ws/query can speak, in order of preference.
+
+    "json": text frames, as before (encoded with orjson when available)
+    "msgpack": binary MessagePack frames, same shapes as the JSON ones
+    """
+    return ["msgpack", "json"] if msgpack is not None else ["json"]
+
+def negotiate(websocket):
+    """
+    Picks the protocol for a connection, from the Sec-WebSocket-Protocol offers (a
+    browser client passes them as `new WebSocket(url, ["msgpack", "json"])`) or else a
+    `protocol` query parameter.
+
+    Returns:
+        (protocol, subprotocol): subprotocol is what to pass to accept(), i.e. the
+        chosen offer if the client made offers, otherwise None.
+    """
+    offered = websocket.scope.get("subprotocols") or []
+    for name in offered:
+        if name in supported_protocols():
+            return name, name
+    requested = websocket.query_params.get("protocol")
+    if requested in supported_protocols():
+        return requested, None
+    return DEFAULT_PROTOCOL, None
+
+def _default(value):
+    # Objects that know their JSON shape (e.g. corpus records) provide to_dict()
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    return str(value)
+
+def dumps(value):
+    """
+    Encodes a frame or stored result as JSON text. Every frame and ChatHistory response
+    goes through here, so each value is encoded exactly once.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib encoder copes
+    return json.dumps(value, default=_default)
+
+def frame_with(fields, **encoded):
+    """
+    Builds a frame from `fields` plus members that are already JSON-encoded, so a large
+    result encoded for storage is reused for the socket instead of being encoded again.
+
+    Usage:
+        frame_with({"status": "Query completed", "chat_id": chat_id}, results=results_json)
+    """
+    frame = dumps(fields)
+    members = ",".join(f"{json.dumps(name)}:{raw}" for name, raw in encoded.items())
+    if not members:
+        return frame
+    return frame[:-1] + ("," if fields else "") + members + "}"
+
+def to_msgpack(frame):
+    # Converts a JSON frame for a msgpack socket (once per fan-out; see ConnectionManager.send_message)
+    return msgpack.packb(json.loads(frame), use_bin_type=True)
+
+def decode_message(message):
+    """
+    Decodes a client message: JSON text, or MessagePack bytes from msgpack clients.
+    Raises ValueError for malformed input.
+    """
+    if message.get("text") is not None:
+        return json.loads(message["text"])
+    if message.get("bytes") is not None:
+        if msgpack is None:
+            raise ValueError("Binary messages need the msgpack protocol")
+        return msgpack.unpackb(message["bytes"], raw=False)
+    raise ValueError("Empty message")
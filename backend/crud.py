@@ -1,7 +1,14 @@
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from sqlalchemy.orm import Session, selectinload, undefer_group
+from sqlalchemy import and_, func, insert, or_, select, update
+from typing import Any, Dict, List, Optional, Tuple
+import datetime
+import json
+import uuid
 
-import models, schemas
+import models, schemas, security
+
+def get_user_by_id(db: Session, user_id: int) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.id == user_id).first()
 
 def get_user_by_provider_details(db: Session, provider: str, provider_account_id: str):
     return db.query(models.User).filter(
@@ -35,34 +42,165 @@ def update_user(db: Session, db_user: models.User, user_data: schemas.UserSync)
     if updated:
         db.commit()
         db.refresh(db_user)
+        security.cached_users.invalidate(db_user.id) # Next auth lookup reloads the user
     return db_user
 
 # ParameterHistory CRUD operations
 def create_parameter_history(db: Session, user_id: int, history_data: schemas.ParameterHistoryCreate) -> models.ParameterHistory:
+    # session_uuid and created_at are set here rather than by defaults, so no refresh is needed
     db_parameter_history = models.ParameterHistory(
         user_id=user_id,
         parameters=history_data.parameters,
-        title=history_data.title
-        # session_uuid is auto-generated by model default
+        title=history_data.title,
+        session_uuid=str(uuid.uuid4()),
+        created_at=datetime.datetime.now(datetime.timezone.utc)
     )
     db.add(db_parameter_history)
     db.commit()
-    db.refresh(db_parameter_history)
     return db_parameter_history
 
 def get_parameter_history_by_session_uuid(db: Session, session_uuid: str) -> Optional[models.ParameterHistory]:
     return db.query(models.ParameterHistory).filter(models.ParameterHistory.session_uuid == session_uuid).first()
 
-def get_parameter_histories_by_user(db: Session, user_id: int, skip: int = 0, limit: int = 100) -> List[models.ParameterHistory]:
+def get_parameter_histories_by_user(
+    db: Session,
+    user_id: int,
+    limit: int = 100,
+    before: Optional[Tuple[datetime.datetime, int]] = None,
+) -> List[Any]:
+    """
+    One page of a user's sessions, newest first, with only the columns the history list shows.
+
+    Pages are keyset-paginated on (created_at, id): pass the (created_at, id) of the last row
+    of the previous page as `before`. Served by ix_parameter_histories_user_id_created_at, so
+    each page is an index range scan whatever its depth.
+    """
+    ph = models.ParameterHistory
+    query = (
+        db.query(ph.id, ph.session_uuid, ph.title, ph.created_at)
+        .filter(ph.user_id == user_id)
+    )
+    if before is not None:
+        created_at, last_id = before
+        query = query.filter(or_(ph.created_at < created_at, and_(ph.created_at == created_at, ph.id < last_id)))
+    return query.order_by(ph.created_at.desc(), ph.id.desc()).limit(limit).all()
+
+# Scheduled refresh operations
+def schedule_session_refresh(db: Session, parameter_history_id: int, interval_seconds: int, watermark_utc: Optional[float]):
+    """
+    Arms (or re-arms) periodic refreshes for a session, starting one interval from now.
+    """
+    db.execute(
+        update(models.ParameterHistory)
+        .where(models.ParameterHistory.id == parameter_history_id)
+        .values(
+            refresh_interval_seconds=interval_seconds,
+            watermark_utc=watermark_utc,
+            next_refresh_at=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=interval_seconds),
+        )
+    )
+    db.commit()
+
+def get_due_session_refreshes(db: Session, limit: int = 10) -> List[models.ParameterHistory]:
+    # Served by the next_refresh_at index; sessions without a schedule have it NULL
     return (
         db.query(models.ParameterHistory)
-        .filter(models.ParameterHistory.user_id == user_id)
-        .order_by(models.ParameterHistory.created_at.desc())
-        .offset(skip)
+        .filter(models.ParameterHistory.next_refresh_at <= datetime.datetime.now(datetime.timezone.utc))
+        .order_by(models.ParameterHistory.next_refresh_at.asc())
         .limit(limit)
         .all()
     )
 
+def claim_session_refresh(db: Session, parameter_history: models.ParameterHistory) -> bool:
+    """
+    Moves a due session's next_refresh_at one interval ahead, but only if no other worker
+    process already did. Returns True if this caller owns the refresh.
+    """
+    next_refresh_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=parameter_history.refresh_interval_seconds)
+    result = db.execute(
+        update(models.ParameterHistory)
+        .where(models.ParameterHistory.id == parameter_history.id)
+        .where(models.ParameterHistory.next_refresh_at == parameter_history.next_refresh_at)
+        .values(next_refresh_at=next_refresh_at)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+def advance_session_watermark(db: Session, parameter_history_id: int, watermark_utc: Optional[float]):
+    db.execute(
+        update(models.ParameterHistory)
+        .where(models.ParameterHistory.id == parameter_history_id)
+        .values(watermark_utc=watermark_utc)
+    )
+    db.commit()
+
+# AnalysisJob CRUD operations
+JOB_ACTIVE_STATUSES = ("queued", "running")
+
+def create_analysis_job(db: Session, user_id: int, parameter_history_id: int, owner_instance: Optional[str] = None) -> models.AnalysisJob:
+    db_job = models.AnalysisJob(
+        user_id=user_id,
+        parameter_history_id=parameter_history_id,
+        status="queued",
+        owner_instance=owner_instance,
+        heartbeat_at=datetime.datetime.now(datetime.timezone.utc),
+    )
+    db.add(db_job)
+    db.commit()
+    db.refresh(db_job)
+    return db_job
+
+def update_analysis_job_status(db: Session, parameter_history_id: int, status: str, error: Optional[str] = None):
+    values = {"status": status, "error": error}
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if status == "running":
+        values["started_at"] = now
+    elif status not in JOB_ACTIVE_STATUSES:
+        values["finished_at"] = now
+    db.execute(
+        update(models.AnalysisJob)
+        .where(models.AnalysisJob.parameter_history_id == parameter_history_id)
+        .values(**values)
+    )
+    db.commit()
+
+def get_analysis_job_for_session(db: Session, parameter_history_id: int) -> Optional[models.AnalysisJob]:
+    return db.query(models.AnalysisJob).filter(models.AnalysisJob.parameter_history_id == parameter_history_id).first()
+
+def heartbeat_analysis_jobs(db: Session, owner_instance: str) -> int:
+    """
+    Confirms that the active jobs of this worker instance are still alive.
+    """
+    result = db.execute(
+        update(models.AnalysisJob)
+        .where(models.AnalysisJob.owner_instance == owner_instance, models.AnalysisJob.status.in_(JOB_ACTIVE_STATUSES))
+        .values(heartbeat_at=datetime.datetime.now(datetime.timezone.utc))
+    )
+    db.commit()
+    return result.rowcount
+
+def interrupt_stale_analysis_jobs(db: Session, heartbeat_timeout: float, owner_instance: Optional[str] = None) -> int:
+    """
+    Marks queued or running jobs that no live worker holds any more as interrupted: those
+    whose heartbeat is older than heartbeat_timeout seconds (or missing), plus those owned
+    by owner_instance if given (a restarted worker's own leftovers). Jobs of other live
+    workers are left alone.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    dead = or_(
+        models.AnalysisJob.heartbeat_at.is_(None),
+        models.AnalysisJob.heartbeat_at < now - datetime.timedelta(seconds=heartbeat_timeout),
+    )
+    if owner_instance is not None:
+        dead = or_(dead, models.AnalysisJob.owner_instance == owner_instance)
+    result = db.execute(
+        update(models.AnalysisJob)
+        .where(models.AnalysisJob.status.in_(JOB_ACTIVE_STATUSES), dead)
+        .values(status="interrupted", finished_at=now)
+    )
+    db.commit()
+    return result.rowcount
+
 # ChatHistory CRUD operations
 def create_chat_history(
     db: Session, 
@@ -74,23 +212,215 @@ def create_chat_history(
     db_chat_history = models.ChatHistory(
         user_id=user_id,
         message=message,
-        response=response,
-        parameter_history_id=parameter_history_id
+        **models.ChatHistory.pack_response(response),
+        parameter_history_id=parameter_history_id,
+        created_at=datetime.datetime.now(datetime.timezone.utc)
     )
     db.add(db_chat_history)
     db.commit()
-    db.refresh(db_chat_history)
     return db_chat_history
 
 # Add other ChatHistory operations if needed, e.g., get_chat_histories_by_parameter_session_uuid
-def get_chat_history_for_session(db: Session, parameter_session_uuid: str) -> List[models.ChatHistory]:
-    # First, get the parameter_history_id from the session_uuid
-    parameter_history = get_parameter_history_by_session_uuid(db, parameter_session_uuid)
-    if not parameter_history:
-        return []
-    return (
+def _session_chat_query(db: Session, parameter_session_uuid: str, with_responses: bool):
+    # Joined on the session uuid, so the ParameterHistory isn't fetched separately first
+    query = (
         db.query(models.ChatHistory)
-        .filter(models.ChatHistory.parameter_history_id == parameter_history.id)
+        .join(models.ParameterHistory, models.ChatHistory.parameter_history_id == models.ParameterHistory.id)
+        .filter(models.ParameterHistory.session_uuid == parameter_session_uuid)
+    )
+    if with_responses:
+        query = query.options(undefer_group("response"))
+    return query
+
+def get_chat_history_for_session(db: Session, parameter_session_uuid: str, with_responses: bool = False) -> List[models.ChatHistory]:
+    # Response payloads are only read (and decompressed) when with_responses is set
+    return (
+        _session_chat_query(db, parameter_session_uuid, with_responses)
         .order_by(models.ChatHistory.created_at.asc())
         .all()
-    ) 
\ No newline at end of file
+    )
+
+def get_session_chat_version(db: Session, session_uuid: str) -> Optional[Tuple[models.ParameterHistory, Optional[int]]]:
+    """
+    A session together with the id of its newest ChatHistory row (None if it has none), in
+    one query. Chat rows are only ever appended, so that id changes whenever the chat log does.
+    """
+    latest_chat_id = (
+        select(func.max(models.ChatHistory.id))
+        .where(models.ChatHistory.parameter_history_id == models.ParameterHistory.id)
+        .correlate(models.ParameterHistory)
+        .scalar_subquery()
+    )
+    return (
+        db.query(models.ParameterHistory, latest_chat_id)
+        .filter(models.ParameterHistory.session_uuid == session_uuid)
+        .first()
+    )
+
+def get_session_with_chat_log(db: Session, session_uuid: str, with_responses: bool = True) -> Optional[models.ParameterHistory]:
+    # chat_entries are loaded up front (selectinload), in created_at order
+    chat_loader = selectinload(models.ParameterHistory.chat_entries)
+    if with_responses:
+        chat_loader = chat_loader.undefer_group("response")
+    return (
+        db.query(models.ParameterHistory)
+        .options(chat_loader)
+        .filter(models.ParameterHistory.session_uuid == session_uuid)
+        .first()
+    )
+
+def get_latest_session_analysis(db: Session, parameter_session_uuid: str) -> Optional[str]:
+    # The most recent stored analysis text for a session (initial run or scheduled refresh).
+    # Newest first, a few payloads at a time: usually only the latest rows are decompressed
+    newest_first = (
+        _session_chat_query(db, parameter_session_uuid, with_responses=True)
+        .order_by(models.ChatHistory.created_at.desc())
+        .yield_per(5)
+    )
+    for entry in newest_first:
+        try:
+            response = json.loads(entry.response_text or "{}")
+        except json.JSONDecodeError:
+            continue
+        if isinstance(response, dict) and response.get("analysis"):
+            return response["analysis"]
+    return None
+
+# Reddit corpus CRUD operations
+BULK_INSERT_CHUNK = 500 # rows per multi-row INSERT statement
+
+def _bulk_upsert(db: Session, model, rows: List[Dict[str, Any]], update_columns: List[str]):
+    """
+    Multi-row INSERT that skips (or refreshes update_columns of) rows whose primary key
+    already exists, using the dialect's native upsert so dedup costs no extra round-trips.
+    """
+    dialect = db.bind.dialect.name
+    for start in range(0, len(rows), BULK_INSERT_CHUNK):
+        chunk = rows[start:start + BULK_INSERT_CHUNK]
+        if dialect in ("mysql", "mariadb"):
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(model).values(chunk)
+            if update_columns:
+                stmt = stmt.on_duplicate_key_update({col: stmt.inserted[col] for col in update_columns})
+            else:
+                stmt = stmt.prefix_with("IGNORE")
+        elif dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(model).values(chunk)
+            primary_keys = [col.name for col in model.__table__.primary_key.columns]
+            if update_columns:
+                stmt = stmt.on_conflict_do_update(index_elements=primary_keys, set_={col: stmt.excluded[col] for col in update_columns})
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=primary_keys)
+        else:
+            stmt = insert(model).values(chunk)
+        db.execute(stmt)
+
+def save_session_corpus(db: Session, parameter_history_id: int, subreddit: str, posts_with_comments: List[Dict[str, Any]], start_position: int = 0, linked_post_ids=()):
+    """
+    Stores the posts and comments fetched for a session in one transaction.
+    Posts and comments are deduplicated on their Reddit ids across sessions; scores of
+    rows that already exist are refreshed. Link rows record which posts and comments
+    belong to this session. Refreshes pass start_position and the ids of the posts already
+    linked, so only the posts that are new to the session are numbered (appended after the
+    ones already linked, without gaps).
+    """
+    post_rows = []
+    comment_rows = []
+    link_rows = []
+    comment_link_rows = []
+    position = start_position
+    for post in posts_with_comments:
+        if not post.get('id'):
+            continue
+        post_rows.append({
+            "id": post['id'],
+            "subreddit": subreddit,
+            "title": post.get('title'),
+            "author": post.get('author'),
+            "selftext": post.get('selftext'),
+            "score": post.get('score'),
+            "num_comments": post.get('num_comments'),
+            "permalink": post.get('permalink'),
+            "created_utc": post.get('created_utc'),
+        })
+        if post['id'] not in linked_post_ids:
+            link_rows.append({"parameter_history_id": parameter_history_id, "reddit_post_id": post['id'], "position": position})
+            position += 1
+        for comment in post.get('comments', []):
+            if not comment.get('id'):
+                continue # Entries cached before comment ids were recorded
+            comment_rows.append({
+                "id": comment['id'],
+                "post_id": post['id'],
+                "author": comment.get('author'),
+                "body": comment.get('body'),
+                "score": comment.get('score'),
+                "created_utc": comment.get('created_utc'),
+                "parent_id": comment.get('parent_id'),
+                "depth": comment.get('depth') or 0,
+            })
+            comment_link_rows.append({"parameter_history_id": parameter_history_id, "reddit_comment_id": comment['id']})
+    try:
+        _bulk_upsert(db, models.RedditPost, post_rows, ["score", "num_comments"])
+        _bulk_upsert(db, models.RedditComment, comment_rows, ["score"])
+        _bulk_upsert(db, models.SessionPost, link_rows, [])
+        _bulk_upsert(db, models.SessionComment, comment_link_rows, [])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+def get_session_corpus(db: Session, parameter_history_id: int) -> List[Dict[str, Any]]:
+    """
+    Loads a session's posts (in search order) with their comments, in the same dict
+    shape process_reddit_query produces. Two indexed queries regardless of corpus size.
+    """
+    rows = (
+        db.query(models.RedditPost, models.SessionPost.position)
+        .join(models.SessionPost, models.SessionPost.reddit_post_id == models.RedditPost.id)
+        .filter(models.SessionPost.parameter_history_id == parameter_history_id)
+        .order_by(models.SessionPost.position.asc())
+        .all()
+    )
+    posts = []
+    posts_by_id = {}
+    for post, _ in rows:
+        post_dict = {
+            "id": post.id,
+            "title": post.title,
+            "author": post.author,
+            "selftext": post.selftext,
+            "score": post.score,
+            "num_comments": post.num_comments,
+            "permalink": post.permalink,
+            "created_utc": post.created_utc,
+            "comments": [],
+        }
+        posts.append(post_dict)
+        posts_by_id[post.id] = post_dict
+    if not posts_by_id:
+        return posts
+
+    # Only the comments this session fetched, not everything stored for its posts
+    comments = (
+        db.query(models.RedditComment)
+        .join(models.SessionComment, models.SessionComment.reddit_comment_id == models.RedditComment.id)
+        .filter(models.SessionComment.parameter_history_id == parameter_history_id)
+        .order_by(models.RedditComment.score.desc())
+        .all()
+    )
+    for comment in comments:
+        posts_by_id[comment.post_id]["comments"].append({
+            "id": comment.id,
+            "author": comment.author,
+            "body": comment.body,
+            "score": comment.score,
+            "created_utc": comment.created_utc,
+            "parent_id": comment.parent_id,
+            "depth": comment.depth,
+        })
+    return posts
@@ -1,4 +1,7 @@
+import asyncio
+import functools
 import os
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -11,14 +14,49 @@ SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@
 if not SQLALCHEMY_DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable not set")
 
+# Threads running blocking DB work for async code. Matches SQLAlchemy's default pool_size,
+# so a DB thread never waits for a pooled connection.
+DB_THREAD_POOL_SIZE = int(os.getenv("DB_THREAD_POOL_SIZE", 5))
+
 engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: objects stay readable after their short-lived session is closed
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 
 Base = declarative_base()
 
+_db_executor = ThreadPoolExecutor(max_workers=DB_THREAD_POOL_SIZE, thread_name_prefix="db")
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close() 
\ No newline at end of file
+        db.close()
+
+def _call_with_session(fn, args, kwargs):
+    db = SessionLocal()
+    try:
+        return fn(db, *args, **kwargs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Runs fn(db, *args, **kwargs) on the DB thread pool with its own short-lived session,
+    so the event loop never blocks on a database round-trip and no connection is held
+    between units of work.
+
+    Usage:
+        user = await run_db(crud.get_user_by_id, user_id)
+
+    Returned ORM objects are detached: their loaded columns stay readable, but changes to
+    them are not saved (do writes inside fn).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(_call_with_session, fn, args, kwargs))
+
+def shutdown_db_executor():
+    _db_executor.shutdown(wait=True)
@@ -0,0 +1,236 @@
+import asyncio
+import datetime
+import os
+import uuid
+from sqlalchemy import insert
+
+import models
+from database import run_db
+
+# --- Write-Behind Configuration ---
+HISTORY_FLUSH_WINDOW = float(os.getenv("HISTORY_FLUSH_WINDOW", 0.05))  # seconds a write may wait to join a group commit
+HISTORY_MAX_BATCH = int(os.getenv("HISTORY_MAX_BATCH", 200))  # rows that trigger a flush without waiting for the window
+HISTORY_MAX_ATTEMPTS = 3  # a row failing this often is dropped (and logged) rather than retried forever
+
+def _write_batch(db, batch):
+    """
+    Inserts one group of queued rows in a single transaction: parameter histories first,
+    then the rows pointing at them, with parameter_history_id resolved from session_uuid
+    in one query. Fails if a referenced session isn't stored (e.g. its own row failed),
+    so no orphaned rows are written.
+    """
+    rows_by_kind = {"parameter_history": [], "analysis_job": [], "chat_history": []}
+    for kind, row, _ in batch:
+        rows_by_kind[kind].append(row)
+
+    if rows_by_kind["parameter_history"]:
+        db.execute(insert(models.ParameterHistory), rows_by_kind["parameter_history"])
+
+    dependent_rows = rows_by_kind["analysis_job"] + rows_by_kind["chat_history"]
+    session_uuids = {row["parameter_session_uuid"] for row in dependent_rows if row.get("parameter_session_uuid")}
+    ids_by_uuid = {}
+    if session_uuids:
+        ids_by_uuid = dict(
+            db.query(models.ParameterHistory.session_uuid, models.ParameterHistory.id)
+            .filter(models.ParameterHistory.session_uuid.in_(session_uuids))
+            .all()
+        )
+
+    for kind, model in (("analysis_job", models.AnalysisJob), ("chat_history", models.ChatHistory)):
+        rows = []
+        for row in rows_by_kind[kind]:
+            row = dict(row)
+            session_uuid = row.pop("parameter_session_uuid", None)
+            if session_uuid is not None:
+                if session_uuid not in ids_by_uuid:
+                    raise LookupError(f"{kind} row references session {session_uuid}, which is not stored")
+                row["parameter_history_id"] = ids_by_uuid[session_uuid]
+            rows.append(row)
+        if rows:
+            db.execute(insert(model), rows)
+    db.commit()
+
+class HistoryWriter:
+    """
+    Write-behind buffer for history rows (ParameterHistory, AnalysisJob, ChatHistory).
+
+    Inserts are queued and committed in groups, once HISTORY_FLUSH_WINDOW has passed since
+    the first queued row or as soon as HISTORY_MAX_BATCH rows are waiting, so a burst of
+    writes costs one transaction instead of a commit + refresh per row. session_uuid and
+    created_at are generated here, so callers never need to read a row back; rows that
+    belong to a session reference it by session_uuid until the flush resolves its id.
+
+    Readers call sync() first to flush anything pending for the requesting user or session
+    (read-your-writes), and close() flushes whatever is left on shutdown.
+    """
+
+    def __init__(self, window=HISTORY_FLUSH_WINDOW, max_batch=HISTORY_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []  # (kind, row, attempts)
+        self._inflight = []
+        self._flush_lock = asyncio.Lock()
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task = None
+        self._commit_listeners = []
+        self.rows_written = 0
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """
+        Stops the flush loop and writes everything still queued, including rows queued while
+        flushing and rows being retried. Ends once the queue is empty, which is bounded since
+        every failed write counts towards that row's HISTORY_MAX_ATTEMPTS.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"History writer: flush on shutdown failed, {len(self._pending)} row(s) left to retry: {e}")
+                await asyncio.sleep(self.window)
+
+    def on_commit(self, callback):
+        """
+        Registers callback(rows) to be called with the (kind, row) pairs of every committed
+        group, e.g. to invalidate caches built from those tables.
+        """
+        self._commit_listeners.append(callback)
+
+    def _enqueue(self, kind, row):
+        self._pending.append((kind, row, 0))
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+
+    def add_parameter_history(self, user_id, history_data):
+        """
+        Queues a ParameterHistory row. Returns an unsaved ParameterHistory carrying its
+        session_uuid and created_at (id stays None; use the uuid to refer to it).
+        """
+        row = {
+            "session_uuid": str(uuid.uuid4()),
+            "user_id": user_id,
+            "parameters": history_data.parameters,
+            "title": history_data.title,
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+        }
+        self._enqueue("parameter_history", row)
+        return models.ParameterHistory(**row)
+
+    def add_analysis_job(self, user_id, session_uuid, owner_instance=None):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self._enqueue("analysis_job", {
+            "user_id": user_id,
+            "parameter_session_uuid": session_uuid,
+            "status": "queued",
+            "owner_instance": owner_instance,
+            "heartbeat_at": now,
+            "created_at": now,
+        })
+
+    def add_chat_history(self, user_id, message, response, session_uuid=None):
+        self._enqueue("chat_history", {
+            "user_id": user_id,
+            "parameter_session_uuid": session_uuid,
+            "message": message,
+            **models.ChatHistory.pack_response(response),  # compressed when large
+            "created_at": datetime.datetime.now(datetime.timezone.utc),
+        })
+
+    async def _run(self):
+        while True:
+            await self._has_pending.wait()
+            try:
+                # Give concurrent writers one window to join this group
+                await asyncio.wait_for(self._batch_full.wait(), timeout=self.window)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"History writer: flush failed: {e}")
+                await asyncio.sleep(self.window)
+
+    async def flush(self):
+        """
+        Commits everything queued so far (waiting for an in-flight group first).
+        """
+        async with self._flush_lock:
+            self._has_pending.clear()
+            self._batch_full.clear()
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            self._inflight = batch
+            try:
+                committed, failed = await self._write_group(batch)
+                if committed:
+                    self.rows_written += len(committed)
+                    self.flushes += 1
+                    for callback in self._commit_listeners:
+                        callback([(kind, row) for kind, row, _ in committed])
+                retry = [(kind, row, attempts + 1) for (kind, row, attempts), _ in failed if attempts + 1 < HISTORY_MAX_ATTEMPTS]
+                for (kind, row, attempts), error in failed:
+                    if attempts + 1 >= HISTORY_MAX_ATTEMPTS:
+                        print(f"History writer: dropping {kind} row after {HISTORY_MAX_ATTEMPTS} failed attempts: {error}")
+                self._pending[:0] = retry
+                if self._pending:
+                    self._has_pending.set()
+                if retry and not committed:
+                    raise failed[-1][1]  # Nothing could be written (e.g. database down): let the loop back off
+            finally:
+                self._inflight = []
+
+    async def _write_group(self, batch):
+        """
+        Commits a group in one transaction. If that fails, writes each row in its own
+        transaction instead, in queue order (a session's ParameterHistory row is queued
+        before the rows referencing it), so one bad row doesn't take its neighbours down.
+
+        Returns:
+            (committed, failed): the rows written, and (row, error) pairs for the others
+        """
+        try:
+            await run_db(_write_batch, batch)
+            return batch, []
+        except Exception as e:
+            if len(batch) == 1:
+                return [], [(batch[0], e)]
+            print(f"History writer: group of {len(batch)} row(s) failed, writing them one at a time: {e}")
+        committed, failed = [], []
+        for entry in batch:
+            try:
+                await run_db(_write_batch, [entry])
+                committed.append(entry)
+            except Exception as e:
+                failed.append((entry, e))
+        return committed, failed
+
+    async def sync(self, user_id=None, session_uuid=None):
+        """
+        Flushes if any queued or in-flight row belongs to the given user or session, so a
+        read that follows sees that caller's own writes.
+        """
+        def matches(row):
+            return (user_id is not None and row.get("user_id") == user_id) or (
+                session_uuid is not None and session_uuid in (row.get("session_uuid"), row.get("parameter_session_uuid"))
+            )
+        if any(matches(row) for _, row, _ in self._pending + self._inflight):
+            await self.flush()
+
+    def stats(self):
+        return {"pending": len(self._pending), "rows_written": self.rows_written, "flushes": self.flushes}
+
+history_writer = HistoryWriter()
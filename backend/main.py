@@ -1,21 +1,40 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException, status
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, Query, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from starlette.websockets import WebSocketState
+from pydantic import BaseModel, Field
 import json
-from typing import List, Dict, Any, Optional
-import uuid
+import os
+from typing import List, Dict, Any, Optional, Set
+import time
+import functools
+import base64
+import datetime
+import hashlib
+from email.utils import format_datetime, parsedate_to_datetime
 import logging # Add logging
 
 # Import the auth router and the get_current_active_user dependency
 from routers import auth
+from routers.auth import load_user
 # Assuming get_current_active_user is now in routers.auth
 # If it were in, say, dependencies.py, you'd import from there.
 
 import crud
 import models # models.py
 import schemas # schemas.py
-from database import get_db, SessionLocal # Import SessionLocal for manual session management if needed
+from database import SessionLocal, run_db, shutdown_db_executor # run_db: short-lived sessions off the event loop
 import security # Make sure this is imported
+from api.cache import TTLCache
+from api.coalesce import analysis_coalescer
+from api.session_index import session_indexes
+from api.ai_analysis import answer_follow_up
+from api.corpus import newest_created_utc
+from api.prompt_packing import load_encoding
+from api.refresh import RefreshScheduler, refresh_interval_seconds
+from api.jobs import JobRunner, INSTANCE_ID, JOB_HEARTBEAT_TIMEOUT
+from api.broker import create_broker
+from api import wire
+from history_writer import history_writer
 
 app = FastAPI()
 
@@ -28,6 +47,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "Last-Modified", "X-Next-Cursor"], # History list caching/pagination
 )
 
 # Model for incoming WebSocket query, adjust as needed
@@ -42,14 +62,17 @@ class RedditQuery(BaseModel):
     keyword: str
     question: str
     limit: int = 10
-    # repeatHours: int = 0 # Not used by process_reddit_query based on its call signature
-    # repeatMinutes: int = 0 # Not used by process_reddit_query
+    repeatHours: int = 0 # Together with repeatMinutes: interval of scheduled refreshes (0/0 = run once)
+    repeatMinutes: int = 0
     sort_order: str = "hot"
+    stream_mode: str = "batch" # "batch" (comment_batch frames, what the frontend uses) or "comment" (one frame per comment)
+    analysis_mode: str = "auto" # "single", "map_reduce", or "auto" (map-reduce for large corpora)
+    deep_fetch: bool = False # Walk nested replies and expand "load more comments" stubs
     # Ensure this matches what process_reddit_query expects, current call uses:
-    # subreddit, keyword, question, limit, (removed repeatHours, repeatMinutes), progress_callback, sort_order
+    # subreddit, keyword, question, limit, repeatHours, repeatMinutes, progress_callback, sort_order
 
 # --- Helper for WebSocket Authentication ---
-async def get_websocket_user(token: Optional[str], db: SessionLocal) -> Optional[models.User]:
+async def get_websocket_user(token: Optional[str]) -> Optional[models.User]:
     if not token:
         logging.warning("WebSocket Auth: No token provided.")
         return None
@@ -68,8 +91,8 @@ async def get_websocket_user(token: Optional[str], db: SessionLocal) -> Optional
         
         # --- Query the database ---
         user_id_from_token = token_data.user_id
-        logging.info(f"WebSocket Auth: Querying DB for user_id: {user_id_from_token}")
-        user = db.query(models.User).filter(models.User.id == user_id_from_token).first()
+        logging.info(f"WebSocket Auth: Looking up user_id: {user_id_from_token}")
+        user = await load_user(user_id_from_token) # Cached; see routers.auth.load_user
         # --- END Query ---
         
         # --- ADD LOGGING HERE ---
@@ -87,140 +110,438 @@ async def get_websocket_user(token: Optional[str], db: SessionLocal) -> Optional
 
 # --- WebSocket Connection Manager (existing) ---
 class ConnectionManager:
+    """
+    The sockets connected to this worker, indexed for broker event delivery.
+
+    Events are routed with dict lookups instead of scanning every connection:
+    user_id -> sockets for user-scoped events, and chat_id -> {socket: cursor} for
+    analysis job frames. A cursor is the next job-log seq the socket should receive
+    (lower ones were already replayed to it), or a list buffering live frames while
+    the socket is being replayed a log fetched from the broker.
+    """
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
-        # Store user_id with websocket to identify user for broadcasting if needed
-        self.connection_details: Dict[WebSocket, int] = {}
+        self.active_connections: Set[WebSocket] = set()
+        self.sockets_by_user: Dict[int, Set[WebSocket]] = {}
+        self.user_by_socket: Dict[WebSocket, int] = {}
+        self.sockets_by_chat: Dict[str, Dict[WebSocket, Any]] = {}
+        self.chats_by_socket: Dict[WebSocket, Set[str]] = {}
+        self.protocol_by_socket: Dict[WebSocket, str] = {} # Negotiated wire protocol (see api.wire)
 
-    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None):
-        await websocket.accept()
-        self.active_connections.append(websocket)
+    async def connect(self, websocket: WebSocket, user_id: Optional[int] = None, protocol: str = wire.DEFAULT_PROTOCOL, subprotocol: Optional[str] = None):
+        await websocket.accept(subprotocol=subprotocol)
+        self.active_connections.add(websocket)
+        self.protocol_by_socket[websocket] = protocol
         if user_id:
-            self.connection_details[websocket] = user_id
+            self.user_by_socket[websocket] = user_id
+            self.sockets_by_user.setdefault(user_id, set()).add(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
-        if websocket in self.connection_details:
-            del self.connection_details[websocket]
-
-    async def send_message(self, websocket: WebSocket, message: str):
-        await websocket.send_text(message)
-    
-    # async def broadcast_to_user(self, user_id: int, message: str):
-    #     for ws, uid in self.connection_details.items():
-    #         if uid == user_id:
-    #             await ws.send_text(message)
+        self.active_connections.discard(websocket)
+        self.protocol_by_socket.pop(websocket, None)
+        user_id = self.user_by_socket.pop(websocket, None)
+        if user_id is not None:
+            user_sockets = self.sockets_by_user.get(user_id)
+            if user_sockets is not None:
+                user_sockets.discard(websocket)
+                if not user_sockets:
+                    del self.sockets_by_user[user_id]
+        for chat_id in list(self.chats_by_socket.get(websocket, ())):
+            self.leave_chat(websocket, chat_id)
+
+    async def send_message(self, websocket: WebSocket, message: str, converted: Optional[Dict[str, bytes]] = None):
+        # Frames are JSON text everywhere (job logs, the broker); msgpack sockets get them converted.
+        # `converted` holds the conversion while one frame fans out, so it is done once per publish.
+        if self.protocol_by_socket.get(websocket) == "msgpack":
+            packed = converted.get("msgpack") if converted is not None else None
+            if packed is None:
+                packed = wire.to_msgpack(message)
+                if converted is not None:
+                    converted["msgpack"] = packed
+            await websocket.send_bytes(packed)
+        else:
+            await websocket.send_text(message)
+
+    async def receive_message(self, websocket: WebSocket) -> Dict[str, Any]:
+        # JSON text, or MessagePack bytes from msgpack clients; ValueError if malformed
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            raise WebSocketDisconnect(message.get("code", 1000))
+        return wire.decode_message(message)
+
+    def join_chat(self, websocket: WebSocket, chat_id: str, next_seq: Optional[int] = None):
+        # next_seq None: hold live frames until release_chat() has sent the replayed log
+        self.sockets_by_chat.setdefault(chat_id, {})[websocket] = next_seq if next_seq is not None else []
+        self.chats_by_socket.setdefault(websocket, set()).add(chat_id)
+
+    async def release_chat(self, websocket: WebSocket, chat_id: str, history: List[str]):
+        for frame in history:
+            await self.send_message(websocket, frame)
+        subscribers = self.sockets_by_chat.get(chat_id, {})
+        held = subscribers.get(websocket)
+        subscribers[websocket] = len(history)
+        for envelope in held if isinstance(held, list) else ():
+            await self._deliver_chat_frame(websocket, chat_id, envelope)
+
+    def leave_chat(self, websocket: WebSocket, chat_id: str):
+        subscribers = self.sockets_by_chat.get(chat_id)
+        if subscribers is not None:
+            subscribers.pop(websocket, None)
+            if not subscribers:
+                del self.sockets_by_chat[chat_id]
+        chats = self.chats_by_socket.get(websocket)
+        if chats is not None:
+            chats.discard(chat_id)
+            if not chats:
+                del self.chats_by_socket[websocket]
+
+    async def deliver(self, envelope: Dict[str, Any]):
+        """
+        Sends a broker envelope to the matching sockets on this worker.
+        """
+        converted = {} # Dropped once this frame has been sent everywhere
+        if envelope["scope"] == "user":
+            for websocket in list(self.sockets_by_user.get(envelope["key"], ())):
+                await self._send_or_drop(websocket, envelope["frame"], converted)
+        elif envelope["scope"] == "chat":
+            for websocket in list(self.sockets_by_chat.get(envelope["key"], {})):
+                await self._deliver_chat_frame(websocket, envelope["key"], envelope, converted)
+
+    async def _deliver_chat_frame(self, websocket: WebSocket, chat_id: str, envelope: Dict[str, Any], converted: Optional[Dict[str, bytes]] = None):
+        subscribers = self.sockets_by_chat.get(chat_id, {})
+        cursor = subscribers.get(websocket)
+        if isinstance(cursor, list):
+            cursor.append(envelope) # Still being replayed; delivered by release_chat()
+            return
+        seq = envelope.get("seq")
+        if seq is not None and cursor is not None:
+            if seq < cursor:
+                return # Already sent during replay
+            subscribers[websocket] = seq + 1
+        await self._send_or_drop(websocket, envelope["frame"], converted)
+
+    async def _send_or_drop(self, websocket: WebSocket, frame: str, converted: Optional[Dict[str, bytes]] = None):
+        try:
+            await self.send_message(websocket, frame, converted)
+        except Exception as e:
+            # Usually a socket closing under us; its jobs keep running and can be re-attached to
+            logging.warning(f"Dropping socket after failed event delivery: {str(e)}")
+            self.disconnect(websocket)
 
 manager = ConnectionManager()
 
+# Job and session events reach sockets through the broker, so they are delivered on
+# whichever worker the user is connected to (see BROKER_URL)
+broker = create_broker()
+
+@app.on_event("startup")
+async def load_tokenizer():
+    # tiktoken may download its encoding on first use; do it here, off the event loop
+    await load_encoding()
+
+@app.on_event("startup")
+async def start_broker():
+    await broker.start(manager.deliver)
+
+# --- Scheduled Refreshes ---
+async def notify_session_refreshed(user_id: int, session_uuid: str, results_json: str):
+    # Push scheduled updates to any socket the session's owner has open, on any worker
+    await broker.publish_to_user(user_id, wire.frame_with({"status": "Scheduled update", "chat_id": session_uuid}, results=results_json))
+
+refresh_scheduler = RefreshScheduler(on_refreshed=notify_session_refreshed)
+
+@app.on_event("startup")
+async def start_refresh_scheduler():
+    history_writer.start()
+    refresh_scheduler.start()
+
+# --- Background Analysis Jobs ---
+def _record_job_status(db: SessionLocal, session_uuid: str, job_status: str, error: Optional[str]):
+    param_history = crud.get_parameter_history_by_session_uuid(db, session_uuid=session_uuid)
+    if param_history:
+        crud.update_analysis_job_status(db, param_history.id, job_status, error)
+
+async def record_job_status(session_uuid: str, job_status: str, error: Optional[str]):
+    await history_writer.sync(session_uuid=session_uuid) # The job row may still be queued
+    await run_db(_record_job_status, session_uuid, job_status, error)
+
+async def publish_job_event(session_uuid: str, seq: int, frame: str):
+    await broker.publish_to_chat(session_uuid, frame, seq)
+
+async def job_heartbeat():
+    # Keep this worker's jobs alive, and interrupt those of workers that stopped heartbeating
+    await run_db(crud.heartbeat_analysis_jobs, INSTANCE_ID)
+    interrupted = await run_db(crud.interrupt_stale_analysis_jobs, JOB_HEARTBEAT_TIMEOUT)
+    if interrupted:
+        logging.warning(f"Marked {interrupted} analysis job(s) of unresponsive workers as interrupted.")
+
+job_runner = JobRunner(on_status=record_job_status, on_event=publish_job_event, on_heartbeat=job_heartbeat)
+
+async def attach_to_job(websocket: WebSocket, chat_id: str) -> bool:
+    """
+    Replays an analysis job's frames to the socket and subscribes it to the live ones.
+    Returns False if no worker has a record of the job any more.
+    """
+    async def send_frame(frame: str):
+        await manager.send_message(websocket, frame)
+
+    job, next_seq = await job_runner.replay(chat_id, send_frame)
+    if job is not None:
+        manager.join_chat(websocket, chat_id, next_seq) # No await since the replay ended: nothing slips through
+        return True
+    # Possibly running on another worker: hold live frames while its log is replayed from the broker
+    manager.join_chat(websocket, chat_id)
+    history = await broker.history(chat_id)
+    if history:
+        await manager.release_chat(websocket, chat_id, history)
+        return True
+    manager.leave_chat(websocket, chat_id)
+    return False
+
+@app.on_event("startup")
+async def interrupt_stale_jobs():
+    # Jobs of a previous run of this worker, or of workers that stopped heartbeating, can't
+    # be resumed; make their status say so. Live jobs on other workers are left alone.
+    interrupted = await run_db(crud.interrupt_stale_analysis_jobs, JOB_HEARTBEAT_TIMEOUT, owner_instance=INSTANCE_ID)
+    if interrupted:
+        logging.warning(f"Marked {interrupted} analysis job(s) from a previous run as interrupted.")
+    job_runner.start()
+
+async def run_analysis_job(publish, user_id: int, session_uuid: str, title: str, query_params: RedditQuery):
+    """
+    The new_analysis pipeline as a background job. Frames go to `publish`, which
+    forwards them to whichever sockets are attached to the job. DB writes go through
+    run_db, so no connection is held while Reddit and the model are being waited on.
+    """
+    corpus_watermark = {"utc": None} # Newest created_utc fetched, where scheduled refreshes pick up
+    resolved = {}
+
+    async def session_history_id() -> int:
+        # The ParameterHistory row is written behind; make sure it is in before using its id
+        if "id" not in resolved:
+            await history_writer.sync(session_uuid=session_uuid)
+            param_history = await run_db(crud.get_parameter_history_by_session_uuid, session_uuid=session_uuid)
+            resolved["id"] = param_history.id
+        return resolved["id"]
+
+    try:
+        # Define progress callback, now including chat_id in its messages
+        async def progress_callback(data_to_send: Any):
+            payload_str = ""
+            if isinstance(data_to_send, dict) and data_to_send.get("type") == "corpus":
+                # Internal event: index the fetched posts so follow-ups don't refetch them,
+                # and store them so the session can be reopened after eviction or a restart
+                await session_indexes.build(session_uuid, data_to_send["posts"])
+                corpus_watermark["utc"] = newest_created_utc(data_to_send["posts"])
+                try:
+                    await run_db(crud.save_session_corpus, await session_history_id(), query_params.subreddit, data_to_send["posts"])
+                except Exception as e:
+                    logging.error(f"Failed to store corpus for session {session_uuid}: {str(e)}")
+                return
+            if isinstance(data_to_send, str):
+                payload_str = wire.dumps({"status": data_to_send, "chat_id": session_uuid})
+            elif isinstance(data_to_send, dict):
+                data_to_send["chat_id"] = session_uuid # Add chat_id
+                payload_str = wire.dumps(data_to_send)
+            else:
+                payload_str = wire.dumps({"error": "Unexpected data format from backend processing.", "chat_id": session_uuid})
+            if payload_str:
+                await publish(payload_str)
+
+        # Ensure process_reddit_query is imported correctly
+        from api.process_query import process_reddit_query 
+        # Identical analyses already running (same parameters) are joined rather than re-run
+        analysis_key = analysis_coalescer.key_for(**query_params.dict())
+        results = await analysis_coalescer.run(
+            analysis_key,
+            progress_callback,
+            lambda shared_callback: process_reddit_query(
+                query_params.subreddit, 
+                query_params.keyword, 
+                query_params.question, 
+                query_params.limit,
+                query_params.repeatHours,
+                query_params.repeatMinutes,
+                shared_callback, # Fans progress out to every subscribed websocket
+                query_params.sort_order, # Correct position
+                stream_mode=query_params.stream_mode,
+                analysis_mode=query_params.analysis_mode,
+                deep_fetch=query_params.deep_fetch
+            )
+        )
+
+        session_index = session_indexes.get(session_uuid)
+        if session_index is not None:
+            session_index.analysis = results.get("analysis")
+
+        # Encoded once: the same JSON is stored and embedded in the completion frame
+        results_json = wire.dumps(results)
+        # Store final results in ChatHistory, linked to ParameterHistory (group-committed by the history writer)
+        history_writer.add_chat_history(user_id, f"Initial analysis: {title}", results_json, session_uuid=session_uuid)
+        # Arm scheduled refreshes; they only analyze what appears after this run
+        interval_seconds = refresh_interval_seconds(query_params.repeatHours, query_params.repeatMinutes)
+        if interval_seconds and not results.get("error"):
+            await run_db(crud.schedule_session_refresh, await session_history_id(), interval_seconds, corpus_watermark["utc"])
+        # Send final completion message (the runner sends it once the job is marked completed)
+        await publish(wire.frame_with({"status": "Query completed", "chat_id": session_uuid}, results=results_json), final=True)
+        return results
+
+    except Exception as e:
+        await publish(wire.dumps({"error": f"Error processing new analysis: {str(e)}", "chat_id": session_uuid}))
+        raise
+
+# --- Per-message DB units of work (run through run_db) ---
+def load_job_status(db: SessionLocal, param_history_id: int, session_uuid: str) -> Dict[str, Any]:
+    stored_job = crud.get_analysis_job_for_session(db, parameter_history_id=param_history_id)
+    job_status = {"type": "job_status", "status": stored_job.status if stored_job else "unknown", "chat_id": session_uuid}
+    chat_entries = crud.get_chat_history_for_session(db, parameter_session_uuid=session_uuid, with_responses=True)
+    if chat_entries:
+        job_status["results"] = json.loads(chat_entries[0].response_text or "null")
+    return job_status
+
+def load_follow_up_context(db: SessionLocal, param_history_id: int, session_uuid: str):
+    # The stored corpus and latest analysis, to rebuild an evicted follow-up index
+    return crud.get_session_corpus(db, parameter_history_id=param_history_id), crud.get_latest_session_analysis(db, session_uuid)
+
 # --- WebSocket Endpoint ---
 @app.websocket("/ws/query")
 async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = Query(None)):
-    db: SessionLocal = next(get_db())
+    # No session is held for the connection's lifetime: each message does its DB work
+    # through run_db, in short-lived sessions on the DB thread pool
     current_user: Optional[models.User] = None
     try:
-        current_user = await get_websocket_user(token, db)
+        current_user = await get_websocket_user(token)
         if not current_user:
             await websocket.accept() # Accept before sending close reason
             await websocket.send_text(json.dumps({"error": "Authentication failed"}))
             await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
             return
 
-        await manager.connect(websocket, current_user.id)
+        # Wire protocol chosen at connect time; clients that don't ask keep JSON text frames
+        protocol, subprotocol = wire.negotiate(websocket)
+        await manager.connect(websocket, current_user.id, protocol, subprotocol)
         
         while True: # Keep connection open for multiple messages
-            raw_data = await websocket.receive_text()
             try:
-                ws_message_data = json.loads(raw_data)
+                ws_message_data = await manager.receive_message(websocket)
                 message_type = ws_message_data.get("type")
                 client_chat_id = ws_message_data.get("chat_id") # This is the session_uuid
                 payload_data = ws_message_data.get("data", {})
 
-            except json.JSONDecodeError:
+            except WebSocketDisconnect:
+                raise
+            except ValueError: # Malformed JSON (or MessagePack)
                 await manager.send_message(websocket, json.dumps({"error": "Invalid JSON format"}))
                 continue
             except Exception as e: # Catch other potential errors from message parsing
                 await manager.send_message(websocket, json.dumps({"error": f"Invalid message structure: {str(e)}"}))
                 continue
 
-            if message_type == "new_analysis":
-                try:
-                    query_params = RedditQuery(**payload_data) # Validate/parse parameters
-                    title = f"r/{query_params.subreddit} - {query_params.keyword}"
-                    # Store parameters with user_id and generated title
-                    ph_create_schema = schemas.ParameterHistoryCreate(parameters=json.dumps(payload_data), title=title)
-                    param_history = crud.create_parameter_history(db, user_id=current_user.id, history_data=ph_create_schema)
-                    session_uuid = param_history.session_uuid # This is our chat_id for the frontend
-
-                    # Acknowledge session start with chat_id
-                    await manager.send_message(websocket, json.dumps({"chat_id": session_uuid, "status": "Analysis session started"}))
-
-                    # Define progress callback, now including chat_id in its messages
-                    async def progress_callback(data_to_send: Any):
-                        payload_str = ""
-                        if isinstance(data_to_send, str):
-                            payload_str = json.dumps({"status": data_to_send, "chat_id": session_uuid})
-                        elif isinstance(data_to_send, dict):
-                            data_to_send["chat_id"] = session_uuid # Add chat_id
-                            payload_str = json.dumps(data_to_send)
-                        else:
-                            payload_str = json.dumps({"error": "Unexpected data format from backend processing.", "chat_id": session_uuid})
-                        if payload_str:
-                            await manager.send_message(websocket, payload_str)
-                    
-                    # Ensure process_reddit_query is imported correctly
-                    from api.process_query import process_reddit_query 
-                    results = await process_reddit_query(
-                        query_params.subreddit, 
-                        query_params.keyword, 
-                        query_params.question, 
-                        query_params.limit,
-                        0, # repeatHours - not provided by frontend
-                        0, # repeatMinutes - not provided by frontend
-                        progress_callback, # Correct position
-                        query_params.sort_order # Correct position
-                    )
-                    
-                    # Store final results in ChatHistory, linked to ParameterHistory
-                    crud.create_chat_history(
-                        db, 
-                        user_id=current_user.id, 
-                        message=f"Initial analysis: {title}", 
-                        response=json.dumps(results, default=str), 
-                        parameter_history_id=param_history.id
-                    )
-                    # Send final completion message
-                    await manager.send_message(websocket, json.dumps({"status": "Query completed", "results": results, "chat_id": session_uuid}, default=str))
+            # Each message is handled on its own: one failing reports an error frame and the
+            # connection stays open for the next
+            try:
+                if message_type == "new_analysis":
+                    try:
+                        query_params = RedditQuery(**payload_data) # Validate/parse parameters
+                        title = f"r/{query_params.subreddit} - {query_params.keyword}"
+                        # Store parameters with user_id and generated title
+                        ph_create_schema = schemas.ParameterHistoryCreate(parameters=json.dumps(payload_data), title=title)
+                        # Written behind with the job row; the uuid is generated up front so nothing is read back
+                        param_history = history_writer.add_parameter_history(current_user.id, ph_create_schema)
+                        session_uuid = param_history.session_uuid # This is our chat_id for the frontend
+                        history_writer.add_analysis_job(current_user.id, session_uuid, owner_instance=INSTANCE_ID)
 
-                except Exception as e:
-                    # Error specific to new analysis processing
-                    await manager.send_message(websocket, json.dumps({"error": f"Error processing new analysis: {str(e)}", "chat_id": locals().get('session_uuid')})) # locals().get in case session_uuid was set
-
-            elif message_type == "follow_up" and client_chat_id:
-                param_history = crud.get_parameter_history_by_session_uuid(db, session_uuid=client_chat_id)
-                if not param_history or param_history.user_id != current_user.id:
-                    await manager.send_message(websocket, json.dumps({"error": "Invalid or unauthorized chat session ID", "chat_id": client_chat_id}))
-                    continue # Wait for next message
+                        # Acknowledge session start with chat_id
+                        await manager.send_message(websocket, json.dumps({"chat_id": session_uuid, "status": "Analysis session started"}))
+
+                        # Run in the background job runner; this socket is attached to the job's events
+                        # and is free to take other messages meanwhile
+                        job_runner.submit(
+                            session_uuid,
+                            current_user.id,
+                            functools.partial(
+                                run_analysis_job,
+                                user_id=current_user.id,
+                                session_uuid=session_uuid,
+                                title=title,
+                                query_params=query_params,
+                            )
+                        )
+                        await attach_to_job(websocket, session_uuid)
+
+                    except Exception as e:
+                        # Error specific to new analysis processing
+                        await manager.send_message(websocket, json.dumps({"error": f"Error processing new analysis: {str(e)}", "chat_id": locals().get('session_uuid')})) # locals().get in case session_uuid was set
+
+                elif message_type == "attach" and client_chat_id:
+                    # Re-attach to an analysis (e.g. after a reload): replay its events so far, then stream the rest
+                    await history_writer.sync(user_id=current_user.id) # Read-your-writes for this user's queued rows
+                    param_history = await run_db(crud.get_parameter_history_by_session_uuid, session_uuid=client_chat_id)
+                    if not param_history or param_history.user_id != current_user.id:
+                        await manager.send_message(websocket, json.dumps({"error": "Invalid or unauthorized chat session ID", "chat_id": client_chat_id}))
+                        continue
+                    if await attach_to_job(websocket, client_chat_id):
+                        continue
+                    # No longer held anywhere (finished a while ago or before a restart): report the stored status
+                    job_status = await run_db(load_job_status, param_history.id, client_chat_id)
+                    await manager.send_message(websocket, wire.dumps(job_status))
+
+                elif message_type == "follow_up" and client_chat_id:
+                    await history_writer.sync(user_id=current_user.id) # Read-your-writes for this user's queued rows
+                    param_history = await run_db(crud.get_parameter_history_by_session_uuid, session_uuid=client_chat_id)
+                    if not param_history or param_history.user_id != current_user.id:
+                        await manager.send_message(websocket, json.dumps({"error": "Invalid or unauthorized chat session ID", "chat_id": client_chat_id}))
+                        continue # Wait for next message
                 
-                follow_up_query = payload_data.get("query", "")
-                # Placeholder: Actual follow-up processing logic would go here
-                follow_up_response = {"answer": f"Follow-up response to: '{follow_up_query}' for session {client_chat_id}"}
+                    running_job = job_runner.get(client_chat_id)
+                    if running_job is not None and not running_job.done:
+                        await manager.send_message(websocket, json.dumps({"error": "The analysis for this session is still running. Please ask again once it finishes.", "chat_id": client_chat_id}))
+                        continue
+
+                    follow_up_query = payload_data.get("query", "")
+                    session_index = session_indexes.get(client_chat_id)
+                    if session_index is None:
+                        # Evicted or fetched before a restart: rebuild the index from the stored corpus
+                        stored_posts, latest_analysis = await run_db(load_follow_up_context, param_history.id, client_chat_id)
+                        if not stored_posts:
+                            await manager.send_message(websocket, json.dumps({"error": "No stored posts for this session. Please start a new analysis.", "chat_id": client_chat_id}))
+                            continue
+                        session_index = await session_indexes.build(client_chat_id, stored_posts)
+                        session_index.analysis = latest_analysis
+
+                    # Retrieve only the most relevant snippets from the session's corpus
+                    retrieval_started = time.perf_counter()
+                    snippets = session_index.search(follow_up_query)
+                    retrieval_ms = (time.perf_counter() - retrieval_started) * 1000
+
+                    async def send_follow_up_delta(delta: str):
+                        await manager.send_message(websocket, wire.dumps({"type": "analysis_delta", "delta": delta, "chat_id": client_chat_id}))
+
+                    outcome = await answer_follow_up(follow_up_query, snippets, session_index.analysis, on_delta=send_follow_up_delta)
+                    if outcome["analysis"] is None:
+                        await manager.send_message(websocket, json.dumps({"error": "Could not answer the follow-up question right now.", "chat_id": client_chat_id}))
+                        continue
+                    follow_up_response = {
+                        "answer": outcome["analysis"],
+                        "sources": list(dict.fromkeys(f"https://www.reddit.com{snippet['permalink']}" for snippet in snippets if snippet.get("permalink"))),
+                        "snippets_used": len(snippets),
+                        "retrieval_ms": round(retrieval_ms, 2),
+                        "cached": outcome["cached"],
+                    }
                 
-                # Store follow-up Q&A in ChatHistory
-                crud.create_chat_history(
-                    db,
-                    user_id=current_user.id,
-                    message=follow_up_query,
-                    response=json.dumps(follow_up_response),
-                    parameter_history_id=param_history.id
-                )
-                # Send response back to client
-                await manager.send_message(websocket, json.dumps({"results": follow_up_response, "chat_id": client_chat_id}))
+                    # Store follow-up Q&A in ChatHistory, and send the same encoded response back
+                    follow_up_json = wire.dumps(follow_up_response)
+                    history_writer.add_chat_history(current_user.id, follow_up_query, follow_up_json, session_uuid=client_chat_id)
+                    await manager.send_message(websocket, wire.frame_with({"chat_id": client_chat_id}, results=follow_up_json))
             
-            # Handle unknown message types
-            else:
-                await manager.send_message(websocket, json.dumps({"error": "Invalid message type or missing chat_id for follow_up"}))
+                # Handle unknown message types
+                else:
+                    await manager.send_message(websocket, json.dumps({"error": "Invalid message type or missing chat_id for follow_up"}))
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                logging.error(f"WebSocket: failed to handle '{message_type}' message: {str(e)}")
+                await manager.send_message(websocket, json.dumps({"error": f"Could not process the message: {str(e)}", "chat_id": client_chat_id}))
 
     except WebSocketDisconnect:
         manager.disconnect(websocket)
@@ -233,47 +554,191 @@ async def websocket_endpoint(websocket: WebSocket, token: Optional[str] = Query(
         try:
             if websocket.client_state == WebSocketState.CONNECTED: # Check if ws is still connected
                 await websocket.send_text(json.dumps({"error": "An unexpected server error occurred. Please try reconnecting."}))
+                await websocket.close(code=status.WS_1011_INTERNAL_ERROR)
         except Exception as e_send:
             print(f"Error sending WebSocket error message to client: {str(e_send)}")
         # No matter what, ensure disconnection from manager
         manager.disconnect(websocket)
     finally:
-        if db: # Ensure db session is closed
-            db.close()
+        # Jobs keep running without this socket; stop routing their events to it
+        manager.disconnect(websocket)
 
 # --- HTTP API Endpoints for History (ensure get_current_active_user is correctly imported/defined) ---
 from routers.auth import get_current_active_user # This should be okay if auth.py has it
 
+async def get_owned_session(session_uuid: str, current_user: models.User) -> models.ParameterHistory:
+    # 404 for unknown sessions, 403 for other users' sessions
+    await history_writer.sync(user_id=current_user.id) # Read-your-writes for this user's queued rows
+    param_history = await run_db(crud.get_parameter_history_by_session_uuid, session_uuid=session_uuid)
+    if not param_history:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Analysis session not found")
+    if param_history.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this session")
+    return param_history
+
+# --- History listing: keyset cursors and conditional responses ---
+HISTORY_PAGE_SIZE = 100
+
+def encode_history_cursor(created_at: datetime.datetime, row_id: int) -> str:
+    # Opaque to clients: the (created_at, id) of the last row on a page
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor: str):
+    try:
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def history_page_validators(rows, cursor: Optional[str]):
+    """
+    ETag and Last-Modified for one page of the history list. The ETag covers every listed
+    field, so a new, removed or renamed session changes it; Last-Modified is the newest
+    session on the page.
+    """
+    digest = hashlib.sha1((cursor or "").encode())
+    for row in rows:
+        digest.update(f"{row.id}|{row.session_uuid}|{row.title}|{row.created_at.isoformat()}\n".encode())
+    etag = f'"{digest.hexdigest()}"'
+    last_modified = None
+    if rows:
+        newest = max(row.created_at for row in rows)
+        if newest.tzinfo is None: # SQLite drops the zone; timestamps are stored in UTC
+            newest = newest.replace(tzinfo=datetime.timezone.utc)
+        last_modified = newest
+    return etag, last_modified
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime.datetime]) -> bool:
+    # If-None-Match takes precedence; If-Modified-Since is only consulted without it
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            return last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
 @app.get("/api/history", response_model=List[schemas.ParameterHistoryListItem])
 async def get_analysis_history(
-    db: SessionLocal = Depends(get_db), 
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=HISTORY_PAGE_SIZE),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    histories = crud.get_parameter_histories_by_user(db, user_id=current_user.id)
-    return histories
+    """
+    The user's sessions, newest first. Pass the X-Next-Cursor header of a page as `cursor`
+    to get the next one (the header is absent on the last page). Responses carry ETag and
+    Last-Modified, and a matching If-None-Match / If-Modified-Since gets a 304.
+    """
+    before = decode_history_cursor(cursor) if cursor else None
+    await history_writer.sync(user_id=current_user.id)
+    rows = await run_db(crud.get_parameter_histories_by_user, user_id=current_user.id, limit=limit, before=before)
+
+    etag, last_modified = history_page_validators(rows, cursor)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"} # Browsers revalidate on every poll
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    if len(rows) == limit:
+        headers["X-Next-Cursor"] = encode_history_cursor(rows[-1].created_at, rows[-1].id)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return rows
 
 # Define a combined response model for session details + chat log
 class SessionDetailResponse(schemas.ParameterHistoryOut):
-    chat_log: List[schemas.ChatHistoryOut]
+    chat_log: List[schemas.ChatHistoryOut] = Field(validation_alias="chat_entries") # Read straight off the ORM relationship
+
+# --- Session detail cache ---
+SESSION_DETAIL_CACHE_BYTES = int(os.getenv("SESSION_DETAIL_CACHE_BYTES", 32 * 1024 * 1024))
+SESSION_DETAIL_CACHE_TTL = int(os.getenv("SESSION_DETAIL_CACHE_TTL", 3600))
+
+# (session_uuid, include_responses) -> (newest chat row id, serialized SessionDetailResponse)
+session_detail_cache = TTLCache(
+    "session_detail",
+    max_bytes=SESSION_DETAIL_CACHE_BYTES,
+    default_ttl=SESSION_DETAIL_CACHE_TTL,
+    sizeof=lambda entry: len(entry[1]),
+)
+
+def invalidate_session_details(rows):
+    # New chat rows make the cached detail of their session stale
+    for kind, row in rows:
+        if kind == "chat_history" and row.get("parameter_session_uuid"):
+            for include_responses in (True, False):
+                session_detail_cache.invalidate((row["parameter_session_uuid"], include_responses))
+
+history_writer.on_commit(invalidate_session_details)
 
 @app.get("/api/history/{session_uuid}", response_model=SessionDetailResponse)
 async def get_specific_analysis_session(
     session_uuid: str,
-    db: SessionLocal = Depends(get_db),
+    include_responses: bool = True,
     current_user: models.User = Depends(get_current_active_user)
 ):
-    param_history = crud.get_parameter_history_by_session_uuid(db, session_uuid=session_uuid)
-    if not param_history:
+    """
+    A session with its whole chat log. With include_responses=false the chat entries come
+    without their `response` payloads, which are then neither loaded nor decompressed.
+
+    The serialized response is cached per session and checked against the newest chat row
+    id, so a cache hit costs one small query (also correct when another worker appended to
+    the chat) and never re-serializes the log.
+    """
+    await history_writer.sync(user_id=current_user.id) # Read-your-writes for this user's queued rows
+    found = await run_db(crud.get_session_chat_version, session_uuid=session_uuid)
+    if not found:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Analysis session not found")
+    param_history, chat_version = found
     if param_history.user_id != current_user.id:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this session")
-    
-    chat_entries = crud.get_chat_history_for_session(db, parameter_session_uuid=session_uuid)
-    
-    # Use the Pydantic model ParameterHistoryOut to serialize param_history
-    session_details_dict = schemas.ParameterHistoryOut.from_orm(param_history).dict()
-    # Combine with chat_log for the final response
-    return SessionDetailResponse(**session_details_dict, chat_log=chat_entries)
+
+    cache_key = (session_uuid, include_responses)
+    cached = await session_detail_cache.get(cache_key)
+    if cached is not None and cached[0] == chat_version:
+        return Response(content=cached[1], media_type="application/json")
+
+    param_history = await run_db(crud.get_session_with_chat_log, session_uuid=session_uuid, with_responses=include_responses)
+    body = SessionDetailResponse.model_validate(param_history).model_dump_json().encode()
+    # Version from the rows actually serialized, in case one was appended in between
+    loaded_version = max((entry.id for entry in param_history.chat_entries), default=None)
+    await session_detail_cache.set(cache_key, (loaded_version, body))
+    return Response(content=body, media_type="application/json")
+
+@app.get("/api/history/{session_uuid}/posts", response_model=List[schemas.RedditPostOut])
+async def get_session_posts(
+    session_uuid: str,
+    current_user: models.User = Depends(get_current_active_user)
+):
+    param_history = await get_owned_session(session_uuid, current_user)
+    return await run_db(crud.get_session_corpus, parameter_history_id=param_history.id)
+
+@app.get("/api/history/{session_uuid}/job", response_model=schemas.AnalysisJobOut)
+async def get_session_job(
+    session_uuid: str,
+    current_user: models.User = Depends(get_current_active_user)
+):
+    param_history = await get_owned_session(session_uuid, current_user)
+    job = await run_db(crud.get_analysis_job_for_session, parameter_history_id=param_history.id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No analysis job recorded for this session")
+    return job
+
+@app.on_event("shutdown")
+async def shutdown_reddit_client():
+    # Release the pooled keep-alive connections held by the shared Reddit client
+    from api.reddit_fetch import close_reddit_client
+    await refresh_scheduler.stop()
+    await job_runner.shutdown()
+    await history_writer.close() # Flush queued history rows (including the interrupted jobs' statuses)
+    await broker.close()
+    await close_reddit_client()
+    shutdown_db_executor()
 
 @app.get("/test")
 async def test():
@@ -281,10 +746,13 @@ async def test():
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "ok"}
+    from api.reddit_fetch import get_reddit_client
+    reddit = get_reddit_client()
+    return {"status": "ok", "reddit_cache": reddit.cache.stats(), "reddit_rate_limit": reddit.rate_limiter.stats(), "refresh_scheduler": refresh_scheduler.stats(), "analysis_jobs": job_runner.stats(), "history_writer": history_writer.stats(), "session_detail_cache": session_detail_cache.stats(), "token_cache": security.verified_tokens.stats(), "user_cache": security.cached_users.stats()}
 
 if __name__ == "__main__":
     import uvicorn
     # Ensure security module is imported as it's used by get_websocket_user
     # import security # Already imported at the top
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # permessage-deflate compresses frames on the wire for clients that negotiate it (all browsers do)
+    uvicorn.run(app, host="0.0.0.0", port=8000, ws_per_message_deflate=True)
\ No newline at end of file
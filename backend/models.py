@@ -1,7 +1,8 @@
 import datetime
 import uuid
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
-from sqlalchemy.orm import relationship
+import zlib
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Float, Index, LargeBinary, inspect
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.sql import func
 
 from database import Base
@@ -27,12 +28,43 @@ class ChatHistory(Base):
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     parameter_history_id = Column(Integer, ForeignKey("parameter_histories.id"), nullable=True, index=True)
     message = Column(Text, nullable=False)
-    response = Column(Text)
+    # The response payload (results JSON) is stored either as plain text in `response`
+    # (response_format NULL: small payloads and rows written before compression) or
+    # zlib-compressed in `response_data` (response_format "zlib"). Both columns are
+    # deferred: load them with .undefer_group("response") when the payload is needed.
+    response = deferred(Column(Text), group="response")
+    response_data = deferred(Column(LargeBinary, nullable=True), group="response")
+    response_format = Column(String(16), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     user = relationship("User", back_populates="chat_histories")
     parameter_session = relationship("ParameterHistory", back_populates="chat_entries")
 
+    RESPONSE_COMPRESS_MIN_BYTES = 256 # Smaller payloads don't shrink enough to be worth it
+
+    @staticmethod
+    def pack_response(response):
+        """
+        Column values storing a response payload, compressed when that makes it smaller.
+        """
+        if response is None:
+            return {"response": None, "response_data": None, "response_format": None}
+        raw = response.encode("utf-8")
+        if len(raw) >= ChatHistory.RESPONSE_COMPRESS_MIN_BYTES:
+            packed = zlib.compress(raw, 6)
+            if len(packed) < len(raw):
+                return {"response": None, "response_data": packed, "response_format": "zlib"}
+        return {"response": response, "response_data": None, "response_format": None}
+
+    @property
+    def response_text(self):
+        # The decoded payload, or None if it wasn't loaded (deferred) or is empty
+        if "response_data" in inspect(self).unloaded:
+            return None
+        if self.response_format == "zlib":
+            return zlib.decompress(self.response_data).decode("utf-8")
+        return self.response
+
 class ParameterHistory(Base):
     __tablename__ = "parameter_histories"
 
@@ -42,7 +74,83 @@ class ParameterHistory(Base):
     parameters = Column(Text) # Store parameters as JSON string or use JSONB if supported
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     title = Column(String(255), nullable=True) # e.g., "r/uft - bird course"
+    # Scheduled refreshes (repeatHours/repeatMinutes); NULL interval means the session never repeats
+    refresh_interval_seconds = Column(Integer, nullable=True)
+    next_refresh_at = Column(DateTime(timezone=True), nullable=True, index=True)
+    watermark_utc = Column(Float, nullable=True) # Newest post/comment created_utc already analyzed
 
     user = relationship("User", back_populates="parameter_histories")
     # Relationship to associated chat history entries
-    chat_entries = relationship("ChatHistory", back_populates="parameter_session", cascade="all, delete-orphan") 
\ No newline at end of file
+    chat_entries = relationship("ChatHistory", back_populates="parameter_session", cascade="all, delete-orphan", order_by="ChatHistory.created_at")
+    # Reddit posts fetched for this session, in search order
+    session_posts = relationship("SessionPost", back_populates="parameter_session", cascade="all, delete-orphan", order_by="SessionPost.position")
+    session_comments = relationship("SessionComment", cascade="all, delete-orphan")
+
+    # Backs the per-user history listing (newest first, keyset-paginated on created_at, id)
+    __table_args__ = (Index("ix_parameter_histories_user_id_created_at", "user_id", "created_at"),)
+
+class RedditPost(Base):
+    __tablename__ = "reddit_posts"
+
+    id = Column(String(16), primary_key=True) # Reddit's base36 post id, shared by every session that fetched it
+    subreddit = Column(String(100), index=True)
+    title = Column(Text)
+    author = Column(String(100))
+    selftext = Column(Text)
+    score = Column(Integer)
+    num_comments = Column(Integer)
+    permalink = Column(String(512))
+    created_utc = Column(Float)
+    fetched_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    comments = relationship("RedditComment", back_populates="post")
+
+class RedditComment(Base):
+    __tablename__ = "reddit_comments"
+
+    id = Column(String(16), primary_key=True) # Reddit's base36 comment id
+    post_id = Column(String(16), ForeignKey("reddit_posts.id"), nullable=False, index=True)
+    author = Column(String(100))
+    body = Column(Text)
+    score = Column(Integer)
+    created_utc = Column(Float)
+    parent_id = Column(String(20)) # Reddit fullname of the parent: "t3_<post>" or "t1_<comment>"
+    depth = Column(Integer, default=0) # 0 for top-level comments
+
+    post = relationship("RedditPost", back_populates="comments")
+
+class SessionPost(Base):
+    __tablename__ = "session_posts"
+
+    # Composite primary key doubles as the index for "posts of this session" reads
+    parameter_history_id = Column(Integer, ForeignKey("parameter_histories.id"), primary_key=True)
+    reddit_post_id = Column(String(16), ForeignKey("reddit_posts.id"), primary_key=True, index=True)
+    position = Column(Integer, nullable=False) # Order the post appeared in the search results
+
+    parameter_session = relationship("ParameterHistory", back_populates="session_posts")
+    post = relationship("RedditPost") 
+
+class SessionComment(Base):
+    __tablename__ = "session_comments"
+
+    # Which of a post's stored comments this session actually fetched (other sessions may
+    # have fetched more of the same post, e.g. with a deep fetch)
+    parameter_history_id = Column(Integer, ForeignKey("parameter_histories.id"), primary_key=True)
+    reddit_comment_id = Column(String(16), ForeignKey("reddit_comments.id"), primary_key=True, index=True)
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    parameter_history_id = Column(Integer, ForeignKey("parameter_histories.id"), nullable=False, unique=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    status = Column(String(20), nullable=False, default="queued") # queued, running, completed, failed, interrupted
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+    # The worker instance running the job, and when it last confirmed it still is
+    owner_instance = Column(String(128), nullable=True, index=True)
+    heartbeat_at = Column(DateTime(timezone=True), nullable=True)
+
+    parameter_session = relationship("ParameterHistory")
@@ -5,7 +5,7 @@ from typing import List, Optional
 import logging # Add logging import
 
 import crud, schemas, security, models
-from database import get_db, engine
+from database import get_db, engine, run_db
 
 # Create database tables if they don't exist
 # In a production app, you might use Alembic for migrations
@@ -19,7 +19,19 @@ router = APIRouter(
 # For HTTP routes, defines how the token is extracted (from Authorization header)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/sync-user") # Point to your token-issuing endpoint
 
-async def get_current_active_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> models.User:
+async def load_user(user_id: int) -> Optional[models.User]:
+    """
+    The user with this id, from security.cached_users when possible, otherwise from the
+    database (off the event loop, in a short-lived session) and then cached.
+    """
+    user = security.cached_users.get(user_id)
+    if user is None:
+        user = await run_db(crud.get_user_by_id, user_id)
+        if user is not None:
+            security.cache_user(user)
+    return user
+
+async def get_current_active_user(token: str = Depends(oauth2_scheme)) -> models.User:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -32,7 +44,7 @@ async def get_current_active_user(token: str = Depends(oauth2_scheme), db: Sessi
     except security.JWTError: # Catch JWTError from security.verify_token
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.id == token_data.user_id).first()
+    user = await load_user(token_data.user_id) # Usually a memory lookup; see load_user
     if user is None:
         raise credentials_exception
     # Add any other checks like user.is_active if you have such a field
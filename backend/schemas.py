@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import Optional, List, Any, Dict
 from datetime import datetime
 
@@ -33,11 +33,12 @@ class TokenData(BaseModel):
 class ChatHistoryOut(BaseModel):
     id: int
     message: str
-    response: str | None = None
+    response: str | None = Field(None, validation_alias="response_text") # Decompressed; None when not loaded
     created_at: datetime
 
     class Config:
         from_attributes = True
+        populate_by_name = True
 
 # Schemas for ParameterHistory
 class ParameterHistoryBase(BaseModel):
@@ -57,10 +58,40 @@ class ParameterHistoryOut(ParameterHistoryBase):
     class Config:
         from_attributes = True
 
+class AnalysisJobOut(BaseModel):
+    status: str
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
 class ParameterHistoryListItem(BaseModel):
     session_uuid: str # The chat_id
     title: Optional[str] = None # Title can be optional
     created_at: datetime
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+# Schemas for the stored Reddit corpus of a session
+class RedditCommentOut(BaseModel):
+    id: str
+    author: Optional[str] = None
+    body: Optional[str] = None
+    score: Optional[int] = None
+    created_utc: Optional[float] = None
+    parent_id: Optional[str] = None
+    depth: Optional[int] = 0
+
+class RedditPostOut(BaseModel):
+    id: str
+    title: Optional[str] = None
+    author: Optional[str] = None
+    selftext: Optional[str] = None
+    score: Optional[int] = None
+    num_comments: Optional[int] = None
+    permalink: Optional[str] = None
+    created_utc: Optional[float] = None
+    comments: List[RedditCommentOut] = []
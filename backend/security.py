@@ -1,4 +1,6 @@
 import os
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
@@ -15,12 +17,60 @@ SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
+# --- Auth Cache Configuration ---
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 4096))  # verified tokens kept (each until its exp)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 4096))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", 60))  # seconds a looked-up user is reused
+
 if not SECRET_KEY:
     raise ValueError("JWT_SECRET_KEY environment variable not set")
 
 # We don't need password hashing here as auth is via OAuth, but keeping context setup for potential future use
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+class ExpiringLRU:
+    """
+    Small in-memory LRU map whose entries each carry their own expiry (epoch seconds).
+    Used to skip re-verifying tokens and re-loading users on every request.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+# token -> TokenData, until the token's exp
+verified_tokens = ExpiringLRU(TOKEN_CACHE_SIZE)
+# user id -> detached models.User, for USER_CACHE_TTL (dropped by crud.update_user)
+cached_users = ExpiringLRU(USER_CACHE_SIZE)
+
+def cache_user(user):
+    cached_users.put(user.id, user, time.time() + USER_CACHE_TTL)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -32,6 +82,10 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
     return encoded_jwt
 
 def verify_token(token: str, credentials_exception) -> schemas.TokenData:
+    # A token that verified before is good until its exp; skip the signature check
+    token_data = verified_tokens.get(token)
+    if token_data is not None:
+        return token_data
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: Optional[str] = payload.get("sub") # Assuming user_id is stored in 'sub'
@@ -40,4 +94,6 @@ def verify_token(token: str, credentials_exception) -> schemas.TokenData:
         token_data = schemas.TokenData(user_id=int(user_id))
     except JWTError:
         raise credentials_exception
-    return token_data 
\ No newline at end of file
+    if payload.get("exp") is not None: # Tokens without an expiry are never cached
+        verified_tokens.put(token, token_data, float(payload["exp"]))
+    return token_data
@@ -0,0 +1,100 @@
+"""
+Shared setup for the backend tests: a throwaway SQLite database and dummy secrets, set
+before any app module reads its configuration at import time.
+
+    cd backend && python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)  # modules import each other as top-level names (crud, models, api.*)
+
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'tests.db')}"
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret")
+os.environ.setdefault("OPENAI_KEY", "test-key")
+
+import models  # noqa: E402  (registers the tables)
+import security  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+
+@pytest.fixture
+def db():
+    """
+    A session on the test database, whose tables are emptied again after the test.
+    """
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        with engine.begin() as connection:
+            for table in reversed(Base.metadata.sorted_tables):
+                connection.execute(table.delete())
+
+@pytest.fixture
+def user(db):
+    db_user = models.User(email="tester@example.com", name="Tester", provider="google", provider_account_id="tester-1")
+    db.add(db_user)
+    db.commit()
+    return db_user
+
+@pytest.fixture
+def token(user):
+    return security.create_access_token({"sub": str(user.id)})
+
+@pytest.fixture(scope="session")
+def client():
+    """
+    One running app for the whole session: its startup/shutdown hooks own process-wide
+    state (the DB thread pool, the history writer, the broker) that can only start once.
+    """
+    from fastapi.testclient import TestClient
+    import main
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+class FakeCompletions:
+    """
+    Stands in for AsyncOpenAI().chat.completions: streamed requests yield `reply` in a few
+    deltas, others return it whole. Every request is recorded in `requests`.
+    """
+
+    def __init__(self, reply):
+        self.reply = reply
+        self.requests = []
+
+    async def create(self, stream=False, **request):
+        self.requests.append(request)
+        reply = self.reply(request) if callable(self.reply) else self.reply
+        if stream:
+            return self._stream(reply)
+        message = type("Message", (), {"content": reply})
+        return type("Response", (), {"choices": [type("Choice", (), {"message": message})]})
+
+    async def _stream(self, reply):
+        words = reply.split(" ")
+        for n, word in enumerate(words):
+            delta = type("Delta", (), {"content": word + (" " if n < len(words) - 1 else "")})
+            yield type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})]})
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """
+    Replaces the OpenAI client and the LLM result cache of api.ai_analysis. Set
+    `fake_openai.reply` to a string, or a callable taking the request, before use.
+    """
+    import api.ai_analysis
+    from api.cache import TTLCache
+
+    completions = FakeCompletions("The bird course is the easy one.")
+    client = type("FakeAsyncOpenAI", (), {"api_key": "test-key"})()
+    client.chat = type("Chat", (), {"completions": completions})()
+    monkeypatch.setattr(api.ai_analysis, "async_client", client)
+    monkeypatch.setattr(api.ai_analysis, "llm_cache", TTLCache("llm-test", max_bytes=1024 * 1024, default_ttl=60))
+    return completions
@@ -0,0 +1,35 @@
+import asyncio
+
+import api.process_query
+from api.ai_analysis import analyze_reddit_content_async
+from api.corpus import Comment, Post
+from api.process_query import process_reddit_query
+
+def test_analysis_is_forwarded_delta_by_delta(fake_openai):
+    posts = [Post(id="p1", title="Bird course?", comments=[Comment(id="c1", body="AST101", score=5)])]
+    deltas = []
+
+    async def on_delta(delta):
+        deltas.append(delta)
+
+    outcome = asyncio.run(analyze_reddit_content_async("Which course?", posts, on_delta=on_delta, mode="single"))
+    assert len(deltas) > 1 and "".join(deltas) == outcome["analysis"]
+    assert outcome["time_to_first_token"] is not None
+
+def test_pipeline_sends_analysis_delta_frames_before_the_result(monkeypatch, fake_openai):
+    class OnePostReddit:
+        async def search_subreddit(self, subreddit, keyword, limit, sort_order="hot", on_wait=None):
+            return [Post(id="p1", title="Bird course?", permalink="/r/uft/comments/p1/")]
+
+        async def get_post_content(self, post_id, subreddit, on_wait=None, deep=False):
+            return [Comment(id="c1", body="AST101", score=5)]
+
+    monkeypatch.setattr(api.process_query, "get_reddit_client", lambda: OnePostReddit())
+    frames = []
+
+    async def collect(frame):
+        frames.append(frame)
+
+    results = asyncio.run(process_reddit_query("uft", "bird", "Which course?", 1, 0, 0, collect))
+    deltas = [frame["delta"] for frame in frames if isinstance(frame, dict) and frame.get("type") == "analysis_delta"]
+    assert "".join(deltas) == results["analysis"] == "The bird course is the easy one."
@@ -0,0 +1,69 @@
+import asyncio
+import datetime
+
+import pytest
+from fastapi import HTTPException
+
+import crud
+import security
+from routers.auth import load_user
+
+@pytest.fixture(autouse=True)
+def fresh_caches(monkeypatch):
+    # Row ids are reused between tests, so cached users must not leak across them
+    monkeypatch.setattr(security, "verified_tokens", security.ExpiringLRU(16))
+    monkeypatch.setattr(security, "cached_users", security.ExpiringLRU(16))
+
+def test_entries_expire_and_the_least_recently_used_is_evicted(monkeypatch):
+    cache = security.ExpiringLRU(2)
+    now = 1000.0
+    monkeypatch.setattr(security.time, "time", lambda: now)
+    cache.put("a", 1, now + 10)
+    cache.put("b", 2, now + 10)
+    assert cache.get("a") == 1
+    cache.put("c", 3, now + 10)
+    assert cache.get("b") is None and cache.get("a") == 1
+    now += 11
+    assert cache.get("a") is None
+    assert cache.stats() == {"entries": 1, "hits": 2, "misses": 2}
+
+def test_a_verified_token_skips_the_signature_check(monkeypatch):
+    token = security.create_access_token({"sub": "7"})
+    unauthorized = HTTPException(status_code=401)
+    assert security.verify_token(token, unauthorized).user_id == 7
+
+    def no_decode(*args, **kwargs):
+        raise AssertionError("token decoded again")
+
+    monkeypatch.setattr(security.jwt, "decode", no_decode)
+    assert security.verify_token(token, unauthorized).user_id == 7
+
+def test_invalid_and_expiry_less_tokens_are_not_cached():
+    unauthorized = HTTPException(status_code=401)
+    with pytest.raises(HTTPException):
+        security.verify_token("not-a-jwt", unauthorized)
+    without_exp = security.jwt.encode({"sub": "7"}, security.SECRET_KEY, algorithm=security.ALGORITHM)
+    assert security.verify_token(without_exp, unauthorized).user_id == 7
+    assert security.verified_tokens.stats()["entries"] == 0
+
+    expired = security.create_access_token({"sub": "7"}, expires_delta=datetime.timedelta(seconds=-1))
+    with pytest.raises(HTTPException):
+        security.verify_token(expired, unauthorized)
+
+def test_users_are_loaded_once_and_reloaded_after_an_update(monkeypatch, client, user):
+    lookups = []
+    get_user_by_id = crud.get_user_by_id
+
+    def counting_lookup(db, user_id):
+        lookups.append(user_id)
+        return get_user_by_id(db, user_id)
+
+    monkeypatch.setattr(crud, "get_user_by_id", counting_lookup)
+    assert asyncio.run(load_user(user.id)).name == "Tester"
+    assert asyncio.run(load_user(user.id)).name == "Tester"
+    assert lookups == [user.id]
+
+    response = client.post("/api/v1/auth/sync-user", json={"email": user.email, "name": "Renamed", "provider": "google", "provider_account_id": "tester-1"})
+    assert response.status_code == 200
+    assert asyncio.run(load_user(user.id)).name == "Renamed"
+    assert lookups == [user.id, user.id]
@@ -0,0 +1,217 @@
+"""
+Tests for the Redis broker and the ConnectionManager's chat delivery, run against an
+in-memory stand-in for redis.asyncio (no Redis server needed).
+"""
+import asyncio
+import json
+
+import main
+from api.broker import RedisBroker
+
+class FakePubSub:
+    def __init__(self, server):
+        self.server = server
+        self.queue = asyncio.Queue()
+        self.channels = set()
+        self.closed = False
+
+    async def subscribe(self, channel):
+        self.channels.add(channel)
+        self.server.subscribers.append(self)
+        await self.queue.put({"type": "subscribe", "channel": channel, "data": 1})
+
+    async def unsubscribe(self, channel):
+        self.channels.discard(channel)
+        if self in self.server.subscribers:
+            self.server.subscribers.remove(self)
+
+    async def listen(self):
+        while True:
+            message = await self.queue.get()
+            if isinstance(message, Exception):
+                raise message
+            yield message
+
+    async def aclose(self):
+        self.closed = True
+        await self.unsubscribe(next(iter(self.channels), None))
+
+class FakePipeline:
+    def __init__(self, server):
+        self.server = server
+        self.commands = []
+
+    def __getattr__(self, name):
+        # Commands are queued and sent together by execute()
+        def queue(*args):
+            self.commands.append((name, args))
+            return self
+        return queue
+
+    async def execute(self):
+        self.server.round_trips += 1
+        return [await getattr(self.server, name)(*args) for name, args in self.commands]
+
+class FakeRedis:
+    """
+    The subset of redis.asyncio.Redis the broker uses. Every broker built on the same
+    instance behaves like a worker connected to the same Redis server.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.lists = {}
+        self.ttls = {}
+        self.round_trips = 0
+
+    def pubsub(self):
+        return FakePubSub(self)
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def drop_connections(self):
+        for pubsub in list(self.subscribers):
+            await pubsub.queue.put(ConnectionError("Connection closed by server."))
+
+    async def publish(self, channel, data):
+        receivers = [pubsub for pubsub in self.subscribers if channel in pubsub.channels]
+        for pubsub in receivers:
+            await pubsub.queue.put({"type": "message", "channel": channel, "data": data.encode("utf-8")})
+        return len(receivers)
+
+    async def rpush(self, key, value):
+        self.lists.setdefault(key, []).append(value.encode("utf-8"))
+        return len(self.lists[key])
+
+    async def expire(self, key, seconds):
+        self.ttls[key] = seconds
+        return True
+
+    async def lrange(self, key, start, end):
+        values = self.lists.get(key, [])
+        return values[start:] if end == -1 else values[start:end + 1]
+
+class FakeWebSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        pass
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+    async def send_bytes(self, message):
+        raise AssertionError("json sockets only")
+
+async def settle():
+    # Lets the listener tasks drain what was published
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+def frame(seq):
+    return json.dumps({"status": f"step {seq}", "chat_id": "chat-1"})
+
+async def start_worker(server):
+    manager = main.ConnectionManager()
+    broker = RedisBroker(client=server, channel="test-events", log_ttl=60, reconnect_delay=0)
+    await broker.start(manager.deliver)
+    return manager, broker
+
+def test_publish_reaches_sockets_on_other_workers():
+    async def scenario():
+        server = FakeRedis()
+        _, job_worker = await start_worker(server)
+        manager, socket_worker = await start_worker(server)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, user_id=7)
+        manager.join_chat(websocket, "chat-1", 0)
+
+        await job_worker.publish_to_chat("chat-1", frame(0), seq=0)
+        await job_worker.publish_to_user(7, json.dumps({"status": "Scheduled update"}))
+        await job_worker.publish_to_user(8, json.dumps({"status": "someone else"}))
+        await settle()
+
+        assert websocket.sent == [{"status": "step 0", "chat_id": "chat-1"}, {"status": "Scheduled update"}]
+        # Sequenced chat frames are logged for replay, with the configured TTL
+        assert await job_worker.history("chat-1") == [frame(0)]
+        assert server.ttls == {"test-events:log:chat-1": 60}
+        # One round trip per published frame
+        assert server.round_trips == 3
+
+        await job_worker.close()
+        await socket_worker.close()
+
+    asyncio.run(scenario())
+
+def test_listener_resubscribes_after_the_connection_drops():
+    async def scenario():
+        server = FakeRedis()
+        _, job_worker = await start_worker(server)
+        manager, socket_worker = await start_worker(server)
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, user_id=7)
+
+        await server.drop_connections()
+        await settle()
+        assert socket_worker.reconnects == 1 and job_worker.reconnects == 1
+        assert socket_worker._listener is not None and not socket_worker._listener.done()
+
+        await job_worker.publish_to_user(7, json.dumps({"status": "after reconnect"}))
+        await settle()
+        assert websocket.sent == [{"status": "after reconnect"}]
+
+        await job_worker.close()
+        await socket_worker.close()
+        assert server.subscribers == []
+
+    asyncio.run(scenario())
+
+def test_attach_replays_the_log_then_live_frames(monkeypatch):
+    async def scenario():
+        server = FakeRedis()
+        _, job_worker = await start_worker(server)
+        manager, socket_worker = await start_worker(server)
+        monkeypatch.setattr(main, "manager", manager)
+        monkeypatch.setattr(main, "broker", socket_worker)
+        for seq in range(2):
+            await job_worker.publish_to_chat("chat-1", frame(seq), seq=seq)
+        await settle()
+
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, user_id=7)
+        assert await main.attach_to_job(websocket, "chat-1")
+        await job_worker.publish_to_chat("chat-1", frame(2), seq=2)
+        await settle()
+
+        assert [sent["status"] for sent in websocket.sent] == ["step 0", "step 1", "step 2"]
+        assert not await main.attach_to_job(FakeWebSocket(), "unknown-chat")
+
+        await job_worker.close()
+        await socket_worker.close()
+
+    asyncio.run(scenario())
+
+def test_seq_cursor_drops_frames_already_replayed():
+    async def scenario():
+        manager = main.ConnectionManager()
+        websocket = FakeWebSocket()
+        await manager.connect(websocket, user_id=7)
+        manager.join_chat(websocket, "chat-1")
+
+        # Live frames arriving while the log is replayed are held, including ones the log has too
+        await manager.deliver({"scope": "chat", "key": "chat-1", "seq": 1, "frame": frame(1)})
+        await manager.deliver({"scope": "chat", "key": "chat-1", "seq": 2, "frame": frame(2)})
+        assert websocket.sent == []
+        await manager.release_chat(websocket, "chat-1", [frame(0), frame(1)])
+        assert [sent["status"] for sent in websocket.sent] == ["step 0", "step 1", "step 2"]
+        assert manager.sockets_by_chat["chat-1"][websocket] == 3
+
+        # Duplicates and stale frames after the replay are dropped too; unsequenced ones always pass
+        await manager.deliver({"scope": "chat", "key": "chat-1", "seq": 2, "frame": frame(2)})
+        await manager.deliver({"scope": "chat", "key": "chat-1", "seq": None, "frame": frame(9)})
+        await manager.deliver({"scope": "chat", "key": "chat-1", "seq": 3, "frame": frame(3)})
+        assert [sent["status"] for sent in websocket.sent] == ["step 0", "step 1", "step 2", "step 9", "step 3"]
+
+    asyncio.run(scenario())
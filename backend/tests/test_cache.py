@@ -0,0 +1,58 @@
+import asyncio
+import sqlite3
+import time
+
+from api.cache import DiskCacheStore, TTLCache, make_cache_key
+
+def count_rows(path):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+
+def test_expired_disk_entries_are_purged_every_n_writes(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    store = DiskCacheStore(path, purge_every=3)
+    past = time.time() - 1
+    store.set("old-1", past, '"a"')
+    store.set("old-2", past, '"b"')
+    assert count_rows(path) == 2
+    assert store.get("old-1") is None  # expired rows are skipped on read...
+
+    store.set("fresh", time.time() + 60, '"c"')  # ...and deleted on the third write
+    assert count_rows(path) == 1
+    assert store.get("fresh")[1] == '"c"'
+
+def test_expired_disk_entries_are_purged_when_the_store_opens(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    store = DiskCacheStore(path)
+    store.set("old", time.time() - 1, '"a"')
+    store.set("fresh", time.time() + 60, '"b"')
+    assert count_rows(path) == 2
+
+    DiskCacheStore(path)  # e.g. a worker restart
+    assert count_rows(path) == 1
+    assert store.purge_expired() == 0
+
+def test_ttl_cache_evicts_least_recently_used_and_reads_through_disk(tmp_path):
+    async def scenario():
+        store = DiskCacheStore(str(tmp_path / "cache.sqlite3"))
+        cache = TTLCache("test", max_bytes=20, default_ttl=60, disk_store=store)
+        await cache.set("a", "x" * 8)  # 10 bytes of JSON each
+        await cache.set("b", "y" * 8)
+        assert await cache.get("a") == "x" * 8  # a is now the most recent
+        await cache.set("c", "z" * 8)
+        assert list(cache._entries) == ["a", "c"]
+        assert cache.evictions == 1
+
+        # Evicted from memory, still on disk
+        assert await cache.get("b") == "y" * 8
+        assert cache.stats()["disk_hits"] == 1
+
+        await cache.set("short", "v", ttl=-1)
+        assert await cache.get("short") is None
+        assert cache.stats()["misses"] == 1
+
+    asyncio.run(scenario())
+
+def test_cache_keys_ignore_case_and_whitespace():
+    assert make_cache_key("search", keyword=" Bird  Course") == make_cache_key("search", keyword="bird course")
+    assert make_cache_key("search", keyword="bird") != make_cache_key("comments", keyword="bird")
@@ -0,0 +1,43 @@
+import json
+
+import crud
+import models
+import schemas
+
+def new_session(db, user):
+    return crud.create_parameter_history(db, user.id, schemas.ParameterHistoryCreate(parameters="{}"))
+
+def test_large_payloads_are_compressed_and_small_ones_kept_plain():
+    large = json.dumps({"analysis": "AST101 is the bird course. " * 50})
+    packed = models.ChatHistory.pack_response(large)
+    assert packed["response"] is None and packed["response_format"] == "zlib"
+    assert len(packed["response_data"]) < len(large)
+    assert models.ChatHistory(**packed).response_text == large
+
+    assert models.ChatHistory.pack_response('{"analysis": "AST101"}') == {"response": '{"analysis": "AST101"}', "response_data": None, "response_format": None}
+    assert models.ChatHistory.pack_response(None)["response"] is None
+
+def test_payloads_are_only_loaded_when_asked_for(db, user):
+    session = new_session(db, user)
+    large = json.dumps({"analysis": "Take AST101. " * 100})
+    crud.create_chat_history(db, user.id, "Which course?", large, parameter_history_id=session.id)
+    crud.create_chat_history(db, user.id, "And GGR100?", json.dumps({"analysis": "Also easy."}), parameter_history_id=session.id)
+    db.expire_all()
+
+    without = crud.get_chat_history_for_session(db, session.session_uuid)
+    assert [entry.message for entry in without] == ["Which course?", "And GGR100?"]
+    assert all(entry.response_text is None for entry in without)
+
+    db.expire_all()
+    loaded = crud.get_chat_history_for_session(db, session.session_uuid, with_responses=True)
+    assert [entry.response_format for entry in loaded] == ["zlib", None]
+    assert loaded[0].response_text == large
+    assert crud.get_latest_session_analysis(db, session.session_uuid) == "Also easy."
+
+def test_chat_version_tracks_the_newest_row(db, user):
+    session = new_session(db, user)
+    assert crud.get_session_chat_version(db, session.session_uuid)[1] is None
+    entry = crud.create_chat_history(db, user.id, "Which course?", "{}", parameter_history_id=session.id)
+    found, version = crud.get_session_chat_version(db, session.session_uuid)
+    assert found.id == session.id and version == entry.id
+    assert crud.get_session_chat_version(db, "no-such-session") is None
@@ -0,0 +1,71 @@
+import asyncio
+
+from api.coalesce import AnalysisCoalescer
+
+def test_identical_concurrent_analyses_share_one_run():
+    async def scenario():
+        coalescer = AnalysisCoalescer()
+        key = coalescer.key_for(subreddit="uft", keyword="bird", question="Which course?")
+        assert key == coalescer.key_for(subreddit="UFT", keyword=" bird", question="which course?")
+        runs = []
+        halfway = asyncio.Event()
+        finish = asyncio.Event()
+
+        async def pipeline(progress):
+            runs.append(1)
+            await progress({"status": "step 1"})
+            halfway.set()
+            await finish.wait()
+            await progress({"status": "step 2"})
+            return {"analysis": "shared"}
+
+        first_frames, second_frames = [], []
+
+        async def first(event):
+            first_frames.append(event)
+
+        async def second(event):
+            second_frames.append(event)
+
+        first_run = asyncio.create_task(coalescer.run(key, first, pipeline))
+        await halfway.wait()
+        assert coalescer.is_running(key)
+        second_run = asyncio.create_task(coalescer.run(key, second, pipeline))
+        await asyncio.sleep(0)
+        finish.set()
+        results = await asyncio.gather(first_run, second_run)
+
+        assert len(runs) == 1 and results == [{"analysis": "shared"}] * 2
+        assert first_frames == [{"status": "step 1"}, {"status": "step 2"}]
+        # The late subscriber is told it joined, replayed step 1, then gets step 2 live
+        assert second_frames[0].startswith("Someone asked the exact same thing")
+        assert second_frames[1:] == [{"status": "step 1"}, {"status": "step 2"}]
+        # Each subscriber gets its own copy to stamp its chat_id on
+        assert first_frames[1] is not second_frames[2]
+        assert not coalescer.is_running(key)
+
+    asyncio.run(scenario())
+
+def test_a_failing_subscriber_is_dropped_without_stopping_the_run():
+    async def scenario():
+        coalescer = AnalysisCoalescer()
+        received = []
+
+        async def closed_socket(event):
+            raise ConnectionError("socket closed")
+
+        async def pipeline(progress):
+            await progress({"status": "step 1"})
+            await progress({"status": "step 2"})
+            return "done"
+
+        async def healthy(event):
+            received.append(event)
+
+        key = coalescer.key_for(question="q")
+        shared_run = asyncio.create_task(coalescer.run(key, closed_socket, pipeline))
+        assert await shared_run == "done"
+        assert await coalescer.run(key, healthy, pipeline) == "done"  # a fresh run afterwards
+        assert received == [{"status": "step 1"}, {"status": "step 2"}]
+
+    asyncio.run(scenario())
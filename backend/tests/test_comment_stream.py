@@ -0,0 +1,70 @@
+import asyncio
+
+from api.comment_stream import CommentBatcher
+from api.corpus import Comment
+
+POST = {"id": "p1", "title": "Bird course?", "author": "op"}
+
+def comment(n):
+    return Comment(id=f"c{n}", body=f"comment {n}")
+
+def test_batches_flush_at_size_and_on_close():
+    async def scenario():
+        frames = []
+
+        async def send(frame):
+            frames.append(frame)
+
+        batcher = CommentBatcher(send, window=60, min_size=3, max_size=3)
+        for n in range(7):
+            await batcher.add(POST, comment(n))
+        assert [len(frame["comments"]) for frame in frames] == [3, 3]
+        await batcher.close()
+        assert [len(frame["comments"]) for frame in frames] == [3, 3, 1]
+        assert frames[0]["type"] == "comment_batch"
+        assert frames[0]["comments"][0] == {"post": POST, "comment": comment(0).to_dict()}
+        assert (batcher.frames_sent, batcher.comments_sent) == (3, 7)
+
+    asyncio.run(scenario())
+
+def test_a_partial_batch_is_flushed_after_the_window():
+    async def scenario():
+        frames = []
+
+        async def send(frame):
+            frames.append(frame)
+
+        batcher = CommentBatcher(send, window=0.01, min_size=10)
+        await batcher.add(POST, comment(0))
+        assert frames == []
+        await asyncio.sleep(0.05)
+        assert len(frames) == 1 and len(frames[0]["comments"]) == 1
+        await batcher.close()
+        assert len(frames) == 1
+
+    asyncio.run(scenario())
+
+def test_batch_size_follows_the_drain_rate():
+    batcher = CommentBatcher(None, window=0.25, min_size=5, max_size=200)
+    batcher._adapt(sent=10, elapsed=0.001)  # fast socket: 10k comments/s
+    assert batcher.batch_size == 200
+    batcher._adapt(sent=10, elapsed=1.0)  # slow socket: 10 comments/s
+    assert batcher.batch_size == 5
+    batcher._adapt(sent=40, elapsed=0.25)  # 160/s -> 40 per window
+    assert batcher.batch_size == 40
+
+def test_send_failures_in_the_window_flush_surface_on_the_next_call():
+    async def scenario():
+        async def closed_socket(frame):
+            raise ConnectionError("socket closed")
+
+        batcher = CommentBatcher(closed_socket, window=0.01, min_size=10)
+        await batcher.add(POST, comment(0))
+        await asyncio.sleep(0.05)
+        try:
+            await batcher.add(POST, comment(1))
+        except ConnectionError:
+            return True
+        return False
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+from api.corpus import Comment, Post, approx_size, newest_created_utc, records_from_json
+
+def test_records_have_no_instance_dict_and_read_like_dicts():
+    comment = Comment(id="c1", author="alice", body="AST101", score=5, parent_id="t3_p1")
+    assert not hasattr(comment, "__dict__")
+    assert comment["body"] == "AST101" and comment.get("score") == 5
+    assert comment.get("missing", "fallback") == "fallback" and "depth" in comment and "missing" not in comment
+    with pytest.raises(KeyError):
+        comment["missing"]
+    assert comment.author is Comment(author="".join(["ali", "ce"])).author  # interned
+
+def test_json_round_trip_of_posts_and_comments():
+    post = Post(id="p1", title="Bird course?", score=3, created_utc=100.0, comments=[Comment(id="c1", body="AST101", depth=1)])
+    data = json.loads(json.dumps(post.to_dict()))
+    assert data["comments"][0] == {"id": "c1", "author": None, "body": "AST101", "score": None, "created_utc": None, "parent_id": None, "depth": 1}
+    assert "comments" not in post.to_dict(include_comments=False)
+
+    restored = records_from_json([data, data["comments"][0]])
+    assert isinstance(restored[0], Post) and isinstance(restored[1], Comment)
+    assert restored[0].to_dict() == post.to_dict()
+
+def test_with_comments_leaves_the_original_untouched():
+    post = Post(id="p1", title="Bird course?", comments=[Comment(id="c1")])
+    copy = post.with_comments([Comment(id="c2")])
+    assert [c.id for c in post.comments] == ["c1"] and [c.id for c in copy.comments] == ["c2"]
+    assert copy.title == "Bird course?"
+
+def test_size_estimate_and_watermark():
+    post = Post(id="p1", title="x" * 100, created_utc=10.0, comments=[Comment(id="c1", body="y" * 50, created_utc=30.0), Comment(id="c2")])
+    assert approx_size([post]) > 150 + 50
+    assert newest_created_utc([post]) == 30.0
+    assert newest_created_utc([], default=5.0) == 5.0
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+import pytest
+
+import crud
+import models
+from database import run_db
+
+def test_run_db_works_off_the_event_loop_in_a_short_lived_session(user):
+    async def scenario():
+        loop_thread = threading.get_ident()
+
+        def unit_of_work(db, user_id):
+            return threading.get_ident(), db, crud.get_user_by_id(db, user_id)
+
+        worker_thread, session, found = await run_db(unit_of_work, user.id)
+        assert worker_thread != loop_thread
+        assert found.email == user.email  # still readable after its session closed
+        assert session.get_bind() is not None and not session.in_transaction()
+
+    asyncio.run(scenario())
+
+def test_run_db_rolls_back_a_failed_unit_of_work(db, user):
+    def add_then_fail(session):
+        session.add(models.ParameterHistory(user_id=user.id, parameters="{}"))
+        session.flush()
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_db(add_then_fail))
+    assert db.query(models.ParameterHistory).count() == 0
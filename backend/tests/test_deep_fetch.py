@@ -0,0 +1,87 @@
+import asyncio
+
+import httpx
+import pytest
+
+import api.reddit_fetch
+from api.rate_limit import RedditRateLimiter
+from api.reddit_fetch import RedditClient, walk_comment_tree
+
+def t1(comment_id, parent_id, depth, replies=(), body=None):
+    data = {"id": comment_id, "body": body or f"body {comment_id}", "parent_id": parent_id, "depth": depth, "score": 1}
+    data["replies"] = {"data": {"children": list(replies)}} if replies else ""
+    return {"kind": "t1", "data": data}
+
+def more(*ids, depth=0):
+    return {"kind": "more", "data": {"children": list(ids), "depth": depth}}
+
+@pytest.fixture(autouse=True)
+def reddit_credentials(monkeypatch):
+    monkeypatch.setattr(api.reddit_fetch, "CLIENT_ID", "client-id")
+    monkeypatch.setattr(api.reddit_fetch, "CLIENT_SECRET", "client-secret")
+
+def make_client(handler):
+    client = RedditClient(retry_backoff=0)
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client.rate_limiter = RedditRateLimiter(rate=1000, burst=100)
+    return client
+
+def test_walk_flattens_replies_depth_first_within_the_caps():
+    tree = [
+        t1("a", "t3_p1", 0, replies=[t1("a1", "t1_a", 1, replies=[t1("a11", "t1_a1", 2)]), more("x", "y", depth=1)]),
+        t1("b", "t3_p1", 0, body="[deleted]", replies=[t1("b1", "t1_b", 1)]),
+    ]
+    comments, stubs = [], []
+    walk_comment_tree(tree, comments, stubs, max_depth=1, max_comments=100)
+    assert [(c.id, c.depth, c.parent_id) for c in comments] == [("a", 0, "t3_p1"), ("a1", 1, "t1_a"), ("b1", 1, "t1_b")]
+    assert stubs == [{"children": ["x", "y"], "depth": 1}]
+
+    comments, stubs = [], []
+    walk_comment_tree(tree, comments, stubs, max_depth=8, max_comments=2)
+    assert [c.id for c in comments] == ["a", "a1"]
+
+def test_deep_fetch_expands_more_stubs_with_batched_morechildren(monkeypatch):
+    monkeypatch.setattr(api.reddit_fetch, "MORECHILDREN_BATCH", 2)
+    morechildren_batches = []
+
+    def handler(request):
+        if request.url.path == "/api/v1/access_token":
+            return httpx.Response(200, json={"access_token": "token-1", "expires_in": 3600})
+        if request.url.path == "/api/morechildren":
+            ids = request.url.params["children"].split(",")
+            morechildren_batches.append(ids)
+            assert request.url.params["link_id"] == "t3_p1"
+            things = [t1(comment_id, "t1_a", 1) for comment_id in ids]
+            if ids == ["m1", "m2"]:
+                things.append(more("m4", depth=1))  # a stub inside the expansion
+            return httpx.Response(200, json={"json": {"data": {"things": things}}})
+        assert request.url.params["depth"] == str(api.reddit_fetch.DEEP_FETCH_MAX_DEPTH + 1)
+        listing = [t1("a", "t3_p1", 0, replies=[more("m1", "m2", "m3", depth=1)])]
+        return httpx.Response(200, json=[{}, {"data": {"children": listing}}])
+
+    async def scenario():
+        client = make_client(handler)
+        return await client.get_post_content("p1", "uft", deep=True)
+
+    comments = asyncio.run(scenario())
+    assert [c.id for c in comments] == ["a", "m1", "m2", "m3", "m4"]
+    assert morechildren_batches == [["m1", "m2"], ["m3", "m4"]]
+    assert all(c.parent_id == "t1_a" and c.depth == 1 for c in comments[1:])
+
+def test_deep_fetch_stops_expanding_at_the_comment_cap():
+    morechildren_calls = []
+
+    def handler(request):
+        if request.url.path == "/api/v1/access_token":
+            return httpx.Response(200, json={"access_token": "token-1", "expires_in": 3600})
+        if request.url.path == "/api/morechildren":
+            morechildren_calls.append(request)
+        listing = [t1("a", "t3_p1", 0), t1("b", "t3_p1", 0), more("m1", depth=0)]
+        return httpx.Response(200, json=[{}, {"data": {"children": listing}}])
+
+    async def scenario():
+        client = make_client(handler)
+        return await client._get_comment_tree("p1", "uft", 100, max_comments=2)
+
+    assert [c.id for c in asyncio.run(scenario())] == ["a", "b"]
+    assert morechildren_calls == []
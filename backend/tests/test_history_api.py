@@ -0,0 +1,46 @@
+import datetime
+
+import models
+
+def add_sessions(db, user, created_ats):
+    sessions = [models.ParameterHistory(user_id=user.id, parameters="{}", title=f"session {n}", created_at=created_at) for n, created_at in enumerate(created_ats)]
+    db.add_all(sessions)
+    db.commit()
+    return sessions
+
+def test_history_pages_follow_the_cursor_through_timestamp_ties(client, db, user, token):
+    start = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    # Two pairs share a timestamp; the id breaks the tie
+    add_sessions(db, user, [start, start + datetime.timedelta(minutes=1), start + datetime.timedelta(minutes=1), start + datetime.timedelta(minutes=2), start + datetime.timedelta(minutes=2)])
+    headers = {"Authorization": f"Bearer {token}"}
+
+    titles, cursor, pages = [], None, 0
+    while True:
+        response = client.get("/api/history", params={"limit": 2, **({"cursor": cursor} if cursor else {})}, headers=headers)
+        assert response.status_code == 200
+        titles += [item["title"] for item in response.json()]
+        pages += 1
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert titles == ["session 4", "session 3", "session 2", "session 1", "session 0"]
+    assert pages == 3
+
+    assert client.get("/api/history", params={"cursor": "not-a-cursor"}, headers=headers).status_code == 400
+
+def test_history_polls_get_304_until_the_list_changes(client, db, user, token):
+    add_sessions(db, user, [datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)])
+    headers = {"Authorization": f"Bearer {token}"}
+    first = client.get("/api/history", headers=headers)
+    etag, last_modified = first.headers["ETag"], first.headers["Last-Modified"]
+
+    not_modified = client.get("/api/history", headers={**headers, "If-None-Match": etag})
+    assert not_modified.status_code == 304 and not_modified.content == b""
+    assert client.get("/api/history", headers={**headers, "If-Modified-Since": last_modified}).status_code == 304
+
+    session = db.query(models.ParameterHistory).one()
+    session.title = "renamed"
+    db.commit()
+    changed = client.get("/api/history", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200 and changed.json()[0]["title"] == "renamed"
+    assert changed.headers["ETag"] != etag
@@ -0,0 +1,82 @@
+import asyncio
+
+import history_writer as history_writer_module
+import models
+import schemas
+from history_writer import HistoryWriter
+
+def session_params(title="r/uft - bird course"):
+    return schemas.ParameterHistoryCreate(parameters="{}", title=title)
+
+def test_rows_are_group_committed_and_reported(db, user):
+    async def scenario():
+        writer = HistoryWriter()
+        committed = []
+        writer.on_commit(committed.extend)
+        session = writer.add_parameter_history(user.id, session_params())
+        writer.add_analysis_job(user.id, session.session_uuid, owner_instance="worker-1")
+        writer.add_chat_history(user.id, "Initial analysis", '{"analysis": "ok"}', session_uuid=session.session_uuid)
+        await writer.flush()
+        assert [kind for kind, _ in committed] == ["parameter_history", "analysis_job", "chat_history"]
+        assert writer.stats() == {"pending": 0, "rows_written": 3, "flushes": 1}
+        return session.session_uuid
+
+    session_uuid = asyncio.run(scenario())
+    stored = db.query(models.ParameterHistory).filter_by(session_uuid=session_uuid).one()
+    chat = db.query(models.ChatHistory).one()
+    assert chat.parameter_history_id == stored.id
+    assert db.query(models.AnalysisJob).one().parameter_history_id == stored.id
+
+def test_a_bad_row_is_dropped_without_its_neighbours(db, user):
+    async def scenario():
+        writer = HistoryWriter()
+        session = writer.add_parameter_history(user.id, session_params())
+        writer.add_chat_history(None, "bad: user_id is required", "{}")
+        writer.add_chat_history(user.id, "good", "{}", session_uuid=session.session_uuid)
+        await writer.close()
+        assert writer.stats()["pending"] == 0
+
+    asyncio.run(scenario())
+    assert [chat.message for chat in db.query(models.ChatHistory)] == ["good"]
+    assert db.query(models.ParameterHistory).count() == 1
+
+def test_rows_of_a_failed_session_are_not_stored_as_orphans(db, user):
+    async def scenario():
+        writer = HistoryWriter()
+        session = writer.add_parameter_history(None, session_params())  # fails: user_id is required
+        writer.add_chat_history(user.id, "Initial analysis", "{}", session_uuid=session.session_uuid)
+        writer.add_analysis_job(user.id, session.session_uuid)
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert db.query(models.ChatHistory).count() == 0
+    assert db.query(models.AnalysisJob).count() == 0
+
+def test_close_writes_retried_rows_and_rows_queued_while_flushing(db, user, monkeypatch):
+    write_batch = history_writer_module._write_batch
+    failures = {"left": 2}  # the group write and the first row-by-row attempt
+
+    def flaky_write_batch(session, batch):
+        if failures["left"] and any(row.get("message") == "flaky" for _, row, _ in batch):
+            failures["left"] -= 1
+            raise RuntimeError("connection reset")
+        return write_batch(session, batch)
+
+    monkeypatch.setattr(history_writer_module, "_write_batch", flaky_write_batch)
+
+    async def scenario():
+        writer = HistoryWriter()
+
+        def queue_more(rows):
+            # e.g. a job status recorded while the shutdown flush is running
+            if not any(row.get("message") == "late" for _, row in rows):
+                writer.add_chat_history(user.id, "late", "{}")
+
+        writer.on_commit(queue_more)
+        writer.add_chat_history(user.id, "flaky", "{}")
+        writer.add_chat_history(user.id, "steady", "{}")
+        await writer.close()
+        assert writer.stats()["pending"] == 0
+
+    asyncio.run(scenario())
+    assert sorted(chat.message for chat in db.query(models.ChatHistory)) == ["flaky", "late", "steady"]
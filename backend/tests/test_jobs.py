@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+from api.jobs import JobRunner
+
+def test_final_frame_is_published_after_the_job_is_completed():
+    async def scenario():
+        statuses = []
+        seen_at_final = {}
+
+        async def on_status(chat_id, status, error):
+            statuses.append(status)
+
+        async def on_event(chat_id, seq, frame):
+            if json.loads(frame).get("status") == "Query completed":
+                job = runner.get(chat_id)
+                seen_at_final.update(done=job.done, status=job.status, stored=list(statuses))
+
+        async def run(publish):
+            await publish(json.dumps({"status": "step 1", "chat_id": "chat-1"}))
+            await publish(json.dumps({"status": "Query completed", "chat_id": "chat-1"}), final=True)
+            return {"analysis": "done"}
+
+        runner = JobRunner(on_status=on_status, on_event=on_event)
+        job = runner.submit("chat-1", 7, run)
+        assert await job.task == {"analysis": "done"}
+
+        # A client acting on the results (e.g. sending a follow-up) finds the job finished and stored
+        assert seen_at_final == {"done": True, "status": "completed", "stored": ["running", "completed"]}
+        assert [json.loads(frame)["status"] for frame in job.events] == ["step 1", "Query completed"]
+
+    asyncio.run(scenario())
+
+def test_final_frame_is_dropped_when_the_job_fails():
+    async def scenario():
+        async def run(publish):
+            await publish(json.dumps({"status": "Query completed"}), final=True)
+            raise RuntimeError("model unavailable")
+
+        runner = JobRunner()
+        job = runner.submit("chat-1", 7, run)
+        await job.task
+        assert job.status == "failed" and job.done
+        assert job.events == []
+
+    asyncio.run(scenario())
+
+def test_queued_jobs_wait_for_a_worker_and_replay_their_events():
+    async def scenario():
+        release = asyncio.Event()
+
+        async def slow(publish):
+            await publish(json.dumps({"status": "started"}))
+            await release.wait()
+
+        async def quick(publish):
+            await publish(json.dumps({"status": "quick"}))
+
+        runner = JobRunner(max_workers=1)
+        first = runner.submit("chat-1", 7, slow)
+        second = runner.submit("chat-2", 7, quick)
+        await asyncio.sleep(0.01)
+        assert (first.status, second.status) == ("running", "queued")
+        assert runner.stats()["queued"] == 1
+
+        release.set()
+        await asyncio.gather(first.task, second.task)
+        sent = []
+
+        async def send(frame):
+            sent.append(json.loads(frame)["status"])
+
+        job, next_seq = await runner.replay("chat-2", send)
+        assert job is second and next_seq == 2
+        assert sent[0].startswith("All analysis workers are busy") and sent[1] == "quick"
+        assert await runner.replay("unknown", send) == (None, 0)
+
+    asyncio.run(scenario())
+
+def test_follow_up_sent_on_the_results_frame_is_accepted(client, token, monkeypatch):
+    import api.process_query
+    import main
+
+    async def fake_pipeline(subreddit, keyword, question, limit, repeat_hours, repeat_minutes, callback, sort_order, **options):
+        await callback({"type": "corpus", "posts": [{"id": "p1", "title": "Bird course", "selftext": "take it", "comments": []}]})
+        return {"analysis": "Take the bird course.", "question": question}
+
+    async def fake_answer(query, snippets, analysis, on_delta=None):
+        return {"analysis": f"Answer to {query}", "cached": False}
+
+    monkeypatch.setattr(api.process_query, "process_reddit_query", fake_pipeline)
+    monkeypatch.setattr(main, "answer_follow_up", fake_answer)
+
+    with client.websocket_connect(f"/ws/query?token={token}") as websocket:
+        websocket.send_text(json.dumps({"type": "new_analysis", "data": {"subreddit": "uft", "keyword": "bird", "question": "Which course?"}}))
+        while True:
+            frame = json.loads(websocket.receive_text())
+            if frame.get("status") == "Query completed":
+                break
+        # Straight away, as the frontend does when the user types quickly
+        websocket.send_text(json.dumps({"type": "follow_up", "chat_id": frame["chat_id"], "data": {"query": "Why?"}}))
+        reply = json.loads(websocket.receive_text())
+        while reply.get("type") == "analysis_delta":
+            reply = json.loads(websocket.receive_text())
+
+    assert "error" not in reply, reply
+    assert reply["results"]["answer"] == "Answer to Why?"
@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+import pytest
+
+from api.ai_analysis import analyze_reddit_content_async, llm_cache_key
+from api.corpus import Comment, Post
+
+def corpus(*bodies):
+    return [Post(id="p1", title="Bird course?", selftext="Looking for one", comments=[Comment(id=f"c{n}", body=body, score=10 - n) for n, body in enumerate(bodies)])]
+
+def test_identical_requests_are_answered_from_the_cache(fake_openai):
+    async def scenario():
+        first = await analyze_reddit_content_async("Which course?", corpus("Take AST101"), mode="single")
+        deltas = []
+
+        async def on_delta(delta):
+            deltas.append(delta)
+
+        second = await analyze_reddit_content_async("Which course?", corpus("Take AST101"), on_delta=on_delta, mode="single")
+        changed = await analyze_reddit_content_async("Which course?", corpus("Take AST101", "Or GGR100"), mode="single")
+        return first, second, deltas, changed
+
+    first, second, deltas, changed = asyncio.run(scenario())
+    assert (first["cached"], second["cached"], changed["cached"]) == (False, True, False)
+    assert second["analysis"] == first["analysis"] == "The bird course is the easy one."
+    assert deltas == [first["analysis"]]  # a hit is replayed as one delta
+    assert len(fake_openai.requests) == 2  # the changed corpus is a different request
+
+def test_cache_key_covers_the_prompts_and_sampling():
+    key = llm_cache_key("gpt-4o", "system", "user", temperature=0.5, max_tokens=800)
+    assert key == llm_cache_key("gpt-4o", "system", "user", max_tokens=800, temperature=0.5)
+    assert key != llm_cache_key("gpt-4o", "system", "user ", temperature=0.5, max_tokens=800)  # verbatim, unlike make_cache_key
+    assert key != llm_cache_key("gpt-4o", "system", "user", temperature=0.2, max_tokens=800)
+
+def test_failed_completions_are_not_cached(fake_openai):
+    def unavailable(request):
+        raise RuntimeError("model unavailable")
+
+    fake_openai.reply = unavailable
+
+    async def scenario():
+        failed = await analyze_reddit_content_async("Which course?", corpus("Take AST101"), mode="single")
+        fake_openai.reply = "Recovered."
+        retried = await analyze_reddit_content_async("Which course?", corpus("Take AST101"), mode="single")
+        return failed, retried
+
+    failed, retried = asyncio.run(scenario())
+    assert failed["analysis"] is None
+    assert retried == {**retried, "analysis": "Recovered.", "cached": False}
+
+@pytest.mark.skipif(os.getenv("LLM_CACHE_PATH") is not None, reason="LLM_CACHE_PATH is set in this environment")
+def test_disk_tier_is_opt_in():
+    import api.ai_analysis
+    assert api.ai_analysis.llm_cache.disk_store is None
@@ -0,0 +1,53 @@
+import asyncio
+
+import api.ai_analysis as ai_analysis
+from api.corpus import Comment, Post
+
+def long_posts():
+    return [
+        Post(id=f"p{n}", title=f"Thread {n}", comments=[Comment(id=f"p{n}c{m}", body=f"comment {m} " * 30, score=m) for m in range(8)])
+        for n in range(3)
+    ]
+
+def test_map_summaries_are_reduced_and_cached(monkeypatch, fake_openai):
+    monkeypatch.setattr(ai_analysis, "MAP_CHUNK_TOKENS", 200)
+    fake_openai.reply = lambda request: "SUMMARY" if request["messages"][0]["content"] == ai_analysis.MAP_SYSTEM_PROMPT else "Merged answer."
+    progress = []
+
+    async def on_progress(status):
+        progress.append(status)
+
+    first = asyncio.run(ai_analysis.analyze_reddit_content_map_reduce("Which thread?", long_posts(), on_progress=on_progress))
+    chunks = first["packing"]["map_chunks"]
+    assert chunks > 3  # every post was split
+    assert first["analysis"] == "Merged answer."
+    assert (first["map_cached"], len(progress)) == (0, chunks)
+    assert set(first["packing"]) == {"map_chunks", "map_cached", "map_tokens", "reduce_prompt_tokens"}
+    reduce_prompt = fake_openai.requests[-1]["messages"][1]["content"]
+    assert "--- POST 1: Thread 0 (part 1/" in reduce_prompt and "SUMMARY" in reduce_prompt
+
+    # A different question reuses every map summary and only runs a new reduce call
+    calls = len(fake_openai.requests)
+    second = asyncio.run(ai_analysis.analyze_reddit_content_map_reduce("Another question?", long_posts()))
+    assert second["map_cached"] == chunks
+    assert len(fake_openai.requests) == calls + 1
+
+def test_failed_map_chunks_are_left_out(monkeypatch, fake_openai):
+    monkeypatch.setattr(ai_analysis, "MAP_CHUNK_TOKENS", 200)
+
+    def reply(request):
+        if "Thread 1" in request["messages"][1]["content"] and request["messages"][0]["content"] == ai_analysis.MAP_SYSTEM_PROMPT:
+            raise RuntimeError("rate limited")
+        return "Merged answer."
+
+    fake_openai.reply = reply
+    outcome = asyncio.run(ai_analysis.analyze_reddit_content_map_reduce("Which thread?", long_posts()))
+    assert outcome["analysis"] == "Merged answer."
+    assert "Thread 1" not in fake_openai.requests[-1]["messages"][1]["content"]
+
+def test_auto_mode_switches_only_for_large_corpora(monkeypatch, fake_openai):
+    monkeypatch.setattr(ai_analysis, "MAP_CHUNK_TOKENS", 200)
+    small = asyncio.run(ai_analysis.analyze_reddit_content_async("Which thread?", long_posts()[:1], token_budget=100_000))
+    assert small["mode"] == "single"
+    large = asyncio.run(ai_analysis.analyze_reddit_content_async("Which thread?", long_posts(), token_budget=150))
+    assert large["mode"] == "map_reduce" and large["packing"]["map_chunks"] > 3
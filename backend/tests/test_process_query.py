@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import api.process_query
+from api.corpus import Comment, Post
+from api.process_query import process_reddit_query
+
+class FakeReddit:
+    """
+    Stands in for the shared RedditClient: each post's comments take `delays[post_id]` seconds.
+    """
+
+    def __init__(self, delays):
+        self.delays = delays
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.cancelled = []
+
+    async def search_subreddit(self, subreddit, keyword, limit, sort_order="hot", on_wait=None):
+        return [Post(id=post_id, title=f"Post {post_id}", permalink=f"/r/{subreddit}/comments/{post_id}/") for post_id in self.delays]
+
+    async def get_post_content(self, post_id, subreddit, on_wait=None, deep=False):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delays[post_id])
+        except asyncio.CancelledError:
+            self.cancelled.append(post_id)
+            raise
+        finally:
+            self.in_flight -= 1
+        return [Comment(id=f"{post_id}-c", body=f"about {post_id}", created_utc=1.0)]
+
+@pytest.fixture
+def fake_analysis(monkeypatch):
+    analyzed = []
+
+    async def analyze(question, posts, on_delta=None, mode="auto", on_progress=None):
+        analyzed.append([post["id"] for post in posts])
+        return {"analysis": "summary", "cached": False, "packing": {}, "mode": "single"}
+
+    monkeypatch.setattr(api.process_query, "analyze_reddit_content_async", analyze)
+    return analyzed
+
+def test_comments_are_fetched_concurrently_under_the_cap(monkeypatch, fake_analysis):
+    reddit = FakeReddit({"a": 0.03, "b": 0.01, "c": 0.02, "d": 0.01})
+    monkeypatch.setattr(api.process_query, "get_reddit_client", lambda: reddit)
+    frames = []
+
+    async def collect(frame):
+        frames.append(frame)
+
+    results = asyncio.run(process_reddit_query("uft", "bird", "q", 4, 0, 0, collect, comment_concurrency=2))
+    assert reddit.max_in_flight == 2
+    assert fake_analysis == [["a", "b", "c", "d"]]  # search order, whatever order fetches finished in
+    assert results["total_comments"] == 4
+    assert results["fetch_stats"]["concurrency"] == 2
+    assert results["post_urls"][0] == "https://www.reddit.com/r/uft/comments/a/"
+    batches = [frame for frame in frames if isinstance(frame, dict) and frame.get("type") == "comment_batch"]
+    assert sum(len(frame["comments"]) for frame in batches) == 4  # batch is the default stream mode
+
+def test_pending_fetches_are_cancelled_when_streaming_fails(monkeypatch, fake_analysis):
+    reddit = FakeReddit({"fast": 0.0, "slow-1": 5, "slow-2": 5})
+    monkeypatch.setattr(api.process_query, "get_reddit_client", lambda: reddit)
+
+    async def closed_socket(frame):
+        if isinstance(frame, dict) and frame.get("type") == "comment":
+            raise ConnectionError("socket closed")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await process_reddit_query("uft", "bird", "q", 3, 0, 0, closed_socket, stream_mode="comment")
+        await asyncio.sleep(0)  # let the cancellations land
+
+    asyncio.run(scenario())
+    assert sorted(reddit.cancelled) == ["slow-1", "slow-2"]
+    assert fake_analysis == []
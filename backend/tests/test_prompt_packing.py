@@ -0,0 +1,50 @@
+import time
+
+import pytest
+
+import api.prompt_packing as prompt_packing
+from api.corpus import Comment, Post
+
+@pytest.fixture
+def estimated_tokens(monkeypatch):
+    # The ~4 characters per token estimate, whether or not tiktoken can load here
+    monkeypatch.setattr(prompt_packing, "_encoding", None)
+    monkeypatch.setattr(prompt_packing, "_encoding_failed", True)
+
+def test_tokenizer_load_failure_falls_back_to_the_estimate(monkeypatch):
+    class BrokenTiktoken:
+        @staticmethod
+        def encoding_for_model(model):
+            raise OSError("no network to download the encoding")
+
+    monkeypatch.setattr(prompt_packing, "tiktoken", BrokenTiktoken)
+    monkeypatch.setattr(prompt_packing, "_encoding", None)
+    monkeypatch.setattr(prompt_packing, "_encoding_failed", False)
+    assert prompt_packing.get_encoding() is None
+    assert prompt_packing._encoding_failed  # remembered: not retried on every count
+    assert prompt_packing.count_tokens("x" * 40) == 10
+    assert prompt_packing.truncate_to_tokens("x" * 40, 5) == "x" * 20 + "..."
+
+def test_packing_keeps_the_best_comments_within_the_budget(estimated_tokens):
+    now = time.time()
+    posts = [
+        Post(id="p1", title="Bird course?", comments=[
+            Comment(id="low", body="meh " * 60, score=1, created_utc=now - 86400 * 365),
+            Comment(id="top", body="AST101 is great " * 5, score=500, created_utc=now - 3600),
+        ]),
+        Post(id="p2", title="Easy electives", comments=[Comment(id="mid", body="GGR100 " * 5, score=50, created_utc=now - 3600)]),
+    ]
+    content, stats = prompt_packing.pack_reddit_content(posts, token_budget=100)
+    assert stats["tokens_used"] <= 100
+    assert "AST101" in content and "GGR100" in content and "meh" not in content
+    assert (stats["comments_included"], stats["comments_dropped"]) == (2, 1)
+    assert stats["tokenizer"] == "estimate"
+    assert content.index("POST 1") < content.index("POST 2")  # posts stay in search order
+
+def test_chunks_repeat_the_header_and_respect_the_budget(estimated_tokens):
+    post = Post(id="p1", title="Bird course?", comments=[Comment(id=f"c{n}", body="word " * 40, score=n) for n in range(6)])
+    chunks = prompt_packing.chunk_post(post, chunk_budget=150)
+    assert len(chunks) > 1
+    assert all(chunk.startswith("--- POST: Bird course? ---") for chunk in chunks)
+    assert all(prompt_packing.count_tokens(chunk) <= 150 for chunk in chunks)
+    assert prompt_packing.chunk_post(Post(id="p2", title="Empty"), 150) == ["--- POST: Empty ---\nPost content: \n\nComments:\n"]
@@ -0,0 +1,54 @@
+import asyncio
+
+import api.rate_limit
+from api.rate_limit import RedditRateLimiter
+
+def test_slow_wait_callback_does_not_hold_up_other_requests():
+    async def scenario():
+        limiter = RedditRateLimiter(rate=1000, burst=1)
+        limiter.pause(5.0)  # quota exhausted: the next caller has a reportable wait
+        stalled_client = asyncio.Event()
+
+        async def slow_report(queue_depth, wait_seconds):
+            await stalled_client.wait()  # e.g. a backpressured socket
+
+        reporting = asyncio.create_task(limiter.acquire(on_wait=slow_report))
+        await asyncio.sleep(0)
+        limiter._paused_until = 0  # the window resets
+        limiter.tokens = 1
+        # Another request goes out while the first caller is still stuck reporting
+        await asyncio.wait_for(limiter.acquire(), timeout=0.5)
+        stalled_client.set()
+        await asyncio.wait_for(reporting, timeout=0.5)
+
+    asyncio.run(scenario())
+
+def test_expected_wait_is_reported_once_before_queueing(monkeypatch):
+    monkeypatch.setattr(api.rate_limit, "WAIT_REPORT_THRESHOLD", 0.01)
+
+    async def scenario():
+        limiter = RedditRateLimiter(rate=1000, burst=1)
+        limiter.pause(0.05)
+        reports = []
+
+        async def report(queue_depth, wait_seconds):
+            reports.append((queue_depth, wait_seconds))
+
+        waited = await limiter.acquire(on_wait=report)
+        assert len(reports) == 1 and reports[0][0] == 1 and reports[0][1] > 0.01
+        assert waited >= 0.04
+        assert limiter.stats()["throttled_requests"] == 1
+
+    asyncio.run(scenario())
+
+def test_headers_spread_the_remaining_quota_over_the_window():
+    limiter = RedditRateLimiter()
+    limiter.update_from_headers({"x-ratelimit-remaining": "30", "x-ratelimit-reset": "60"})
+    assert limiter.rate == 0.5
+    assert (limiter.remaining, limiter.reset_in) == (30, 60)
+
+    limiter.update_from_headers({"x-ratelimit-remaining": "0", "x-ratelimit-reset": "5"})
+    assert limiter.tokens == 0 and limiter._time_until_token() > 4
+
+    limiter.update_from_headers({})  # no headers: left as is
+    assert limiter.remaining == 0
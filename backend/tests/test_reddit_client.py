@@ -0,0 +1,68 @@
+import asyncio
+
+import httpx
+import pytest
+
+import api.reddit_fetch
+from api.rate_limit import RedditRateLimiter
+from api.reddit_fetch import RedditClient
+
+def search_listing(*titles):
+    return {"data": {"children": [{"kind": "t3", "data": {"id": f"p{n}", "title": title, "permalink": f"/r/uft/comments/p{n}/"}} for n, title in enumerate(titles)]}}
+
+@pytest.fixture(autouse=True)
+def reddit_credentials(monkeypatch):
+    monkeypatch.setattr(api.reddit_fetch, "CLIENT_ID", "client-id")
+    monkeypatch.setattr(api.reddit_fetch, "CLIENT_SECRET", "client-secret")
+
+def make_client(handler):
+    client = RedditClient(retry_backoff=0)
+    client._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    client.rate_limiter = RedditRateLimiter(rate=1000, burst=100)
+    return client
+
+def token_response():
+    return httpx.Response(200, json={"access_token": "token-1", "expires_in": 3600})
+
+def test_search_retries_server_errors_and_serves_repeats_from_cache():
+    calls = []
+
+    def handler(request):
+        if request.url.path == "/api/v1/access_token":
+            return token_response()
+        calls.append(request)
+        if len(calls) == 1:
+            return httpx.Response(503)
+        return httpx.Response(200, json=search_listing("Bird course?", "Exam tips"))
+
+    async def scenario():
+        client = make_client(handler)
+        posts = await client.search_subreddit("uft", "bird", 10)
+        again = await client.search_subreddit("UfT", " Bird ", 10)  # same query, normalized
+        await client.aclose()
+        return posts, again
+
+    posts, again = asyncio.run(scenario())
+    assert [post["title"] for post in posts] == ["Bird course?", "Exam tips"]
+    assert again == posts
+    assert len(calls) == 2  # one 503, one success; the repeat never left the process
+    assert calls[-1].headers["Authorization"] == "bearer token-1"
+
+def test_search_failure_returns_none():
+    searches = []
+
+    def handler(request):
+        if request.url.path == "/api/v1/access_token":
+            return token_response()
+        searches.append(request)
+        return httpx.Response(404)
+
+    async def scenario():
+        client = make_client(handler)
+        try:
+            return await client.search_subreddit("uft", "bird", 10)
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario()) is None
+    assert len(searches) == 1  # 4xx responses are not retried
@@ -0,0 +1,30 @@
+import crud
+import models
+from api.refresh import MIN_REFRESH_INTERVAL, refresh_interval_seconds
+
+def test_refresh_interval_is_clamped_or_off():
+    assert refresh_interval_seconds(0, 0) is None
+    assert refresh_interval_seconds(0, 1) == MIN_REFRESH_INTERVAL
+    assert refresh_interval_seconds(2, 30) == 2 * 3600 + 30 * 60
+
+def test_refresh_numbers_only_the_new_posts(db, user):
+    session = models.ParameterHistory(user_id=user.id, parameters="{}")
+    db.add(session)
+    db.commit()
+    crud.save_session_corpus(db, session.id, "uft", [{"id": "p1", "title": "first", "comments": []}, {"id": "p2", "title": "second", "comments": []}])
+
+    # A refresh: p2 got a new comment, p3 is new
+    crud.save_session_corpus(
+        db, session.id, "uft",
+        [{"id": "p2", "title": "second", "comments": [{"id": "c1", "body": "update"}]}, {"id": "p3", "title": "third", "comments": []}],
+        start_position=2, linked_post_ids={"p1", "p2"},
+    )
+    positions = (
+        db.query(models.SessionPost.reddit_post_id, models.SessionPost.position)
+        .filter_by(parameter_history_id=session.id)
+        .order_by(models.SessionPost.position)
+        .all()
+    )
+    assert positions == [("p1", 0), ("p2", 1), ("p3", 2)]
+    corpus = crud.get_session_corpus(db, parameter_history_id=session.id)
+    assert [comment["id"] for comment in corpus[1]["comments"]] == ["c1"]
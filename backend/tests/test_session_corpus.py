@@ -0,0 +1,45 @@
+import json
+
+import crud
+import models
+import schemas
+
+def new_session(db, user):
+    return crud.create_parameter_history(db, user.id, schemas.ParameterHistoryCreate(parameters=json.dumps({"subreddit": "uft"})))
+
+def post(post_id, comments, score=10):
+    return {"id": post_id, "title": f"Post {post_id}", "score": score, "permalink": f"/r/uft/comments/{post_id}/", "comments": comments}
+
+def comment(comment_id, score):
+    return {"id": comment_id, "body": f"body of {comment_id}", "score": score, "author": "a", "depth": 0}
+
+def test_corpus_round_trips_in_search_order_with_best_comments_first(db, user):
+    session = new_session(db, user)
+    crud.save_session_corpus(db, session.id, "uft", [
+        post("p2", [comment("c1", 1), comment("c2", 9)]),
+        post("p1", []),
+        {"title": "no id, skipped", "comments": []},
+    ])
+    corpus = crud.get_session_corpus(db, session.id)
+    assert [stored["id"] for stored in corpus] == ["p2", "p1"]
+    assert [stored["id"] for stored in corpus[0]["comments"]] == ["c2", "c1"]
+    assert corpus[0]["permalink"] == "/r/uft/comments/p2/"
+    assert crud.get_session_corpus(db, new_session(db, user).id) == []
+
+def test_sessions_sharing_a_post_keep_their_own_comments(db, user):
+    first, second = new_session(db, user), new_session(db, user)
+    crud.save_session_corpus(db, first.id, "uft", [post("p1", [comment("c1", 5)])])
+    crud.save_session_corpus(db, second.id, "uft", [post("p1", [comment("c2", 7)], score=99)])
+
+    assert db.query(models.RedditPost).count() == 1  # deduplicated on the Reddit id
+    assert [c["id"] for c in crud.get_session_corpus(db, first.id)[0]["comments"]] == ["c1"]
+    assert [c["id"] for c in crud.get_session_corpus(db, second.id)[0]["comments"]] == ["c2"]
+    assert crud.get_session_corpus(db, first.id)[0]["score"] == 99  # refreshed by the later fetch
+
+def test_refresh_appends_only_new_posts_after_the_linked_ones(db, user):
+    session = new_session(db, user)
+    crud.save_session_corpus(db, session.id, "uft", [post("p1", []), post("p2", [])])
+    crud.save_session_corpus(db, session.id, "uft", [post("p3", []), post("p1", [comment("c1", 1)])], start_position=2, linked_post_ids={"p1", "p2"})
+    corpus = crud.get_session_corpus(db, session.id)
+    assert [stored["id"] for stored in corpus] == ["p1", "p2", "p3"]
+    assert [c["id"] for c in corpus[0]["comments"]] == ["c1"]
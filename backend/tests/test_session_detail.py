@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import crud
+import main
+import models
+import schemas
+
+def new_session(db, user):
+    return crud.create_parameter_history(db, user.id, schemas.ParameterHistoryCreate(parameters=json.dumps({"subreddit": "uft"}), title="Bird courses"))
+
+def test_detail_is_served_from_cache_until_a_chat_row_is_added(client, db, user, token):
+    session = new_session(db, user)
+    crud.create_chat_history(db, user.id, "Which course?", json.dumps({"analysis": "AST101"}), parameter_history_id=session.id)
+    headers = {"Authorization": f"Bearer {token}"}
+    url = f"/api/history/{session.session_uuid}"
+
+    first = client.get(url, headers=headers)
+    assert first.status_code == 200
+    assert [entry["message"] for entry in first.json()["chat_log"]] == ["Which course?"]
+    assert json.loads(first.json()["chat_log"][0]["response"]) == {"analysis": "AST101"}
+
+    hits = main.session_detail_cache.hits
+    assert client.get(url, headers=headers).content == first.content
+    assert main.session_detail_cache.hits == hits + 1
+
+    # A row written by another worker bypasses this worker's invalidation; the version check catches it
+    crud.create_chat_history(db, user.id, "And an easy one?", json.dumps({"analysis": "GGR100"}), parameter_history_id=session.id)
+    assert [entry["message"] for entry in client.get(url, headers=headers).json()["chat_log"]] == ["Which course?", "And an easy one?"]
+
+def test_without_responses_the_payloads_are_left_out(client, db, user, token):
+    session = new_session(db, user)
+    crud.create_chat_history(db, user.id, "Which course?", json.dumps({"analysis": "AST101"}), parameter_history_id=session.id)
+    response = client.get(f"/api/history/{session.session_uuid}", params={"include_responses": "false"}, headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["chat_log"][0]["response"] is None
+
+def test_history_writer_commits_invalidate_the_cached_detail(db, user):
+    session = new_session(db, user)
+    for include_responses in (True, False):
+        asyncio.run(main.session_detail_cache.set((session.session_uuid, include_responses), (1, b"{}")))
+    main.invalidate_session_details([("chat_history", {"parameter_session_uuid": session.session_uuid})])
+    assert asyncio.run(main.session_detail_cache.get((session.session_uuid, True))) is None
+    assert asyncio.run(main.session_detail_cache.get((session.session_uuid, False))) is None
+
+def test_unknown_and_foreign_sessions_are_refused(client, db, user, token):
+    other = models.User(email="other@example.com", name="Other", provider="google", provider_account_id="other-1")
+    db.add(other)
+    db.commit()
+    foreign = new_session(db, other)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert client.get("/api/history/no-such-session", headers=headers).status_code == 404
+    assert client.get(f"/api/history/{foreign.session_uuid}", headers=headers).status_code == 403
@@ -0,0 +1,51 @@
+import asyncio
+
+from api.ai_analysis import answer_follow_up
+from api.corpus import Comment, Post
+from api.session_index import BM25Index, SessionIndexStore, tokenize
+
+POSTS = [
+    Post(id="p1", title="Easy science credits", permalink="/r/uft/comments/p1/", comments=[
+        Comment(id="c1", body="AST101 is the bird course everyone takes", score=40, author="a"),
+        Comment(id="c2", body="Avoid CHM135 unless you like labs", score=12, author="b"),
+    ]),
+    Post(id="p2", title="Dining halls", selftext="Which residence has the best food?", comments=[
+        Comment(id="c3", body="Chestnut food is fine", score=3, author="c"),
+        Comment(id="c4", body="the", score=1),  # only stopwords: not indexed
+    ]),
+]
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What's the BEST course, for AST101?") == ["what's", "best", "course", "ast101"]
+    assert tokenize(None) == []
+
+def test_search_ranks_matching_snippets_with_post_metadata():
+    index = BM25Index(POSTS)
+    assert len(index.documents) == 5  # 2 posts + 3 comments with indexable terms
+    results = index.search("which bird course?")
+    assert results[0]["text"] == "AST101 is the bird course everyone takes"
+    assert results[0]["post_id"] == "p1" and results[0]["permalink"] == "/r/uft/comments/p1/"
+    assert results[0]["kind"] == "comment" and results[0]["relevance"] > 0
+    assert [result["relevance"] for result in results] == sorted((result["relevance"] for result in results), reverse=True)
+    assert index.search("food", k=1)[0]["post_id"] == "p2"
+    assert index.search("unrelated words") == []
+    assert BM25Index([]).search("anything") == []
+
+def test_store_evicts_the_least_recently_used_session():
+    store = SessionIndexStore(max_sessions=2)
+    store.put("a", POSTS)
+    asyncio.run(store.build("b", POSTS))
+    assert store.get("a") is not None  # "a" is now the most recently used
+    store.put("c", POSTS)
+    assert store.get("b") is None and store.get("a") is not None and store.get("c") is not None
+    store.discard("a")
+    assert store.get("a") is None
+
+def test_follow_up_sends_only_the_retrieved_snippets(fake_openai):
+    fake_openai.reply = "Take AST101."
+    snippets = BM25Index(POSTS).search("bird course", k=2)
+    outcome = asyncio.run(answer_follow_up("Which bird course?", snippets, previous_analysis="Earlier: AST101."))
+    assert outcome["analysis"] == "Take AST101."
+    prompt = fake_openai.requests[-1]["messages"][-1]["content"]
+    assert "AST101 is the bird course everyone takes" in prompt and "Earlier: AST101." in prompt
+    assert "Chestnut" not in prompt
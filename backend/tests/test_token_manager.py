@@ -0,0 +1,53 @@
+import asyncio
+
+from api.reddit_fetch import TokenManager
+
+def test_concurrent_callers_share_one_token_refresh():
+    async def scenario():
+        fetches = []
+
+        async def fetch_token():
+            fetches.append(1)
+            await asyncio.sleep(0.01)  # everyone else arrives while this POST is in flight
+            return {"access_token": f"token-{len(fetches)}", "expires_in": 3600}
+
+        manager = TokenManager(fetch_token, refresh_margin=60)
+        tokens = await asyncio.gather(*(manager.get_token() for _ in range(10)))
+        assert set(tokens) == {"token-1"} and len(fetches) == 1
+        assert await manager.get_token() == "token-1"  # still fresh: no refresh
+
+        # Concurrent 401s on the same stale token cause a single refresh
+        manager.invalidate("token-1")
+        manager.invalidate("token-1")
+        assert await manager.get_token() == "token-2"
+        manager.invalidate("token-1")  # a late 401 for the old token keeps the new one
+        assert await manager.get_token() == "token-2" and len(fetches) == 2
+
+    asyncio.run(scenario())
+
+def test_token_is_refreshed_ahead_of_its_expiry():
+    async def scenario():
+        fetches = []
+
+        async def fetch_token():
+            fetches.append(1)
+            return {"access_token": f"token-{len(fetches)}", "expires_in": 30}
+
+        manager = TokenManager(fetch_token, refresh_margin=60)  # expires within the margin
+        assert await manager.get_token() == "token-1"
+        assert await manager.get_token() == "token-2"
+
+    asyncio.run(scenario())
+
+def test_failed_refresh_returns_none_and_is_retried():
+    async def scenario():
+        responses = [None, {"access_token": "token-1"}]
+
+        async def fetch_token():
+            return responses.pop(0)
+
+        manager = TokenManager(fetch_token)
+        assert await manager.get_token() is None
+        assert await manager.get_token() == "token-1"  # default lifetime when expires_in is missing
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import asyncio
+import json
+
+import msgpack
+import pytest
+
+import main
+from api import wire
+
+class FakeWebSocket:
+    def __init__(self, subprotocols=(), query_params=None):
+        self.scope = {"subprotocols": list(subprotocols)}
+        self.query_params = query_params or {}
+        self.sent = []
+
+    async def accept(self, subprotocol=None):
+        self.accepted_subprotocol = subprotocol
+
+    async def send_text(self, message):
+        self.sent.append(message)
+
+    async def send_bytes(self, message):
+        self.sent.append(message)
+
+def test_negotiate_prefers_offered_subprotocols_then_the_query_parameter():
+    assert wire.negotiate(FakeWebSocket(["msgpack", "json"])) == ("msgpack", "msgpack")
+    assert wire.negotiate(FakeWebSocket(["chat.v9", "json"])) == ("json", "json")
+    assert wire.negotiate(FakeWebSocket(query_params={"protocol": "msgpack"})) == ("msgpack", None)
+    assert wire.negotiate(FakeWebSocket(query_params={"protocol": "xml"})) == ("json", None)
+
+def test_frame_with_embeds_preencoded_members():
+    results_json = wire.dumps({"analysis": "ok", "post_urls": ["https://www.reddit.com/r/uft/1"]})
+    frame = wire.frame_with({"status": "Query completed", "chat_id": "chat-1"}, results=results_json)
+    assert json.loads(frame) == {"status": "Query completed", "chat_id": "chat-1", "results": json.loads(results_json)}
+    assert json.loads(wire.frame_with({}, results="[1]")) == {"results": [1]}
+
+def test_dumps_falls_back_for_values_orjson_rejects():
+    assert json.loads(wire.dumps({"big": 2 ** 70})) == {"big": 2 ** 70}
+
+def test_decode_message_accepts_text_and_msgpack():
+    assert wire.decode_message({"text": '{"type": "attach"}'}) == {"type": "attach"}
+    assert wire.decode_message({"bytes": msgpack.packb({"type": "attach"})}) == {"type": "attach"}
+    with pytest.raises(ValueError):
+        wire.decode_message({})
+
+def test_a_frame_is_converted_to_msgpack_once_per_fan_out(monkeypatch):
+    conversions = []
+
+    def counting_to_msgpack(frame):
+        conversions.append(frame)
+        return msgpack.packb(json.loads(frame), use_bin_type=True)
+
+    monkeypatch.setattr(wire, "to_msgpack", counting_to_msgpack)
+
+    async def scenario():
+        manager = main.ConnectionManager()
+        sockets = [FakeWebSocket(), FakeWebSocket(), FakeWebSocket()]
+        for websocket, protocol in zip(sockets, ["msgpack", "msgpack", "json"]):
+            await manager.connect(websocket, user_id=7, protocol=protocol)
+        frame = json.dumps({"status": "Scheduled update", "chat_id": "chat-1"})
+        await manager.deliver({"scope": "user", "key": 7, "seq": None, "frame": frame})
+        await manager.deliver({"scope": "user", "key": 7, "seq": None, "frame": frame})
+        return sockets, frame
+
+    sockets, frame = asyncio.run(scenario())
+    assert len(conversions) == 2  # once per publish, not once per socket
+    assert msgpack.unpackb(sockets[0].sent[0]) == json.loads(frame)
+    assert sockets[0].sent == sockets[1].sent
+    assert sockets[2].sent == [frame, frame]
@@ -16,6 +16,7 @@ export interface ChatMessage {
   role: ChatRole;
   content: string;
   postUrls?: string[];
+  streaming?: boolean; // true while analysis_delta frames are still arriving
 }
 
 interface ChatWindowProps {
@@ -37,21 +37,44 @@ interface AnalysisResult {
   post_urls?: string[];
 }
 
+interface StreamedComment {
+  author?: string;
+  body?: string;
+  score?: number;
+  created_utc?: number;
+}
+
+interface StreamedPost {
+  id?: string;
+  title?: string;
+  author?: string;
+}
+
 interface WebSocketResponseData {
   status?: string;
   error?: string;
   results?: AnalysisResult;
-  type?: "comment";
-  post?: { id?: string; title?: string; author?: string };
-  comment?: {
-    author?: string;
-    body?: string;
-    score?: number;
-    created_utc?: number;
-  };
+  type?: "comment" | "comment_batch" | "analysis_delta";
+  post?: StreamedPost;
+  comment?: StreamedComment;
+  comments?: { post?: StreamedPost; comment?: StreamedComment }[];
+  delta?: string;
   chat_id?: string;
 }
 
+const formatCommentMessage = (
+  post: StreamedPost | undefined,
+  comment: StreamedComment
+): ChatMessage => {
+  const postTitle = post?.title || "a post";
+  const commentAuthor = comment.author || "Someone";
+  const commentBody = comment.body || "said something.";
+  return {
+    role: "system",
+    content: `💬 Comment from u/${commentAuthor} on "${postTitle}":\n"${commentBody}"`,
+  };
+};
+
 export default function Home() {
   const { data: session, status: sessionStatus } = useSession();
 
@@ -69,6 +92,8 @@ export default function Home() {
   const [history, setHistory] = useState<PageHistoryItem[]>([]);
   const [messages, setMessages] = useState<ChatMessage[]>([]);
   const [activeChatId, setActiveChatId] = useState<string | null>(null);
+  // Read by the socket handlers, which would otherwise see the chat id of the render that created them
+  const activeChatIdRef = useRef<string | null>(null);
   const [tempClientSideHistoryId, setTempClientSideHistoryId] = useState<
     string | null
   >(null);
@@ -130,6 +155,7 @@ export default function Home() {
   const handleHistorySelect = (item: ImportedHistoryItem) => {
     // This will be expanded in Phase 3 to fetch full data from backend
     setActiveChatId(item.id);
+    activeChatIdRef.current = item.id;
     // For now, populate from client-side item if available (partial data)
     setParams({
       subreddit: item.subreddit,
@@ -175,6 +201,7 @@ export default function Home() {
     setTempClientSideHistoryId(tempId);
 
     setActiveChatId(null); // Start with no active chat ID until backend confirms
+    activeChatIdRef.current = null;
     setTempClientSideHistoryId(null);
 
     if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
@@ -189,7 +216,10 @@ export default function Home() {
         keyword: formData.keyword,
         question: formData.question,
         limit: parseInt(formData.numberOfPosts),
+        repeatHours: parseInt(formData.repeatHours) || 0,
+        repeatMinutes: parseInt(formData.repeatMinutes) || 0,
         sort_order: formData.sortOrder,
+        stream_mode: "batch",
       };
 
       const ws = new WebSocket(
@@ -216,12 +246,19 @@ export default function Home() {
         try {
           const data: WebSocketResponseData = JSON.parse(event.data);
 
-          if (data.chat_id && !activeChatId) {
+          if (data.chat_id && !activeChatIdRef.current) {
             const backendChatId = data.chat_id;
+            activeChatIdRef.current = backendChatId;
             setActiveChatId(backendChatId);
           }
 
-          const currentChatIdForMessage = data.chat_id || activeChatId;
+          // Scheduled updates go to every socket of the user; only draw the open chat's
+          if (data.chat_id && data.chat_id !== activeChatIdRef.current) {
+            console.log("Ignoring message for another chat:", data.chat_id);
+            return;
+          }
+
+          const currentChatIdForMessage = data.chat_id || activeChatIdRef.current;
 
           if (data.status && typeof data.status === "string") {
             setMessages((prev) => [
@@ -242,22 +279,43 @@ export default function Home() {
               postUrls,
             };
 
-            setMessages((prev) => [...prev, newAssistantMessage]);
+            // Replace the message assembled from analysis_delta frames, if any
+            setMessages((prev) => [
+              ...prev.filter((message) => !message.streaming),
+              newAssistantMessage,
+            ]);
             setIsAnalysisLoading(false);
           }
 
+          if (data.type === "analysis_delta" && data.delta) {
+            const delta = data.delta;
+            setMessages((prev) => {
+              const last = prev[prev.length - 1];
+              if (last && last.streaming) {
+                return [
+                  ...prev.slice(0, -1),
+                  { ...last, content: last.content + delta },
+                ];
+              }
+              return [
+                ...prev,
+                { role: "assistant", content: delta, streaming: true },
+              ];
+            });
+          }
+
           if (data.type === "comment" && data.comment) {
-            const postTitle = data.post?.title || "a post";
-            const commentAuthor = data.comment?.author || "Someone";
-            const commentBody = data.comment?.body || "said something.";
-            const commentContent = `💬 Comment from u/${commentAuthor} on "${postTitle}":\n"${commentBody}"`;
-            const newSystemMessage: ChatMessage = {
-              role: "system",
-              content: commentContent,
-            };
+            const newSystemMessage = formatCommentMessage(data.post, data.comment);
             setMessages((prev) => [...prev, newSystemMessage]);
           }
 
+          if (data.type === "comment_batch" && data.comments) {
+            const batchMessages = data.comments
+              .filter((item) => item.comment)
+              .map((item) => formatCommentMessage(item.post, item.comment!));
+            setMessages((prev) => [...prev, ...batchMessages]);
+          }
+
           if (data.error && typeof data.error === "string") {
             setMessages((prev) => [
               ...prev,